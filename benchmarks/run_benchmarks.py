@@ -0,0 +1,384 @@
+"""
+Run Benchmarks
+--------------
+
+Time the main steps of the degree-day calculator on synthetic
+temperature grids (see synthetic), save the times to a history file,
+and compare them to a baseline run with the same settings. Everything is
+generated locally, so benchmarks can be run offline.
+
+Benchmarks
+    calc_degree_days_for_cell: a sample of pixels, one at a time
+    calc_grid_degree_days-<method>-<n>p: whole grid, for each method and
+        number of processes
+    fill_missing_by_interpolation: the hole pixels of the monthly grid
+    sort_snap_files: snap style file names for the record length
+    save_all_as_geotiff: tdd, fdd and roots grids
+
+Flags
+-----
+--rows: int
+    Optional, Default 64. Rows in synthetic grid
+--cols: int
+    Optional, Default 64. Columns in synthetic grid
+--years: int
+    Optional, Default 20. Years in synthetic record
+--coastal: float
+    Optional, Default 0.1. Fraction of pixels with near zero series
+--frost: float
+    Optional, Default 0.05. Fraction of pixels with permanent frost
+--holes: float
+    Optional, Default 0.05. Fraction of pixels with missing data
+--seed: int
+    Optional, Default 0. Random seed for synthetic data
+--processes: list
+    Optional, Default "1,2". Comma separated numbers of processes for
+    calc_grid_degree_days
+--methods: list
+    Optional, Default "spline,batch-spline". Comma separated methods for
+    calc_grid_degree_days
+--cell-sample: int
+    Optional, Default 50. Number of pixels for calc_degree_days_for_cell
+--repeat: int
+    Optional, Default 3. Times each benchmark is run, the fastest time is
+    kept
+--history: path
+    Optional, Default benchmarks/history.jsonl. File results are saved to
+--label: str
+    Optional. Label for this run, i.e. a version or commit
+--baseline: str
+    Optional. Label of the run to compare to. Defaults to the first run in
+    the history with the same settings
+--threshold: float
+    Optional, Default 0.2. A benchmark is a regression if it is slower
+    than the baseline by more than this fraction
+--no-save: bool
+    Optional, Default False. If True, results are not saved to the history
+
+Exits with status 1 if any benchmark is a regression.
+
+Example
+-------
+python benchmarks/run_benchmarks.py --rows=32 --cols=32 --label=v2.2.0
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+from datetime import datetime
+from tempfile import mkdtemp
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ddc')
+)
+from calc_degree_days import calc_degree_days_for_cell, calc_grid_degree_days
+from calc_degree_days import fallback_windows, fill_missing_by_interpolation
+from sort import sort_snap_files
+from __init__ import __version__
+from multigrids import TemporalGrid
+from multigrids.tools import get_raster_metadata
+from osgeo import gdal, osr
+from spicebox import CLILib
+
+from synthetic import synthetic_dataset
+
+DEFAULT_HISTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'history.jsonl'
+)
+
+def best_time (function, repeat, setup = None):
+    """Fastest of repeat runs of function
+
+    Parameters
+    ----------
+    function: function
+        called with the value returned by setup
+    repeat: int
+    setup: function, optional
+        called before each run, not timed
+
+    Returns
+    -------
+    float
+        seconds
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = perf_counter()
+        function(arg)
+        times.append(perf_counter() - start)
+    return min(times)
+
+def copy_grid (grid):
+    """copy a TemporalGrid in to a new grid"""
+    rows, cols = grid.config['grid_shape']
+    new = TemporalGrid(
+        rows, cols, grid.config['num_timesteps'],
+        start_timestep = grid.config['start_timestep'],
+        delta_timestep = grid.config['delta_timestep'], mode = 'w+'
+    )
+    new.grids[:] = grid.grids
+    return new
+
+def write_reference_tiff (path, rows, cols):
+    """Write a tiff to get raster metadata for the geotiff export from"""
+    dataset = gdal.GetDriverByName('GTiff').Create(
+        path, cols, rows, 1, gdal.GDT_Float32
+    )
+    dataset.SetGeoTransform((0, 1000, 0, 0, 0, -1000))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3338)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.GetRasterBand(1).WriteArray(np.zeros((rows, cols)))
+    dataset = None
+
+def run_benchmarks (config, work_dir):
+    """Run all benchmarks
+
+    Parameters
+    ----------
+    config: dict
+        settings, see flags
+    work_dir: path
+        directory for synthetic data and outputs
+
+    Returns
+    -------
+    dict
+        seconds for each benchmark
+    """
+    repeat = config['repeat']
+    data = synthetic_dataset(
+        work_dir, config['years'], config['rows'], config['cols'],
+        {k: config[k] for k in ['coastal', 'frost', 'holes']}, config['seed']
+    )
+    monthly = data['monthly-temperature']
+    quiet = lambda: {'Element Messages': [], 'verbose': 0}
+    results = {}
+
+    ## calc_degree_days_for_cell needs a complete series
+    complete = ~np.isnan(np.array(monthly.grids)).any(axis=0)
+    valid = np.argwhere(complete.reshape(monthly.config['grid_shape']))
+    sample = valid[np.random.default_rng(config['seed']).permutation(
+        len(valid)
+    )[:config['cell_sample']]]
+    windows = fallback_windows(monthly)
+    method_map = np.full(monthly.config['grid_shape'], np.nan)
+    def cells (_):
+        for index in sample:
+            calc_degree_days_for_cell(
+                tuple(index), monthly, data['tdd'], data['fdd'],
+                data['roots'], method_map, windows = windows
+            )
+    results['calc_degree_days_for_cell'] = best_time(cells, repeat)
+    print('calc_degree_days_for_cell: %i pixels' % len(sample))
+
+    for method in config['methods']:
+        for num_process in config['processes']:
+            name = 'calc_grid_degree_days-%s-%ip' % (method, num_process)
+            def grid (logging_dir):
+                calc_grid_degree_days(
+                    data, start = -1, num_process = num_process,
+                    log = quiet(), logging_dir = logging_dir, method = method
+                )
+            results[name] = best_time(
+                grid, repeat, lambda: mkdtemp(dir = work_dir)
+            )
+            print(name)
+
+    holes = np.isnan(
+        np.array(monthly.grids).reshape(-1, *monthly.config['grid_shape'])
+    ).any(axis=0)
+    results['fill_missing_by_interpolation'] = best_time(
+        lambda grid: fill_missing_by_interpolation(grid, holes, quiet()),
+        repeat, lambda: copy_grid(monthly)
+    )
+    print('fill_missing_by_interpolation: %i pixels' % holes.sum())
+
+    names = [
+        'tas_mean_C_%02i_%04i.tif' % (month, 1901 + year)
+            for year in range(config['years']) for month in range(1, 13)
+    ]
+    np.random.default_rng(config['seed']).shuffle(names)
+    results['sort_snap_files'] = best_time(
+        lambda _: sort_snap_files(names), repeat
+    )
+    print('sort_snap_files: %i files' % len(names))
+
+    reference = os.path.join(work_dir, 'reference.tif')
+    write_reference_tiff(reference, config['rows'], config['cols'])
+    raster_metadata = get_raster_metadata(reference)
+    for key in ['tdd', 'fdd', 'roots']:
+        data[key].config['raster_metadata'] = raster_metadata
+    def export (out_dir):
+        for key in ['tdd', 'fdd', 'roots']:
+            data[key].save_all_as_geotiff(os.path.join(out_dir, key))
+    def export_dir ():
+        out_dir = mkdtemp(dir = work_dir)
+        for key in ['tdd', 'fdd', 'roots']:
+            os.makedirs(os.path.join(out_dir, key))
+        return out_dir
+    results['save_all_as_geotiff'] = best_time(export, repeat, export_dir)
+    print('save_all_as_geotiff')
+    return results
+
+def load_history (path):
+    """Load benchmark history
+
+    Parameters
+    ----------
+    path: path
+
+    Returns
+    -------
+    list
+        records, oldest first
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r') as fd:
+        return [json.loads(line) for line in fd if line.strip()]
+
+def find_baseline (history, config, label = None):
+    """Find the baseline record for a run
+
+    Parameters
+    ----------
+    history: list
+    config: dict
+    label: str, optional
+        if provided the last record with this label is used, otherwise
+        the first record with the same config
+
+    Returns
+    -------
+    dict or None
+    """
+    if label:
+        matches = [r for r in history if r['label'] == label]
+        return matches[-1] if matches else None
+    matches = [r for r in history if r['config'] == config]
+    return matches[0] if matches else None
+
+def compare (results, baseline, threshold):
+    """Compare results to a baseline, and print a table
+
+    Parameters
+    ----------
+    results: dict
+    baseline: dict
+        baseline record
+    threshold: float
+
+    Returns
+    -------
+    list
+        names of benchmarks that regressed
+    """
+    regressions = []
+    print('%-45s %10s %10s %7s' % ('benchmark', 'baseline', 'current', 'ratio'))
+    for name, seconds in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('%-45s %10s %10.3f' % (name, '-', seconds))
+            continue
+        ratio = seconds / base if base > 0 else np.inf
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print('%-45s %10.3f %10.3f %7.2f %s' % (
+            name, base, seconds, ratio, flag
+        ))
+    return regressions
+
+def main ():
+    """run benchmarks utility"""
+    try:
+        arguments = CLILib.CLI({
+            '--rows': {'required': False, 'type': int, 'default': 64},
+            '--cols': {'required': False, 'type': int, 'default': 64},
+            '--years': {'required': False, 'type': int, 'default': 20},
+            '--coastal': {'required': False, 'type': float, 'default': 0.1},
+            '--frost': {'required': False, 'type': float, 'default': 0.05},
+            '--holes': {'required': False, 'type': float, 'default': 0.05},
+            '--seed': {'required': False, 'type': int, 'default': 0},
+            '--processes': {'required': False, 'type': str, 'default': '1,2'},
+            '--methods':
+                {
+                    'required': False, 'type': str,
+                    'default': 'spline,batch-spline'
+                },
+            '--cell-sample': {'required': False, 'type': int, 'default': 50},
+            '--repeat': {'required': False, 'type': int, 'default': 3},
+            '--history':
+                {'required': False, 'type': str, 'default': DEFAULT_HISTORY},
+            '--label': {'required': False, 'type': str, 'default': ''},
+            '--baseline': {'required': False, 'type': str},
+            '--threshold': {'required': False, 'type': float, 'default': 0.2},
+            '--no-save': {'required': False, 'type': bool, 'default': False},
+        })
+    except (CLILib.CLILibHelpRequestedError, CLILib.CLILibMandatoryError) as E:
+        print (E)
+        print(__doc__)
+        return 0
+
+    config = {
+        'rows': arguments['--rows'], 'cols': arguments['--cols'],
+        'years': arguments['--years'], 'seed': arguments['--seed'],
+        'coastal': arguments['--coastal'], 'frost': arguments['--frost'],
+        'holes': arguments['--holes'],
+        'processes': [int(p) for p in arguments['--processes'].split(',')],
+        'methods': arguments['--methods'].split(','),
+        'cell_sample': arguments['--cell-sample'],
+        'repeat': arguments['--repeat'],
+    }
+
+    work_dir = mkdtemp(prefix = 'ddc-benchmarks-')
+    cwd = os.getcwd()
+    try:
+        ## multigrids writes some temporary files to the working directory
+        os.chdir(work_dir)
+        results = run_benchmarks(config, work_dir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    record = {
+        'label': arguments['--label'],
+        'date': datetime.now().isoformat(timespec = 'seconds'),
+        'version': __version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.node(),
+        'config': config,
+        'results': results,
+    }
+    history = load_history(arguments['--history'])
+    baseline = find_baseline(history, config, arguments['--baseline'])
+
+    regressions = []
+    if baseline is None:
+        print('No baseline, results:')
+        for name, seconds in results.items():
+            print('%-45s %10.3f' % (name, seconds))
+    else:
+        print('Baseline: %s %s' % (baseline['label'], baseline['date']))
+        regressions = compare(results, baseline, arguments['--threshold'])
+
+    if not arguments['--no-save']:
+        with open(arguments['--history'], 'a') as fd:
+            fd.write(json.dumps(record) + '\n')
+
+    if regressions:
+        print('%i regressions' % len(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
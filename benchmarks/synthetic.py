@@ -0,0 +1,129 @@
+"""
+Synthetic
+---------
+
+Synthetic monthly temperature grids for benchmarks. Pixels are a mix of
+normal seasonal series and pathological cases:
+    coastal: mean near zero with a small annual cycle and noise, the
+        spline often has extra roots
+    frost: below zero all year (permanent frost), no thawing season
+    holes: no data (all months missing), or some missing months
+"""
+import os
+from datetime import datetime
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from multigrids import TemporalGrid
+
+DEFAULT_MIX = {'coastal': 0.1, 'frost': 0.05, 'holes': 0.05}
+
+def synthetic_temperatures (
+        num_years, rows, cols, mix = DEFAULT_MIX, seed = 0
+    ):
+    """Create synthetic monthly temperatures
+
+    Parameters
+    ----------
+    num_years: int
+    rows, cols: int
+        grid shape
+    mix: dict, Defaults to DEFAULT_MIX
+        fraction of pixels for each pathology, 'coastal', 'frost', and
+        'holes'. Half of the hole pixels have no data, the other half are
+        missing 10% of months
+    seed: int, Defaults to 0
+        random seed, the same seed gives the same temperatures
+
+    Returns
+    -------
+    temperatures: np.array
+        (timestep, row, col) float32 array
+    kinds: np.array
+        2d array of pixel kind, '' (normal), 'coastal', 'frost', or 'holes'
+    """
+    rng = np.random.default_rng(seed)
+    n_pixels = rows * cols
+    months = np.arange(num_years * 12)
+    cycle = np.sin(2 * np.pi * (months - 3.5) / 12)[:, np.newaxis]
+
+    mean = rng.normal(-4, 3, n_pixels)
+    amplitude = rng.uniform(10, 20, n_pixels)
+    noise = rng.uniform(0.5, 2, n_pixels)
+
+    kinds = np.full(n_pixels, '', dtype=object)
+    order = rng.permutation(n_pixels)
+    first = 0
+    for kind in ['coastal', 'frost', 'holes']:
+        count = int(round(mix.get(kind, 0) * n_pixels))
+        kinds[order[first:first + count]] = kind
+        first += count
+
+    coastal = kinds == 'coastal'
+    mean[coastal] = rng.normal(0, 0.5, coastal.sum())
+    amplitude[coastal] = rng.uniform(1, 3, coastal.sum())
+    noise[coastal] = rng.uniform(1, 2.5, coastal.sum())
+    frost = kinds == 'frost'
+    mean[frost] = rng.uniform(-25, -18, frost.sum())
+    amplitude[frost] = rng.uniform(5, 10, frost.sum())
+
+    temps = mean + amplitude * cycle + \
+        noise * rng.standard_normal((len(months), n_pixels))
+
+    holes = np.where(kinds == 'holes')[0]
+    empty, partial = holes[:len(holes) // 2], holes[len(holes) // 2:]
+    temps[:, empty] = np.nan
+    missing = rng.random((len(months), len(partial))) < 0.1
+    temps[:, partial] = np.where(missing, np.nan, temps[:, partial])
+
+    return (
+        temps.reshape(len(months), rows, cols).astype(np.float32),
+        kinds.reshape(rows, cols)
+    )
+
+def synthetic_dataset (
+        directory, num_years, rows, cols, mix = DEFAULT_MIX, seed = 0,
+        start_year = 1901
+    ):
+    """Create synthetic monthly temperature, and empty tdd, fdd and roots
+    TemporalGrids, like utility.utility does.
+
+    Parameters
+    ----------
+    directory: path
+        directory for grid files
+    num_years: int
+    rows, cols: int
+    mix: dict, Defaults to DEFAULT_MIX
+    seed: int, Defaults to 0
+    start_year: int, Defaults to 1901
+
+    Returns
+    -------
+    dict
+        'monthly-temperature', 'tdd', 'fdd', and 'roots' TemporalGrids, for
+        calc_degree_days.calc_grid_degree_days
+    """
+    temps, kinds = synthetic_temperatures(num_years, rows, cols, mix, seed)
+    data = {}
+    monthly = TemporalGrid(
+        rows, cols, num_years * 12,
+        start_timestep = datetime(start_year, 1, 1),
+        delta_timestep = relativedelta(months=1), mode = 'w+'
+    )
+    monthly.grids[:] = temps.reshape(num_years * 12, rows * cols)
+    monthly.save(os.path.join(directory, 'monthly-temperature.yml'))
+    data['monthly-temperature'] = monthly
+
+    for name, num_timesteps, start in [
+            ('tdd', num_years, start_year), ('fdd', num_years, start_year),
+            ('roots', num_years * 2, 0)
+        ]:
+        grid = TemporalGrid(
+            rows, cols, num_timesteps, start_timestep = start, mode = 'w+'
+        )
+        grid.grids[:] = np.nan
+        grid.save(os.path.join(directory, name + '.yml'))
+        data[name] = grid
+    return data
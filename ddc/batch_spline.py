@@ -0,0 +1,142 @@
+"""
+Batch Spline
+------------
+
+Tools for fitting smoothing splines to many pixels at once.
+
+Every pixel in a grid shares the same sample days, so the B-spline basis and
+the (banded) normal equations only need to be built and factored once. Each
+tile of pixels is then fit with a single banded solve instead of one FITPACK
+call per pixel.
+
+The splines are penalized regression splines (P-splines) with a knot at
+every sample day and a second-difference penalty on the coefficients. They
+are close to, but not the same as, the `scipy.interpolate.UnivariateSpline`
+curves used by `calc_degree_days.calc_degree_days_for_cell`.
+
+DEFAULT_SMOOTHING was calibrated against those curves with verify.py, on 
+method-failure-locations-rcp45.csv and synthetic grids (see benchmarks).
+UnivariateSpline's default smoothing (a residual of about one unit of 
+variance per sample) places knots where the series needs them, and 
+P-splines with the same residual, or with the penalty chosen by 
+generalized cross validation, are further from it than the penalty that 
+gives the closest degree-days. With the default penalty the median 
+difference in degree-days is about 1%.
+"""
+import numpy as np
+from scipy import interpolate, linalg
+
+DEGREE = 3
+## calibrated against the per cell UnivariateSpline, see above
+DEFAULT_SMOOTHING = 0.01
+
+def create_knots (days, knot_spacing = 1, degree = DEGREE):
+    """Create a clamped knot vector for the sample days.
+
+    Parameters
+    ----------
+    days: list like
+        day number for each temperature value.
+    knot_spacing: int, Defaults to 1
+        use every knot_spacing'th interior day as a knot.
+    degree: int, Defaults to 3
+        spline degree
+
+    Returns
+    -------
+    np.array
+        knots
+    """
+    days = np.asarray(days, dtype=float)
+    interior = days[1:-1][::knot_spacing]
+    return np.concatenate([
+        np.repeat(days[0], degree + 1),
+        interior,
+        np.repeat(days[-1], degree + 1)
+    ])
+
+def create_basis (
+        days, smoothing = DEFAULT_SMOOTHING, knot_spacing = 1, degree = DEGREE
+    ):
+    """Create the shared basis and factored normal equations used to fit
+    a smoothing spline to any number of time series sampled at `days`.
+
+    Parameters
+    ----------
+    days: list like
+        day number for each temperature value.
+    smoothing: float, Defaults to DEFAULT_SMOOTHING
+        weight of the second-difference penalty. Larger values give
+        smoother curves (and fewer roots).
+    knot_spacing: int, Defaults to 1
+        use every knot_spacing'th interior day as a knot.
+    degree: int, Defaults to 3
+        spline degree
+
+    Returns
+    -------
+    dict
+        'days', 'knots', 'degree', 'smoothing', 'basis' (days by
+        coefficients design matrix), and 'factor' (banded cholesky factor
+        of the normal equations)
+    """
+    days = np.asarray(days, dtype=float)
+    knots = create_knots(days, knot_spacing, degree)
+    n_coef = len(knots) - degree - 1
+
+    basis = interpolate.BSpline(knots, np.eye(n_coef), degree)(days)
+
+    diff = np.diff(np.eye(n_coef), n=2, axis=0)
+    normal = basis.T @ basis + smoothing * (diff.T @ diff)
+
+    ## upper banded storage for scipy.linalg.cholesky_banded
+    bands = degree
+    banded = np.zeros((bands + 1, n_coef))
+    for offset in range(bands + 1):
+        banded[bands - offset, offset:] = np.diagonal(normal, offset)
+
+    return {
+        'days': days,
+        'knots': knots,
+        'degree': degree,
+        'smoothing': smoothing,
+        'basis': basis,
+        'factor': linalg.cholesky_banded(banded),
+    }
+
+def fit_splines (basis, temps):
+    """Fit smoothing splines to many time series at once.
+
+    Parameters
+    ----------
+    basis: dict
+        shared basis from create_basis
+    temps: np.array
+        2d array of temperature values, timestep by pixel. Columns must
+        not contain nan values.
+
+    Returns
+    -------
+    np.array
+        2d array of spline coefficients, coefficient by pixel.
+    """
+    rhs = basis['basis'].T @ np.asarray(temps, dtype=float)
+    return linalg.cho_solve_banded((basis['factor'], False), rhs)
+
+def get_spline (basis, coefficients):
+    """Get a spline object for fitted coefficients.
+
+    Parameters
+    ----------
+    basis: dict
+        shared basis from create_basis
+    coefficients: np.array
+        coefficients for one (1d) or many (2d, coefficient by pixel) pixels
+
+    Returns
+    -------
+    scipy.interpolate.BSpline
+    """
+    return interpolate.BSpline(
+        basis['knots'], coefficients, basis['degree'], extrapolate=False
+    )
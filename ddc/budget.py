@@ -0,0 +1,58 @@
+"""
+Budget
+------
+
+Time budgets for calculating a single pixel. A few pathological series
+(i.e. noisy, near zero coastal pixels) can spend far longer than others
+searching for a smoothing factor, and stall the end of a run. A pixel
+that runs past its budget is abandoned, so it can be calculated with the
+fallback method instead.
+
+Budgets use a real time interval timer (SIGALRM), so they are only
+available on unix, in the main thread of a process. The budget is checked
+when control returns to python, so a single long call in to compiled
+code (FITPACK) is abandoned after it returns. See scheduler.run_work_units
+timeout for work units that never return.
+"""
+import signal
+import threading
+from contextlib import contextmanager
+
+class BudgetExceeded (Exception):
+    """Raised when a calculation runs past its time budget"""
+
+def available ():
+    """Check if time budgets can be used in this thread
+
+    Returns
+    -------
+    bool
+    """
+    return hasattr(signal, 'setitimer') and \
+        threading.current_thread() is threading.main_thread()
+
+@contextmanager
+def time_budget (seconds):
+    """Raise BudgetExceeded in the with block if it runs longer
+    than seconds. Budgets can not be nested.
+
+    Parameters
+    ----------
+    seconds: float or None
+        if None (or 0), or budgets are not available (see available),
+        there is no budget
+    """
+    if not seconds or not available():
+        yield
+        return
+
+    def exceeded (signum, frame):
+        raise BudgetExceeded('time budget of %s seconds exceeded' % seconds)
+
+    previous = signal.signal(signal.SIGALRM, exceeded)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
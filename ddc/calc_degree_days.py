@@ -8,12 +8,11 @@ from cmath import exp
 import os
 from re import I
 import shutil
-import gc
 import warnings
-from multiprocessing import Process, Lock, active_children, cpu_count 
-from multiprocessing import set_start_method
+from multiprocessing import Lock, cpu_count 
 from copy import deepcopy
 from tempfile import mkdtemp
+from time import perf_counter
 
 from dateutil.relativedelta import relativedelta
 
@@ -21,6 +20,7 @@ from progress.bar import Bar
 
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 from scipy import interpolate
 
@@ -30,19 +30,187 @@ except ImportError:
     from .multigrids import temporal_grid
 TemporalGrid = temporal_grid.TemporalGrid
 
+try:
+    from . import batch_spline, piecewise, prescreen, scheduler, scratch
+    from . import budget, journal, metrics, run_log, shared, windowed
+except ImportError:
+    import batch_spline, piecewise, prescreen, scheduler, scratch
+    import budget, journal, metrics, run_log, shared, windowed
+
 ROW, COL = 0, 1
 
+DEFAULT_TILE_SHAPE = (32, 32)
+MAX_SMOOTHING_FACTOR = 50
+DEFAULT_APPEND_OVERLAP = 3
+MONTHS_PER_YEAR = 12
+
 warnings.filterwarnings("ignore")
 
-# Some Mac OS nonsense for python>=3.8. Macos uses 'spawn' now instead of
-# 'fork' but that causes issues with passing np.memmap objcets. Anyway
-# this might be unstable on Mac OS now
-set_start_method('fork') 
 
+def fallback_windows (monthly_temps):
+    """Calculate the fixed season windows used by the fallback method. 
+    Thawing seasons are Jan-Jan and freezing seasons are Jul-Jul, starting 
+    from the first timestep of the monthly data. 
+
+    Parameters
+    ----------
+    monthly_temps: TemporalGrid
+        monthly temperature data
+
+    Returns
+    -------
+    dict
+        'tdd' and 'fdd' arrays with (start, end) day for each year, 
+        relative to the first timestep
+    """
+    return season_windows(list(monthly_temps.config['grid_name_map'].keys()))
+
+def season_windows (timesteps):
+    """Calculate the fixed season windows used by the fallback method, 
+    for a list of monthly timesteps. See fallback_windows.
+
+    Parameters
+    ----------
+    timesteps: list
+        datetime of each timestep
+
+    Returns
+    -------
+    dict
+        'tdd' and 'fdd' arrays with (start, end) day for each year, 
+        relative to the first timestep
+    """
+    start = timesteps[0]
+    num_years = timesteps[-1].year + 1 - start.year
+
+    delta_year = relativedelta(years=1) 
+    delta_6_months = relativedelta(months=6)
+
+    windows = {'tdd': [], 'fdd': []}
+    for year in range(num_years):
+        start_tdd = start + delta_year * year
+        start_fdd = start + delta_year * year + delta_6_months
+        windows['tdd'].append(
+            [(start_tdd - start).days, (start_tdd + delta_year - start).days]
+        )
+        windows['fdd'].append(
+            [(start_fdd - start).days, (start_fdd + delta_year - start).days]
+        )
+    return {k: np.array(v, dtype=float) for k, v in windows.items()}
+
+def find_smoothing_factor (
+        spline, expected_roots, seeds = (), 
+        max_factor = MAX_SMOOTHING_FACTOR, max_first = False
+    ):
+    """Find the smallest integer smoothing factor (1 to max_factor) that 
+    gives a spline the expected number of roots, like the old search over 
+    every factor in order, without trying every factor.
+
+    set_smoothing_factor reuses the knots of the last fit. The knots found
+    for factor 1 are kept for all larger factors, so once factor 1 has been
+    tried, the spline for any factor is the same as it was after trying 
+    every factor up to it. Factor 1 is always tried first, then the 
+    smallest factor with at most the expected number of roots is bisected 
+    for (more smoothing -> fewer roots), with the seeds (i.e. factors used 
+    by neighboring cells) tried first to narrow the range. If no factor 
+    is found the spline is left with max_factor set, the same spline as 
+    after trying every factor. If the number of roots does not fall 
+    steadily as the factor grows, the factor found can differ from the 
+    first factor in order with the expected number of roots.
+
+    With max_first, max_factor is tried right after factor 1, and if it 
+    still gives too many roots no factor will, so the search stops there.
+    This saves the bisection for series that are expected to fail.
+
+    Parameters
+    ----------
+    spline: scipy.interpolate.UnivariateSpline
+        spline, the smoothing factor is set in place.
+    expected_roots: int
+        number of roots needed
+    seeds: list like, optional
+        smoothing factors to try first
+    max_factor: int, Defaults to MAX_SMOOTHING_FACTOR
+        largest smoothing factor tried
+    max_first: bool, Defaults to False
+        if True try max_factor right after factor 1
+
+    Returns
+    -------
+    sf: int or None
+        smoothing factor found or None
+    tries: int
+        number of factors tried
+    """
+    counts = {}
+    def num_roots(sf):
+        if not sf in counts:
+            set_factor(sf)
+            counts[sf] = len(spline.roots())
+        return counts[sf]
+    current = [None]
+    def set_factor(sf):
+        if current[0] != sf:
+            spline.set_smoothing_factor(sf)
+            current[0] = sf
+
+    if num_roots(1) == expected_roots:
+        return 1, len(counts)
+    if max_first and num_roots(max_factor) > expected_roots:
+        return None, len(counts)
+
+    ## smallest factor with at most the expected number of roots is in 
+    ## low..high, high + 1 if there is none
+    low, high = 2, max_factor
+    for sf in seeds:
+        if low <= sf <= high:
+            if num_roots(sf) > expected_roots:
+                low = sf + 1
+            else:
+                high = sf
+    while low < high:
+        sf = (low + high) // 2
+        if num_roots(sf) > expected_roots:
+            low = sf + 1
+        else:
+            high = sf
+
+    if low <= max_factor and num_roots(low) == expected_roots:
+        set_factor(low)
+        return low, len(counts)
+
+    set_factor(max_factor)
+    return None, len(counts)
+
+def neighbor_smoothing_factors (index, sf_cache):
+    """Get the smoothing factors used by the solved neighbors of a cell,
+    most common first.
+
+    Parameters
+    ----------
+    index: tuple
+        row, col of cell
+    sf_cache: dict or None
+        smoothing factors keyed by (row, col)
+
+    Returns
+    -------
+    list
+    """
+    if not sf_cache:
+        return []
+    row, col = index
+    factors = [
+        sf_cache[(row + r, col + c)] 
+            for r in (-1, 0, 1) for c in (-1, 0, 1) 
+            if (row + r, col + c) in sf_cache
+    ]
+    return sorted(set(factors), key = lambda sf: -factors.count(sf))
 
 def calc_degree_days_for_cell (
-        index, monthly_temps, tdd, fdd, roots, method_map, lock = Lock(),
-        log={'verbose':0}, use_fallback = False
+        index, monthly_temps, tdd, fdd, roots, method_map, lock = None,
+        log={'verbose':0}, use_fallback = False, windows = None,
+        sf_cache = None, expect_fallback = False
         ):
     """Caclulate degree days (thawing, and freezing) and store in to 
     a grid.
@@ -65,14 +233,76 @@ def calc_degree_days_for_cell (
     log: dict
     roots_grid: np.array
         2d grid of # years by flattend grid size X2. where roots are stored
+    windows: dict, optional
+        fallback season windows from fallback_windows. Calculated if not 
+        provided.
+    sf_cache: dict, optional
+        smoothing factors used by already solved cells, keyed by (row, col).
+        Used to seed the search for the smoothing factor 
+        (see find_smoothing_factor) and updated with the factor found.
+    expect_fallback: bool, Defaults to False
+        if True (for cells predicted to need the fallback method), the 
+        search for a smoothing factor stops early when it can not find
+        one (see find_smoothing_factor max_first). Results are the same.
         
     """
-    expected_roots = 2 * tdd.config['num_timesteps']
-    # print('->>', expected_roots, use_fallback)
     row, col = index
-    # print('\n->', expected_roots)
-    days = monthly_temps.convert_timesteps_to_julian_days()
-    temps = monthly_temps[:, row, col]
+    if windows is None:
+        windows = fallback_windows(monthly_temps)
+    tdd_temp, fdd_temp, roots_temp, method = degree_days_for_series(
+        monthly_temps.convert_timesteps_to_julian_days(), 
+        monthly_temps[:, row, col], tdd.config['num_timesteps'], windows,
+        use_fallback, index, sf_cache, expect_fallback
+    )
+    method_map[row, col] = method
+
+    store_cell_results(
+        index, tdd, fdd, roots, tdd_temp, fdd_temp, roots_temp, lock
+    )
+
+def degree_days_for_series (
+        days, temps, num_years, windows, use_fallback = False, 
+        index = None, sf_cache = None, expect_fallback = False, stats = None
+    ):
+    """Caclulate degree days (thawing, and freezing) for a single 
+    time series, with its own spline. 
+
+    Parameters
+    ----------
+    days: list like
+        day number for each temperature value. 
+    temps: list like
+        Temperature values. len(days) == len(temps).
+    num_years: int
+        number of years of data
+    windows: dict
+        fallback season windows from fallback_windows. 
+    use_fallback: bool, Defaults to False
+        if True the fallback method is used
+    index: tuple, optional
+        (row, col) of the series, used with sf_cache
+    sf_cache: dict, optional
+        smoothing factors used by already solved cells, keyed by (row, col).
+        Used to seed the search for the smoothing factor 
+        (see find_smoothing_factor) and updated with the factor found.
+    expect_fallback: bool, Defaults to False
+        if True (for cells predicted to need the fallback method), the 
+        search for a smoothing factor stops early when it can not find
+        one (see find_smoothing_factor max_first). Results are the same.
+    stats: dict, optional
+        'smoothing_searches' and 'smoothing_tries' counts, updated if 
+        the smoothing factor is searched for
+
+    Returns
+    -------
+    tdd_temp, fdd_temp, roots_temp: list
+        values. The last value of fdd_temp is a dummy or partial value
+    method: int
+        method used, 1 (spline), 2 (fallback), or 3 (fallback after 
+        spline method failed)
+    """
+    expected_roots = 2 * num_years
+    # print('->>', expected_roots, use_fallback)
     spline = interpolate.UnivariateSpline(days, temps)
     # print('->>', expected_roots,len(spline.roots()), use_fallback)
 
@@ -82,47 +312,37 @@ def calc_degree_days_for_cell (
 
     
     if len(spline.roots()) != expected_roots:
-        for sf in range(1,51):
-            
-            spline.set_smoothing_factor(sf)
-            # print('->>', expected_roots,len(spline.roots()), use_fallback)
-            len_roots = len(spline.roots())  ## make really explicit to avoid bugs
-            if len_roots == expected_roots:
-                break
+        sf, tries = find_smoothing_factor(
+            spline, expected_roots, 
+            neighbor_smoothing_factors(index, sf_cache), 
+            max_first = expect_fallback
+        )
+        if not sf_cache is None and not sf is None:
+            sf_cache[tuple(index)] = sf
+        if not stats is None:
+            stats['smoothing_searches'] += 1
+            stats['smoothing_tries'] += tries
 
     # print('->>', expected_roots,len(spline.roots()), use_fallback)
     fallback = False
     if len(spline.roots()) == expected_roots and not use_fallback: 
         # print('default')
-        for rdx in range(len(spline.roots())-1):
-            val = spline.integral(spline.roots()[rdx], spline.roots()[rdx+1])
-            if val > 0:
-                roots_temp.append(spline.roots()[rdx])
-                tdd_temp.append(val)
-            else:
-                fdd_temp.append(val)
-                roots_temp.append(-1 * spline.roots()[rdx])
-
-        fdd_temp.append(+8000) # dummy value
-
-        roots_temp.append(spline.roots()[-1]  * roots_temp[-1]/abs(roots_temp[-1]) * -1) 
-
-        method_map[row, col] = 1
-
-        if len(fdd_temp) != tdd.config['num_timesteps'] or \
-           len(tdd_temp) != tdd.config['num_timesteps']:
+        method = 1
+        results = degree_days_from_roots(
+            spline.roots(), spline.integral, num_years
+        )
+        if results is None:
             # print(
             #     'fallback b'
             # )
             fallback = True
-            method_map[row, col] = 3
-            tdd_temp = []
-            fdd_temp = []
-            roots_temp = []
+            method = 3
+        else:
+            tdd_temp, fdd_temp, roots_temp = results
     else:
         fallback = True
         # print('fallback a')
-        method_map[row, col] = 2
+        method = 2
         # print('fdd len', len(fdd_temp))
         # print('tdd len', len(tdd_temp))
         # print('roots len', len(roots_temp))
@@ -130,61 +350,78 @@ def calc_degree_days_for_cell (
     if fallback:
         # default = False
         # print('fallback')
-        start= list(monthly_temps.config['grid_name_map'].keys())[0]
+        spline_roots = np.array(spline.roots())
+        tdd_vals, fdd_vals, roots_vals = piecewise.fallback_degree_days(
+            piecewise.from_spline(spline), spline_roots[np.newaxis], 
+            np.array([len(spline_roots)]), windows
+        )
+        tdd_temp = list(tdd_vals[0])
+        fdd_temp = list(fdd_vals[0])
+        roots_temp = list(roots_vals[0])
 
-        start_year = list(monthly_temps.config['grid_name_map'].keys())[0].year
-        end_year = list(monthly_temps.config['grid_name_map'].keys())[-1].year + 1
-        
-        delta_year = relativedelta(years=1) 
-        delta_6_months = relativedelta(months=6)
+    return tdd_temp, fdd_temp, roots_temp, method
 
-        for year in range(end_year-start_year):
-            start_tdd = list(monthly_temps.config['grid_name_map'].keys())[0] + \
-                delta_year * year
-            end_tdd = start_tdd + delta_year
+def degree_days_from_roots (spline_roots, integral, num_years):
+    """Calculate degree days from the roots of a spline with exactly one
+    thawing and one freezing season per year (the default spline method).
 
-            start_fdd = list(monthly_temps.config['grid_name_map'].keys())[0] + \
-                delta_year * year + delta_6_months
-            end_fdd = (start_fdd + delta_year)
-    
-            start_tdd = (start_tdd - start).days
-            end_tdd =   (end_tdd- start).days
-            start_fdd = (start_fdd- start).days
-            end_fdd = (end_fdd- start).days
-    
-            fdd_roots = sorted([start_fdd, end_fdd] + \
-                [i for i in spline.roots() if start_fdd < i <= end_fdd])
-            tdd_roots = sorted([start_tdd, end_tdd] + \
-                [i for i in spline.roots() if start_tdd < i <= end_tdd])
-    
-            tdd_val = []
-            for idx in range(1,len(tdd_roots)):
-                s = tdd_roots[idx-1]
-                e = tdd_roots[idx]
-                val = spline.integral(s,e)
-                tdd_val.append(val)
-                if idx == 1:
-                    roots_temp.append(e)
-
-            tdd_val = sum([v for v in tdd_val if v > 0])
-            
-            fdd_val = []
-            for idx in range(1,len(fdd_roots)):
-                s = fdd_roots[idx-1]
-                e = fdd_roots[idx]
-                val = spline.integral(s,e)
-                fdd_val.append(val)
-                if idx == 1:
-                    roots_temp.append(-1 * e)
-            fdd_val = sum([v for v in fdd_val if v < 0])
-            fdd_temp.append(fdd_val)
-            tdd_temp.append(tdd_val)
-            
-
-    # print (tdd)
-    
-    # tdd = np.arrtdd))
-    # fdd = np.array(len(fdd))
+    Parameters
+    ----------
+    spline_roots: list like
+        sorted roots of spline.
+    integral: function
+        function with arguments (a, b) returning the integral of the 
+        spline from a to b. 
+    num_years: int
+        number of years of data
+
+    Returns
+    -------
+    tuple or None
+        lists of tdd, fdd, and roots values for the cell. fdd has a 
+        dummy value of +8000 for the last year. None is returned if the 
+        number of seasons found does not match num_years.
+    """
+    tdd_temp = []
+    fdd_temp = []
+    roots_temp = []
+    for rdx in range(len(spline_roots)-1):
+        val = integral(spline_roots[rdx], spline_roots[rdx+1])
+        if val > 0:
+            roots_temp.append(spline_roots[rdx])
+            tdd_temp.append(val)
+        else:
+            fdd_temp.append(val)
+            roots_temp.append(-1 * spline_roots[rdx])
+
+    fdd_temp.append(+8000) # dummy value
+
+    roots_temp.append(spline_roots[-1]  * roots_temp[-1]/abs(roots_temp[-1]) * -1) 
+
+    if len(fdd_temp) != num_years or len(tdd_temp) != num_years:
+        return None
+    return tdd_temp, fdd_temp, roots_temp
+
+def store_cell_results (
+        index, tdd, fdd, roots, tdd_temp, fdd_temp, roots_temp, lock = None
+    ):
+    """Store degree days and roots for a cell.
+
+    Parameters
+    ----------
+    index: tuple
+        row, col of cell
+    tdd, fdd, roots: TemporalGrid
+        grids to store results in
+    tdd_temp, fdd_temp, roots_temp: list
+        values for cell. The last value of fdd_temp is a dummy or partial 
+        value and is replaced.
+    lock: multiprocessing.Lock, Optional.
+        lock object, If not passed a new lock is created.
+    """
+    row, col = index
+    if lock is None:
+        lock = Lock()
     lock.acquire()
     
     tdd[:, row, col] = np.array(tdd_temp)
@@ -211,13 +448,691 @@ def calc_degree_days_for_cell (
 
     lock.release()
 
+def fix_last_winter (fdd_vals):
+    """Replace the dummy or partial last fdd value for many cells with the 
+    value of the previous year. See store_cell_results.
+
+    Parameters
+    ----------
+    fdd_vals: np.array
+        fdd values, cell by year
+
+    Returns
+    -------
+    np.array
+    """
+    return np.concatenate([fdd_vals[:, :-1], fdd_vals[:, -2:-1]], axis=1)
+
+def grid_view (grid):
+    """Get a 3d (timestep, row, col) view of the data in a TemporalGrid.
+
+    Parameters
+    ----------
+    grid: TemporalGrid, or np.array
+        arrays are assumed to be (timestep, row, col) already
+
+    Returns
+    -------
+    np.array (or np.memmap)
+    """
+    if isinstance(grid, np.ndarray):
+        return grid
+    return grid.grids.reshape(grid.grids.shape[0], *grid.config['grid_shape'])
+
+def read_cells (monthly_temps, cells, timesteps = slice(None)):
+    """Read the time series for many cells at once. The block of data 
+    containing the cells is read in one slice.
+
+    Parameters
+    ----------
+    monthly_temps: TemporalGrid, tiff_source.TiffSource, or
+            scratch.PixelMajorStore
+        monthly temperature data
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+    timesteps: slice, optional
+        timestep indices to read, Defaults to all
+
+    Returns
+    -------
+    np.array
+        timestep by cell
+    """
+    if isinstance(monthly_temps, scratch.PixelMajorStore):
+        return monthly_temps.read_cells(cells)[timesteps]
+    rows, cols = np.asarray(cells).T
+    r_0, c_0 = rows.min(), cols.min()
+    block = np.array(
+        monthly_temps[timesteps, r_0:rows.max() + 1, c_0:cols.max() + 1]
+    )
+    return block[:, rows - r_0, cols - c_0]
+
+def write_block (view, cells, values):
+    """Write values for many cells with a single write of the block 
+    containing the cells. Values in the block for other cells are kept.
+
+    Parameters
+    ----------
+    view: np.array
+        array (or memmap) where the last two dimensions are row and col
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+    values: np.array
+        values for each cell, shape (n cells, ...)
+    """
+    rows, cols = np.asarray(cells).T
+    r_0, c_0 = rows.min(), cols.min()
+    region = (Ellipsis, slice(r_0, rows.max() + 1), slice(c_0, cols.max() + 1))
+    block = np.array(view[region])
+    block[..., rows - r_0, cols - c_0] = np.moveaxis(values, 0, -1)
+    view[region] = block
+
+def write_cells (grid, cells, values, first = 0):
+    """Write values for many cells to a TemporalGrid (see write_block) or 
+    a scratch.PixelMajorStore.
+
+    Parameters
+    ----------
+    grid: TemporalGrid or scratch.PixelMajorStore
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+    values: np.array
+        values for each cell, cell by timestep
+    first: int, Defaults to 0
+        index of the timestep of the first value, values for earlier 
+        timesteps are not changed
+    """
+    if isinstance(grid, scratch.PixelMajorStore):
+        if first > 0:
+            current = grid.read_cells(cells).T
+            current[:, first:] = values
+            values = current
+        grid.write_cells(cells, values)
+    else:
+        write_block(grid_view(grid)[first:], cells, values)
+
+def flush_grid (grid):
+    """Write changes in a grid to disk.
+
+    Parameters
+    ----------
+    grid: TemporalGrid, scratch.PixelMajorStore, or np.memmap
+    """
+    if isinstance(grid, scratch.PixelMajorStore):
+        grid.flush()
+        return
+    array = grid.grids if hasattr(grid, 'grids') else grid
+    if isinstance(array, np.memmap):
+        array.flush()
+
+def store_results (
+        cells, tdd, fdd, roots, method_map, results, lock = None, 
+        first_year = 0
+    ):
+    """Store the results for many cells (i.e. a work unit) with one block 
+    write for each grid. Blocks of different work units do not overlap, 
+    so no lock is needed when storing the results of a work unit.
+
+    Parameters
+    ----------
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+    tdd, fdd, roots: TemporalGrid or scratch.PixelMajorStore
+        grids to store results in
+    method_map: np.array
+        2d grid where method used for each cell is stored
+    results: dict
+        results from degree_days_for_cells
+    lock: multiprocessing.Lock, Optional.
+        lock object, only needed if blocks may overlap.
+    first_year: int, Defaults to 0
+        index of the year of the first result, earlier years are not 
+        changed (see trim_results)
+    """
+    if len(cells) == 0:
+        return
+    if lock:
+        lock.acquire()
+    write_cells(tdd, cells, results['tdd'], first_year)
+    write_cells(fdd, cells, results['fdd'], first_year)
+    write_cells(roots, cells, results['roots'], 2 * first_year)
+    write_block(method_map, cells, results['method'])
+    if lock:
+        lock.release()
+
+def degree_days_for_cells (
+        cells, temps, days, num_years, windows, method = 'spline', 
+        use_fallback = False, basis = None, use_prescreen = False,
+        stats = None, pixel_budget = None, linear_fallback = False,
+        prescreen_options = None
+    ):
+    """Calculate degree days (thawing, and freezing) for many cells. 
+    Results are returned, not stored.
+
+    With the 'linear' method, the monthly values of all cells are treated
+    as piecewise linear curves (see piecewise.from_samples), and roots and
+    integrals are found directly for all cells at once. Cells where the 
+    curve does not have the expected number of roots use the fallback 
+    windows. This is much faster than fitting splines, but the monthly 
+    means are not smoothed, so it is meant for quick screening runs. 
+    Cells with missing data are calculated like the 'spline' method.
+
+    With the 'windowed-spline' method, all cells are fit at once for a 
+    window of years around each year (see windowed), cells with missing 
+    data are calculated like the 'spline' method.
+
+    With the 'batch-spline' method all cells are fit at once 
+    (see batch_spline), and roots and integrals are found for all cells 
+    at once (see piecewise). Cells where the batch spline does not have 
+    the expected number of roots, or that have missing data are 
+    calculated with their own spline (see degree_days_for_series), as are 
+    all cells with the 'spline' method. Missing values are skipped when 
+    fitting a cell's own spline. Cells that take longer than pixel_budget
+    to fit their own spline use the fallback windows with a piecewise 
+    linear curve through their values (like the 'linear' method, without 
+    fitting a spline again), and are marked with 9 in the method map.
+
+    Parameters
+    ----------
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+    temps: np.array
+        temperatures, timestep by cell
+    days: list like
+        day number for each temperature value. 
+    num_years: int
+        number of years of data
+    windows: dict
+        fallback season windows from fallback_windows. 
+    method: str, Defaults to 'spline'
+        'spline', 'batch-spline', 'windowed-spline', or 'linear'
+    use_fallback: bool
+        if True the fallback method is used for all cells
+    basis: dict, optional
+        shared basis from batch_spline.create_basis, for 'batch-spline' 
+        method, or bases from windowed.create_bases for 'windowed-spline'
+        method. Created from days if not provided. 
+    use_prescreen: bool, Defaults to False
+        if True cells the spline method is predicted to fail for (see 
+        prescreen.prescreen) use the fallback method, with a shorter 
+        search for a smoothing factor. The values of cells that would have
+        used the fallback method anyway do not change.
+    stats: dict, optional
+        smoothing factor search counts, see degree_days_for_series
+    pixel_budget: float, optional
+        seconds a cell's own spline may take (see budget.time_budget)
+    linear_fallback: bool, Defaults to False
+        if True, cells that would be fit with their own spline (i.e. 
+        cells with missing data) are calculated like cells over 
+        pixel_budget without fitting a spline. Used for work units retried
+        after they timed out.
+    prescreen_options: dict, optional
+        thresholds for prescreen.prescreen ('near_zero', 'min_amplitude', 
+        'max_near_zero_fraction'), defaults are used for missing keys
+
+    Returns
+    -------
+    dict
+        'tdd', 'fdd' (cell by year), 'roots' (cell by 2 * year), 
+        'method' (method map value for each cell), and 'seconds' 
+        (calculation time for each cell, cells calculated at once share
+        the time evenly), and 'searched' (cells where a smoothing factor
+        was searched for) arrays.
+    """
+    n_cells = len(cells)
+    results = {
+        'tdd': np.full((n_cells, num_years), np.nan),
+        'fdd': np.full((n_cells, num_years), np.nan),
+        'roots': np.full((n_cells, 2 * num_years), np.nan),
+        'method': np.full(n_cells, np.nan),
+        'seconds': np.zeros(n_cells),
+        'searched': np.zeros(n_cells, dtype=bool),
+    }
+    start = perf_counter()
+
+    predicted = np.zeros(n_cells, dtype=bool)
+    if use_prescreen and not use_fallback:
+        predicted = prescreen.prescreen(temps, **(prescreen_options or {}))
+    fallback = predicted | use_fallback
+
+    remaining = np.ones(n_cells, dtype=bool)
+    if method == 'batch-spline':
+        if basis is None:
+            basis = batch_spline.create_basis(days)
+        can_fit = np.isfinite(temps).all(axis=0)
+        coefficients = batch_spline.fit_splines(basis, temps[:, can_fit])
+        pp = piecewise.from_bspline(basis, coefficients)
+        spline_roots, counts = piecewise.find_roots(pp)
+
+        in_fit = fallback[can_fit]
+        tdd_vals, fdd_vals, roots_vals = piecewise.fallback_degree_days(
+            piecewise.select(pp, in_fit), spline_roots[in_fit], 
+            counts[in_fit], windows
+        )
+        done = can_fit & fallback
+        results['tdd'][done] = tdd_vals
+        results['fdd'][done] = fdd_vals
+        results['roots'][done] = roots_vals
+        results['method'][done] = 2
+
+        tdd_vals, fdd_vals, roots_vals, success = \
+            piecewise.spline_degree_days(
+                piecewise.select(pp, ~in_fit), spline_roots[~in_fit], 
+                counts[~in_fit], num_years
+            )
+        spline_cells = np.where(can_fit & ~fallback)[0][success]
+        results['tdd'][spline_cells] = tdd_vals
+        results['fdd'][spline_cells] = fdd_vals
+        results['roots'][spline_cells] = roots_vals
+        results['method'][spline_cells] = 1
+        
+        remaining[done] = False
+        remaining[spline_cells] = False
+
+    elif method == 'windowed-spline':
+        if basis is None:
+            basis = windowed.create_bases(days, num_years)
+        can_fit = np.isfinite(temps).all(axis=0)
+        tdd_vals, fdd_vals, roots_vals, year_fallback = \
+            windowed.windowed_degree_days(
+                temps[:, can_fit], days, num_years, windows, basis,
+                use_fallback = fallback[can_fit]
+            )
+        results['tdd'][can_fit] = tdd_vals
+        results['fdd'][can_fit] = fdd_vals
+        results['roots'][can_fit] = roots_vals
+        results['method'][can_fit] = np.where(
+            year_fallback.all(axis=1), 2, 
+            np.where(year_fallback.any(axis=1), 6, 5)
+        )
+        remaining[can_fit] = False
+
+    elif method == 'linear':
+        can_fit = np.isfinite(temps).all(axis=0)
+        pp = piecewise.from_samples(days, temps[:, can_fit])
+        linear_roots, counts = piecewise.find_roots(pp)
+
+        in_fit = fallback[can_fit]
+        tdd_vals, fdd_vals, roots_vals, success = \
+            piecewise.spline_degree_days(
+                piecewise.select(pp, ~in_fit), linear_roots[~in_fit], 
+                counts[~in_fit], num_years
+            )
+        linear_cells = np.where(can_fit & ~fallback)[0][success]
+        results['tdd'][linear_cells] = tdd_vals
+        results['fdd'][linear_cells] = fdd_vals
+        results['roots'][linear_cells] = roots_vals
+        results['method'][linear_cells] = 7
+
+        ## cells without the expected roots use the fallback windows 
+        ## with the same curve
+        in_fit[~in_fit] = ~success
+        tdd_vals, fdd_vals, roots_vals = piecewise.fallback_degree_days(
+            piecewise.select(pp, in_fit), linear_roots[in_fit], 
+            counts[in_fit], windows
+        )
+        done = np.where(can_fit)[0][in_fit]
+        results['tdd'][done] = tdd_vals
+        results['fdd'][done] = fdd_vals
+        results['roots'][done] = roots_vals
+        results['method'][done] = 8
+
+        remaining[can_fit] = False
+
+    if not remaining.all():
+        results['seconds'][~remaining] = \
+            (perf_counter() - start) / (~remaining).sum()
+
+    sf_cache = {}
+    days = np.asarray(days)
+    for cdx in np.where(remaining)[0]:
+        start = perf_counter()
+        ## missing values are skipped, cells without enough values for a 
+        ## spline are left as nan
+        finite = np.isfinite(temps[:, cdx])
+        if finite.sum() <= batch_spline.DEGREE:
+            continue
+        cell_stats = {'smoothing_searches': 0, 'smoothing_tries': 0}
+        cell_method = 9
+        if not linear_fallback:
+            try:
+                with budget.time_budget(pixel_budget):
+                    tdd_temp, fdd_temp, roots_temp, cell_method = \
+                        degree_days_for_series(
+                            days[finite], temps[finite, cdx], num_years, 
+                            windows, fallback[cdx], tuple(cells[cdx]), 
+                            sf_cache, expect_fallback = predicted[cdx], 
+                            stats = cell_stats
+                        )
+            except budget.BudgetExceeded:
+                pass
+        if cell_method == 9:
+            ## refitting the spline could take as long again, the fallback 
+            ## windows are used with the linear curve through the values
+            pp = piecewise.from_samples(
+                days[finite], temps[finite, cdx][:, np.newaxis]
+            )
+            linear_roots, counts = piecewise.find_roots(pp)
+            tdd_vals, fdd_vals, roots_vals = piecewise.fallback_degree_days(
+                pp, linear_roots, counts, windows
+            )
+            tdd_temp, fdd_temp, roots_temp = \
+                tdd_vals[0], fdd_vals[0], roots_vals[0]
+            cell_method = 9
+        results['tdd'][cdx] = tdd_temp
+        results['fdd'][cdx] = fdd_temp
+        results['roots'][cdx] = roots_temp
+        results['method'][cdx] = cell_method
+        results['seconds'][cdx] = perf_counter() - start
+        results['searched'][cdx] = cell_stats['smoothing_searches'] > 0
+        if not stats is None:
+            for key in cell_stats:
+                stats[key] += cell_stats[key]
+        
+    results['method'][predicted & (results['method'] != 9)] = 4
+    results['fdd'] = fix_last_winter(results['fdd'])
+    return results
+
+def trim_results (results, skip_years = 0, day_offset = 0):
+    """Drop the results for the first years, and shift roots by a number 
+    of days. Used when degree days are calculated from a window of the 
+    time series (see calc_grid_degree_days append_from).
+
+    Parameters
+    ----------
+    results: dict
+        results from degree_days_for_cells
+    skip_years: int, Defaults to 0
+        number of years to drop
+    day_offset: int, Defaults to 0
+        days added to the roots. The sign of each root (thawing or 
+        freezing) is kept
+
+    Returns
+    -------
+    dict
+    """
+    if skip_years == 0 and day_offset == 0:
+        return results
+    trimmed = dict(results)
+    trimmed['tdd'] = results['tdd'][:, skip_years:]
+    trimmed['fdd'] = results['fdd'][:, skip_years:]
+    roots = results['roots'][:, 2 * skip_years:]
+    trimmed['roots'] = np.sign(roots) * (np.abs(roots) + day_offset)
+    return trimmed
+
+def calc_degree_days_for_tile (
+        cells, monthly_temps, tdd, fdd, roots, method_map, lock = None,
+        log={'verbose':0}, use_fallback = False, basis = None, windows = None
+        ):
+    """Caclulate degree days (thawing, and freezing) for a tile of grid
+    cells with the batch spline engine and store them in to a grid. 
+    See degree_days_for_cells.
+
+    Parameters
+    ----------
+    cells: np.array
+        (row, col) index for each cell in tile. Shape is (n cells, 2)
+    monthly_temps: TemporalGrid
+        monthly temperature data
+    tdd, fdd, roots: TemporalGrid
+        grids to store results in
+    method_map: np.array
+        2d grid where method used for each cell is stored
+    lock: multiprocessing.Lock, Optional.
+        lock object, If not passed a new lock is created.
+    log: dict
+    use_fallback: bool
+        if True the fallback method is used for all cells
+    basis: dict, optional
+        shared basis from batch_spline.create_basis. Created from 
+        monthly_temps if not provided. 
+    windows: dict, optional
+        fallback season windows from fallback_windows. Calculated if not 
+        provided.
+    """
+    if windows is None:
+        windows = fallback_windows(monthly_temps)
+    results = degree_days_for_cells(
+        cells, read_cells(monthly_temps, cells), 
+        monthly_temps.convert_timesteps_to_julian_days(), 
+        tdd.config['num_timesteps'], windows, 'batch-spline', use_fallback, 
+        basis
+    )
+    store_results(cells, tdd, fdd, roots, method_map, results, lock)
+
+_worker = {}
+
+def init_worker (context):
+    """Set up the data used by process_work_unit in a worker process.
+    Shared arrays (see shared.SharedArray) in 'data' and 'method_map' are
+    attached to by name.
+
+    Parameters
+    ----------
+    context: dict
+        'data' (shared (timestep, row, col) arrays, scratch stores, or 
+        sources for the keys in calc_grid_degree_days data, see 
+        share_grids), 'method_map', 'pixel_seconds' (2d grid or None), 
+        'logging_dir', 'verbose' (see
+        run_log.LogBuffer), 'grid_shape', 'tile_shape', 'days', 
+        'num_years', 'use_fallback', 'use_prescreen', 'prescreen_options',
+        'method', 'windows' 
+        (see fallback_windows), 'basis' (batch and windowed spline 
+        methods), 'pixel_budget' (see degree_days_for_cells), 'retry' (if 
+        True, cells are marked with 9 in the method map), and
+        'timesteps', 'skip_years', 'day_offset', 'first_year' (for 
+        calculating from a window of the time series, see 
+        calc_grid_degree_days append_from)
+    """
+    _worker.clear()
+    _worker.update(context)
+    _worker['data'] = {
+        key: shared.attach(value) for key, value in context['data'].items()
+    }
+    _worker['method_map'] = shared.attach(context['method_map'])
+    _worker['pixel_seconds'] = shared.attach(context['pixel_seconds'])
+    _worker['log'] = run_log.LogBuffer(
+        context['logging_dir'], context['verbose']
+    )
+
+def share_grids (data):
+    """Get handles for the grids used by process_work_unit that can be 
+    sent to worker processes started with any start method. TemporalGrids
+    are shared as (timestep, row, col) arrays (see shared.SharedArray), 
+    scratch stores and tiff sources are reopened by name when unpickled.
+
+    Parameters
+    ----------
+    data: dict
+        'monthly-temperature', 'tdd', 'fdd', and 'roots' TemporalGrids, 
+        or scratch stores (see create_scratch_stores)
+
+    Returns
+    -------
+    dict
+    """
+    return {
+        key: shared.share(
+            grid_view(data[key]) if hasattr(data[key], 'grids') else data[key]
+        ) for key in ['monthly-temperature', 'tdd', 'fdd', 'roots']
+    }
+
+def process_work_unit (cells):
+    """Calculate degree days for the cells in a work unit, with the data
+    set by init_worker. Results are kept in memory until all cells are 
+    done and then written with one block write per grid, without a lock,
+    and flushed to disk (so the unit can be recorded in the completion 
+    journal). Cells where the spline method failed, or without enough data,
+    are logged to the worker's log file (see run_log). Work units retried
+    with the 'linear' method and fallback windows after they timed out 
+    (context 'retry') have their cells marked with 9 in the method map.
+
+    Parameters
+    ----------
+    cells: np.array
+        (row, col) index for each cell, shape (n cells, 2)
+
+    Returns
+    -------
+    dict
+        'cells' (number of cells), 'seconds', 'pid' of the worker, 
+        'smoothing_searches', 'smoothing_tries' (see degree_days_for_series),
+        and 'methods' (see metrics.count_methods)
+    """
+    start = perf_counter()
+    stats = {'smoothing_searches': 0, 'smoothing_tries': 0}
+    data = _worker['data']
+    temps = read_cells(
+        data['monthly-temperature'], cells, _worker['timesteps']
+    )
+    results = degree_days_for_cells(
+        cells, temps, _worker['days'], _worker['num_years'], 
+        _worker['windows'], _worker['method'], _worker['use_fallback'], 
+        _worker['basis'], _worker['use_prescreen'], stats, 
+        _worker['pixel_budget'], linear_fallback = _worker['retry'],
+        prescreen_options = _worker['prescreen_options']
+    )
+    if _worker['retry']:
+        results['method'][~np.isnan(results['method'])] = 9
+    results = trim_results(
+        results, _worker['skip_years'], _worker['day_offset']
+    )
+    store_results(
+        cells, data['tdd'], data['fdd'], data['roots'], 
+        _worker['method_map'], results, first_year = _worker['first_year']
+    )
+    for grid in [data['tdd'], data['fdd'], data['roots']]:
+        flush_grid(grid)
+    flush_grid(_worker['method_map'])
+    if not _worker['pixel_seconds'] is None:
+        write_block(_worker['pixel_seconds'], cells, results['seconds'])
+        flush_grid(_worker['pixel_seconds'])
+
+    log = _worker['log']
+    for cdx in np.where(results['method'] == 3)[0]:
+        log.message(
+            'Default spline method failed, used range spline method', 
+            cells[cdx]
+        )
+    for cdx in np.where(results['method'] == 9)[0]:
+        log.message(
+            'Time budget exceeded, used linear method with range windows', 
+            cells[cdx]
+        )
+    for cdx in np.where(np.isnan(results['method']))[0]:
+        log.message('Not enough data for a spline', cells[cdx])
+    log.flush(
+        scheduler.tile_id(cells, _worker['grid_shape'], _worker['tile_shape'])
+    )
+    stats.update(
+        cells = len(cells), seconds = perf_counter() - start, 
+        pid = os.getpid(), 
+        methods = metrics.count_methods(results['method'], results['searched'])
+    )
+    return stats
+
+def create_scratch_stores (data, scratch_dir, tile_shape):
+    """Create pixel major (time contiguous) scratch copies of the input and 
+    output grids (see scratch.PixelMajorStore). Each grid is copied in one 
+    streaming pass. Stores left in scratch_dir by an unfinished run, with 
+    the same shapes, are reused instead of copied again, if their copy 
+    finished and (for 'monthly-temperature') they were copied from the 
+    same data (see scratch.sample_digest).
+
+    Parameters
+    ----------
+    data: dict
+        'monthly-temperature', 'tdd', 'fdd', and 'roots' TemporalGrids.
+        'monthly-temperature' may also be a tiff_source.TiffSource
+    scratch_dir: path
+        directory for scratch stores
+    tile_shape: tuple
+        (rows, cols) of tiles, should match the work unit tile shape so 
+        each work unit reads and writes a single contiguous block
+
+    Returns
+    -------
+    dict
+        scratch.PixelMajorStore for each key in data
+    """
+    try: 
+        os.makedirs(scratch_dir)
+    except:
+        pass
+    stores = {}
+    for key in ['monthly-temperature', 'tdd', 'fdd', 'roots']:
+        grid = data[key]
+        ## sources like tiff_source.TiffSource can be read as a view
+        view = grid_view(grid) if hasattr(grid, 'grids') else grid
+        ## the result stores hold the results of the unfinished run, so 
+        ## only the input is checked against its source
+        source = None
+        if key == 'monthly-temperature':
+            source = scratch.sample_digest(view)
+        stores[key] = scratch.PixelMajorStore(
+            os.path.join(scratch_dir, 'ddc-temp-%s.pixel-major.data' % key),
+            grid.config['grid_shape'], view.shape[0], tile_shape, view.dtype,
+            source = source
+        )
+        if not stores[key].reused:
+            stores[key].from_view(view)
+    return stores
+
+def select_cells_by_method (method_map, codes = None, region = None):
+    """Select cells to recalculate from the method map of a previous run.
+
+    Parameters
+    ----------
+    method_map: np.array
+        2d method map (i.e. methods.data.npy from the logging directory)
+    codes: list, optional
+        method map values to select (i.e. [2, 3] for cells where the 
+        fallback method was used). All cells with a method are selected 
+        if not provided.
+    region: tuple, optional
+        (min row, min col, max row, max col) of region to select cells 
+        in, max values are exclusive.
+
+    Returns
+    -------
+    np.array
+        2d boolean grid, True for selected cells, use as the recalc_mask for
+        calc_grid_degree_days.
+    """
+    if codes is None:
+        selected = ~np.isnan(method_map)
+    else:
+        selected = np.isin(method_map, codes)
+    if not region is None:
+        r_0, c_0, r_1, c_1 = region
+        in_region = np.zeros(selected.shape, dtype=bool)
+        in_region[r_0:r_1, c_0:c_1] = True
+        selected &= in_region
+    return selected
+
 def calc_grid_degree_days (
         data,
         start = 0, num_process = 1, 
-        log={'Element Messages': [], 'verbose':0},
+        log=None,
         logging_dir=None,
         use_fallback=False,
         recalc_mask = None,
+        method = 'spline',
+        tile_shape = DEFAULT_TILE_SHAPE,
+        smoothing = batch_spline.DEFAULT_SMOOTHING,
+        chunk_size = 1,
+        use_prescreen = False,
+        prescreen_options = None,
+        scratch_dir = None,
+        valid_mask = None,
+        previous_methods = None,
+        append_from = None,
+        append_overlap = DEFAULT_APPEND_OVERLAP,
+        run_metrics = None,
+        pixel_timing = False,
+        pixel_budget = None,
+        unit_timeout = None,
     ):
     """Calculate degree days (Thawing, and Freezing) for an area. 
     
@@ -252,12 +1167,94 @@ def calc_grid_degree_days (
     num_process: int, Defaults to 1.
         number of processes to use to do calcualtion. If set to None,
         cpu_count() value is used. If greater than 1 ttd_grid, and fdd_grid 
-        should be memory mapped numpy arrays.
-    log: dict
+        should be memory mapped numpy arrays. The processes are started 
+        once and are fed work units (tiles of tile_shape cells).
+    log: dict, optional
+        'verbose' level and 'Element Messages' list. 'Spline Errors', a 
+        list of (row, col, message) collected from the worker logs (see 
+        run_log), is set at the end of the run. A new log (verbose 0) is 
+        used if not provided.
     roots_grid: np.array
         2d grid of # years by flattend grid size X2. where roots are stored
     logging_dir: optional, path
-        path to save diagnostic file indcating where data was interpolated
+        path to save diagnostic file indcating where data was interpolated.
+        Work units are recorded in a completion journal 
+        (ddc-temp-journal.txt) here as they finish. If the run is 
+        interrupted, running it again with the same cells (and tile_shape, 
+        and scratch_dir) only calculates the unfinished work units. The 
+        journal is removed when all units finish without errors.
+    method: str, Defaults to 'spline'
+        'spline' to calculate each cell with its own spline
+        (calc_degree_days_for_cell), or 'batch-spline' to fit splines for 
+        tiles of cells at once (calc_degree_days_for_tile), or 
+        'windowed-spline' to fit splines for tiles of cells at once to a 
+        window of years around each year (see windowed), or 'linear'
+        to use piecewise linear curves through the monthly values for tiles
+        of cells at once
+    tile_shape: tuple, Defaults to DEFAULT_TILE_SHAPE
+        (rows, cols) shape of tiles (work units)
+    smoothing: float, Defaults to batch_spline.DEFAULT_SMOOTHING
+        smoothing penalty used by 'batch-spline' and 'windowed-spline' 
+        methods
+    chunk_size: int, Defaults to 1
+        number of work units sent to a worker process at once
+    use_prescreen: bool, Defaults to False
+        if True, cells the spline method is predicted to fail for (see 
+        prescreen.prescreen) are calculated with the fallback method, 
+        with a shorter search for a smoothing factor, and marked with 4 
+        in the method map. The values of cells that would have used the 
+        fallback method anyway do not change.
+    prescreen_options: dict, optional
+        thresholds for the prescreen, see degree_days_for_cells
+    scratch_dir: path, optional
+        If provided, input and output grids are copied to pixel major 
+        scratch stores here (see create_scratch_stores) so reading and
+        writing a cell's time series is not spread across the whole grid.
+        Results are copied back to the output grids at the end, and the
+        stores are removed.
+    valid_mask: np.array, optional
+        2d boolean grid, True for cells with any valid data (i.e. from 
+        tiff_source.TiffSource.load). Used to find the cells to calculate
+        instead of reading the first timestep. Missing values in the time 
+        series of these cells are skipped.
+    previous_methods: np.array, optional
+        2d method map from a previous run (methods.data.npy), used as the 
+        starting method map when there is no ddc-temp-methodmap.data in
+        logging_dir, so the methods for cells not recalculated are kept.
+        See select_cells_by_method.
+    append_from: int, optional
+        If provided, the number of years already calculated in tdd, fdd, 
+        and roots, which have been extended with new years. Only a 
+        trailing window of the time series, starting append_overlap years
+        before append_from, is fit, and results are stored for the years 
+        from append_from - 1 (recalculating the last fdd, which was a copy
+        of the previous year) onward. Earlier years are not changed. 
+        Results for the new years are close to a run over all of the 
+        years, but not the same, as roots near the start of the window 
+        can move.
+    append_overlap: int, Defaults to DEFAULT_APPEND_OVERLAP
+        number of already calculated years included in the window with 
+        append_from, at least 1.
+    run_metrics: metrics.RunMetrics, optional
+        metrics for the run are added to this. Metrics are written to 
+        the logging directory (see metrics.RunMetrics.write)
+    pixel_timing: bool, Defaults to False
+        if True, the calculation time for each cell is saved to 
+        pixel-seconds.data.npy in the logging directory
+    pixel_budget: float, optional
+        seconds a cell fit with its own spline may take. Cells that take 
+        longer are abandoned, calculated with the fallback windows on a
+        piecewise linear curve, and marked with 9 in the method map 
+        (see degree_days_for_cells)
+    unit_timeout: float, optional
+        seconds a work unit may take, with num_process more than 1. Units
+        that do not finish in time (the worker is stuck, or crashed) are
+        abandoned (see scheduler.run_work_units), only the worker 
+        calculating the unit is stopped. They are retried with the 
+        'linear' method and fallback windows once all other units are 
+        done, without fitting a spline for any cell (see 
+        degree_days_for_cells linear_fallback). The cells of retried units
+        are marked with 9 in the method map.
     
     Returns
     -------
@@ -268,11 +1265,11 @@ def calc_grid_degree_days (
     tdd = data['tdd']
     fdd = data['fdd']
     roots = data['roots']
-    w_lock = Lock()
+
+    if log is None:
+        log = {'Element Messages': [], 'verbose': 0}
     
-    if num_process == 1:
-        num_process += 1 # need to have a better fix?
-    elif num_process is None:
+    if num_process is None:
        num_process = cpu_count()
 
     shape=monthly_temps.config['grid_shape']
@@ -289,13 +1286,30 @@ def calc_grid_degree_days (
     )
     if mode == 'w+':
         method_map[:] = np.nan
+        if not previous_methods is None:
+            method_map[:] = previous_methods
+
+    if run_metrics is None:
+        run_metrics = metrics.RunMetrics()
+    run_metrics.num_process = num_process
+    pixel_seconds = None
+    if pixel_timing:
+        ps = os.path.join(logging_dir,'ddc-temp-pixel-seconds.data')
+        exists = os.path.exists(ps)
+        pixel_seconds = np.memmap(
+            ps, shape=shape, dtype = float, mode='r+' if exists else 'w+',
+        )
+        if not exists:
+            pixel_seconds[:] = np.nan
     
 
     print('Calculating valid indices!')
 
     # indices = range(start, temp_grid.shape[1])
-    init = monthly_temps[monthly_temps.config['start_timestep']].flatten()
-    indices = ~np.isnan(init)
+    if valid_mask is None:
+        init = monthly_temps[monthly_temps.config['start_timestep']]
+        valid_mask = ~np.isnan(init)
+    indices = np.asarray(valid_mask).flatten()
     if not recalc_mask is None:
         mask = recalc_mask.flatten()
         indices = np.logical_and(indices, mask)
@@ -309,59 +1323,137 @@ def calc_grid_degree_days (
 
     indices = indices[indices > start]
 
-    n_cells = shape[0] * shape[1]
-
-    with Bar('Calculating Degree-days',  max=n_cells, suffix='%(percent)d%% - %(index)d / %(max)d') as bar:
-        for idx in indices: # flatted area grid index
-            row, col = np.unravel_index(idx, shape)
-            while len(active_children()) >= num_process:
-                continue
-            [gc.collect(i) for i in range(3)] # garbage collection
-            # log['Element Messages'].append(
-            #     'calculating degree days for element ' + str(idx) + \
-            #     '. ~' + '%.2f' % ((idx/n_cells) * 100) + '% complete.'
-            # )
-            # if log['verbose'] >= 2:
-                # print(log['Element Messages'][-1])
-
-            # if (monthly_temps[:,row, col] == -9999).all() or \
-            #         (np.isnan(monthly_temps[:,idx])).all():
-            #     monthly_temps[:,row, col] = np.nan
-            #     monthly_temps[:,row, col] = np.nan
-            #     if not roots_grid is None:
-            #         roots_grid[:,idx] = np.nan
-            #     log['Element Messages'].append(
-            #         'Skipping element for missing values at ' + str(idx)
-            #     )
-            #     print(log['Element Messages'][-1])
-            #     continue
-
-            index = row, col
-            if num_process == 1:
-                calc_degree_days_for_cell(
-                    index, monthly_temps, tdd, fdd, roots,  
-                    method_map, w_lock, log, use_fallback
+    stores = None
+    if scratch_dir:
+        print('Creating pixel major scratch stores!')
+        with run_metrics.stage('scratch-copy-in'):
+            stores = create_scratch_stores(data, scratch_dir, tile_shape)
+
+    days = np.asarray(monthly_temps.convert_timesteps_to_julian_days())
+    timesteps = list(monthly_temps.config['grid_name_map'].keys())
+    num_years = tdd.config['num_timesteps']
+
+    ## with append_from, only the window of years from window_start is fit
+    window_start, first_year = 0, 0
+    if not append_from is None:
+        window_start = max(0, append_from - max(1, append_overlap))
+        first_year = append_from - 1
+    window = slice(window_start * MONTHS_PER_YEAR, None)
+    day_offset = days[window][0]
+
+    basis = None
+    if method == 'batch-spline':
+        basis = batch_spline.create_basis(days[window] - day_offset, smoothing)
+    elif method == 'windowed-spline':
+        basis = windowed.create_bases(
+            days[window] - day_offset, num_years - window_start, 
+            smoothing = smoothing
+        )
+    ## workers attach to the grids by name instead of inheriting them
+    shared_data = share_grids(stores if stores else data)
+    shared_map = shared.share(method_map)
+    shared_seconds = shared.share(pixel_seconds)
+    context = {
+        'data': shared_data, 'method_map': shared_map, 
+        'pixel_seconds': shared_seconds,
+        'logging_dir': logging_dir, 'verbose': log.get('verbose', 0), 
+        'grid_shape': shape, 'tile_shape': tile_shape,
+        'days': days[window] - day_offset, 
+        'num_years': num_years - window_start,
+        'use_fallback': use_fallback, 'method': method, 'basis': basis,
+        'windows': season_windows(timesteps[window]),
+        'use_prescreen': use_prescreen, 
+        'prescreen_options': prescreen_options, 'pixel_budget': pixel_budget,
+        'retry': False, 'timesteps': window, 
+        'skip_years': first_year - window_start,
+        'day_offset': day_offset, 'first_year': first_year,
+    }
+
+    ## work units already finished by an interrupted run are skipped
+    completed = journal.CompletionJournal(
+        os.path.join(logging_dir, 'ddc-temp-journal.txt'),
+        {
+            'grid_shape': list(shape), 'tile_shape': list(tile_shape),
+            'selection': journal.selection_digest(indices),
+            'scratch_dir': scratch_dir, 'append_from': append_from,
+        }
+    )
+    if len(completed) > 0:
+        print('Resuming, %i work units already complete' % len(completed))
+    else:
+        run_log.clear(logging_dir)
+    units = [
+        cells for cells in scheduler.tile_cells(indices, shape, tile_shape)
+            if not scheduler.tile_id(cells, shape, tile_shape) in completed
+    ]
+    n_failed = 0
+
+    def run_units ():
+        """run work units, and retry the units that timed out with the
+        linear method and fallback windows
+        """
+        timed_out = []
+        for cells, result in scheduler.run_work_units(
+                process_work_unit, units, num_process, chunk_size, 
+                initializer = init_worker, initargs = (context, ), 
+                timeout = unit_timeout
+            ):
+            if isinstance(result, scheduler.WorkUnitTimeout):
+                timed_out.append(cells)
+            else:
+                yield cells, result
+        if timed_out:
+            print(
+                'Retrying %i work units that timed out with the linear'
+                ' method' % len(timed_out)
+            )
+            retry = dict(
+                context, method = 'linear', use_fallback = True, 
+                use_prescreen = False, retry = True
+            )
+            yield from scheduler.run_work_units(
+                process_work_unit, timed_out, num_process, 1, 
+                initializer = init_worker, initargs = (retry, ), 
+                timeout = unit_timeout
+            )
+
+    with run_metrics.stage('calculate'), Bar('Calculating Degree-days',  max=len(indices), suffix='%(percent)d%% - %(index)d / %(max)d') as bar:
+        bar.next(len(indices) - sum(len(cells) for cells in units))
+        for cells, result in run_units():
+            if isinstance(result, scheduler.WorkUnitError):
+                log['Element Messages'].append(
+                    'Error calculating degree days for tile at ' + 
+                    str(tuple(cells[0])) + ': ' + str(result)
                 )
+                print(log['Element Messages'][-1])
+                n_failed += 1
             else:
-                Process(
-                    target=calc_degree_days_for_cell,
-                    name = "calc degree day at elem " + str(idx),
-                    args = (
-                        index, monthly_temps, tdd, fdd, roots,  
-                        method_map, w_lock, log,  use_fallback,
-                    )
-                ).start()
-            bar.index = idx-1
-            bar.next()
-    
-    while len(active_children()) > 0 :
-        if len(active_children()) == 1:
-            from multiprocessing.managers import DictProxy
-            if type(log) is DictProxy:
-                # this means the log is probably locking things up 
-                break
-            
-        continue
+                completed.add(scheduler.tile_id(cells, shape, tile_shape))
+                run_metrics.add_unit(result)
+            bar.next(len(cells))
+
+    _worker.clear()
+    for handle in list(shared_data.values()) + [shared_map, shared_seconds]:
+        if isinstance(handle, shared.SharedArray):
+            handle.release()
+
+    if stores:
+        print('Copying results from pixel major scratch stores!')
+        with run_metrics.stage('scratch-copy-out'):
+            for key in ['tdd', 'fdd', 'roots']:
+                stores[key].to_view(grid_view(data[key]))
+        for store in stores.values():
+            store.remove()
+
+    ## keep the journal (and worker logs) if units failed, so a rerun only 
+    ## retries them
+    summary = run_log.collect(logging_dir, remove = n_failed == 0)
+    log['Element Messages'].extend(summary['Element Messages'])
+    log['Spline Errors'] = summary['Spline Errors']
+    if n_failed == 0:
+        completed.remove()
+    else:
+        completed.close()
 
     if logging_dir:
         try: 
@@ -369,13 +1461,36 @@ def calc_grid_degree_days (
         except:
             pass
         np.save(os.path.join(logging_dir, 'methods.data'), method_map)
+        if pixel_timing:
+            np.save(
+                os.path.join(logging_dir, 'pixel-seconds.data'), pixel_seconds
+            )
+        with open(os.path.join(logging_dir, 'spline-errors.csv'), 'w') as fd:
+            fd.write('row,col,message\n')
+            for row, col, msg in log['Spline Errors']:
+                fd.write('%i,%i,%s\n' % (row, col, msg))
         with open(os.path.join(logging_dir, 'methods.readme.txt'), 'w') as fd:
             fd.write(
                 'Nan values -> no input-data\n'
                 '1 -> default spline method used\n'
                 '2 -> range spline method used\n'
+                '3 -> range spline method used, after default spline '
+                    'method failed\n'
+                '4 -> range spline method used, default spline method '
+                    'predicted to fail by prescreen\n'
+                '5 -> windowed spline method used\n'
+                '6 -> windowed spline method used, range spline method '
+                    'used for some years\n'
+                '7 -> linear method used\n'
+                '8 -> linear method used with range (fallback) windows\n'
+                '9 -> linear method used with range (fallback) windows, '
+                    'after the time budget for the pixel (or its work unit)'
+                    ' was exceeded\n'
             )
 
+        run_metrics.failed_units = n_failed
+        run_metrics.write(logging_dir)
+
 
 def log(logging_dir, data):
     """old style logging
@@ -402,38 +1517,142 @@ def log(logging_dir, data):
         os.path.join(logging_dir, "temp-tdd-pre-cleanup.data")
     )        
 
+def neighborhood_values (block, rows, cols, func = np.nanmean):
+    """Get the value from the 3x3 neighborhood of cells in a block of 
+    data, for all timesteps at once. Infinite and missing values are 
+    ignored, and the neighborhoods of cells on the edges of the block 
+    only include cells in the block.
+
+    Parameters
+    ----------
+    block: np.array
+        3d (timestep, row, col) data
+    rows, cols: np.array
+        index of cells in block
+    func: function, Defaults to np.nanmean
+        function called on the neighborhood values of each cell 
+        (shape: timestep, cell, 9) with axis = -1. np.nanmean is 
+        calculated directly from the sums and counts of the values.
+
+    Returns
+    -------
+    np.array
+        timestep by cell, np.nan where there are no values in a 
+        neighborhood
+    """
+    block = np.array(block, dtype=float)
+    block[np.isinf(block)] = np.nan
+    padded = np.pad(
+        block, ((0, 0), (1, 1), (1, 1)), constant_values = np.nan
+    )
+    ## padded row + 0 is the row above the cell
+    windows = sliding_window_view(padded, (3, 3), axis = (1, 2))
+    windows = windows[:, rows, cols].reshape(block.shape[0], len(rows), 9)
+
+    if func is np.nanmean:
+        finite = np.isfinite(windows)
+        counts = finite.sum(axis = -1)
+        sums = np.where(finite, windows, 0).sum(axis = -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return func(windows, axis = -1)
+
+def propagate_values (block, rows, cols, func = np.nanmean):
+    """Get values for cells in a block of data from their 3x3 
+    neighborhoods (see neighborhood_values), repeated until every cell 
+    has a value. Each pass fills the cells (and timesteps) without a value
+    from their neighbors with values, so values propagate inward from 
+    the edges of missing regions, nearest cells first. The number of 
+    passes is the largest distance (in cells) from a missing cell to a 
+    value.
+
+    Parameters
+    ----------
+    block: np.array
+        3d (timestep, row, col) data
+    rows, cols: np.array
+        index of cells in block
+    func: function, Defaults to np.nanmean
+        see neighborhood_values
+
+    Returns
+    -------
+    np.array
+        timestep by cell, np.nan only where there are no values in the 
+        block for a timestep
+    """
+    block = np.array(block, dtype=float)
+    block[np.isinf(block)] = np.nan
+    values = neighborhood_values(block, rows, cols, func)
+    missing = np.isnan(values)
+    while missing.any():
+        block[:, rows, cols] = values
+        pending = missing.any(axis = 0)
+        new = neighborhood_values(block, rows[pending], cols[pending], func)
+        filled = missing[:, pending] & ~np.isnan(new)
+        if not filled.any():
+            break
+        values[:, pending] = np.where(filled, new, values[:, pending])
+        missing[:, pending] &= ~filled
+    return values
+
+FILL_METHODS = {
+    'neighborhood': neighborhood_values, 
+    'propagate': propagate_values,
+}
+
 def fill_missing_by_interpolation(
         data, locations, log, func=np.nanmean, reset_locations = False,
-        loc_type = 'map'
+        loc_type = 'map', fill_method = 'neighborhood'
     ):
-    """
+    """Fill cells with the value from their 3x3 neighborhood (see
+    neighborhood_values) for every timestep. All cells are filled at once
+    from the values before filling, in chunks of timesteps. With the 
+    'propagate' fill_method, cells in large missing regions are filled
+    in the same call (see propagate_values).
+
     Parameters
     ----------
     data: TemporalGrid
     locations: np.array
+        2d boolean map of cells to fill, or (row, col) locations if 
+        loc_type is 'list'
     log: dict like
         logging dict
+    func: function, Defaults to np.nanmean
+        see neighborhood_values
     reset_locations: bool
         if true reset cells at locations == True to -np.inf before 
-        running interpolation
+        running interpolation, so their values are not used
+    loc_type: str, Defaults to 'map'
+        'map' or 'list'
+    fill_method: str, Defaults to 'neighborhood'
+        key in FILL_METHODS, 'neighborhood' for one pass, or 'propagate'
+        to fill every cell
     """
+    fill_values = FILL_METHODS[fill_method]
     ## fix missing cells
     if loc_type == 'list': # list of tuple locations or set
-        m_rows, m_cols  = np.array(list(locations)).T
+        m_rows, m_cols  = np.array(list(locations)).reshape(-1, 2).T
     else: # loctype == map
         m_rows, m_cols = np.where(locations == True)   
    
     log['Element Messages'].append(
-        'Interpolating missing data pixels using: %s' % func.__name__ 
+        'Interpolating missing data pixels using: %s, %s' % (
+            func.__name__, fill_method
+        )
     )
     if log['verbose'] >= 1:
         print(log['Element Messages'][-1])
 
-    # for grid_type in ['fdd', 'tdd', 'roots']:
-    #     loop_data = data[grid_type]
-
-    len_cells = range(len(m_rows))
-    loop_data = data
+    if len(m_rows) == 0:
+        return
+    
+    view = grid_view(data)
+    n_timesteps = view.shape[0]
+    n_rows, n_cols = view.shape[1:]
     if reset_locations:
         log['Element Messages'].append(
             "Resetting (to -np.inf) Missing Locations Before Processing..."
@@ -441,27 +1660,24 @@ def fill_missing_by_interpolation(
         if log['verbose'] >= 1:
             print(log['Element Messages'][-1])
 
-        for cell in len_cells:
-            row, col = m_rows[cell], m_cols[cell]
-            for year in loop_data.timestep_range():
-                ix = year - loop_data.config['start_timestep']
-                loop_data.grids[ix].reshape(loop_data.config['grid_shape'])[row, col] = -np.inf
-
-    print('processing')
-    with Bar('Processing: %s' % 'grid_type',  max=len(len_cells)) as bar:
-        for cell in len_cells:
-            # f_index = m_rows[cell] * shape[1] + m_cols[cell]  # 'flat' index of
-            # cell location
-            row, col = m_rows[cell], m_cols[cell]
-            kernel = np.array(loop_data[:,row-1:row+2,col-1:col+2])
-            
-            kernel[np.isinf(kernel)] = np.nan #clean kernel
-
-            # mean = np.nanmean(kernel.reshape(tdd_grid.shape[0],9),axis = 1)
-            loop_data[:, row, col] = np.nanmean(kernel, axis = 1).mean(1)
+    ## only the block around the cells is read
+    r_0, r_1 = max(m_rows.min() - 1, 0), min(m_rows.max() + 2, n_rows)
+    c_0, c_1 = max(m_cols.min() - 1, 0), min(m_cols.max() + 2, n_cols)
+    rows, cols = m_rows - r_0, m_cols - c_0
+    step_bytes = 8 * ((r_1 - r_0 + 2) * (c_1 - c_0 + 2) + 10 * len(rows))
+    chunk = int(max(1, scratch.DEFAULT_CHUNK_BYTES // step_bytes))
+
+    starts = range(0, n_timesteps, chunk)
+    with Bar('Processing: %s' % 'grid_type',  max=len(starts)) as bar:
+        for t_0 in starts:
+            region = (slice(t_0, t_0 + chunk), slice(r_0, r_1), slice(c_0, c_1))
+            block = np.array(view[region])
+            if reset_locations:
+                block[:, rows, cols] = -np.inf
+            block[:, rows, cols] = fill_values(block, rows, cols, func)
+            view[region] = block
             bar.next()
-            
-    # return cells
+    flush_grid(data)
 
 
 
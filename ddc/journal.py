@@ -0,0 +1,108 @@
+"""
+Journal
+-------
+
+Completion journal for work units, so an interrupted run can be resumed
+without recalculating (or skipping) work units.
+
+The journal is a text file. The first line is a JSON header describing the
+run (grid shape, tile shape, and a digest of the selected cells), each
+following line is the id of a completed work unit. Each id is written
+and synced to disk in a single write, and only complete lines are read
+back (a partial last line is removed), so a crash can not leave a partial 
+entry.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+def selection_digest (indices):
+    """Digest of the flattened grid cell indices selected for a run
+
+    Parameters
+    ----------
+    indices: np.array
+        flattened grid cell indices
+
+    Returns
+    -------
+    str
+    """
+    return hashlib.sha1(
+        np.asarray(indices, dtype=np.int64).tobytes()
+    ).hexdigest()
+
+class CompletionJournal (object):
+    """Append only journal of completed work units.
+
+    Parameters
+    ----------
+    path: path
+        journal file
+    header: dict
+        JSON serializable description of the run. An existing journal is
+        only used if its header is the same, otherwise it is replaced.
+    """
+    def __init__ (self, path, header):
+        self.path = path
+        self.header = json.dumps(header, sort_keys = True)
+        self.completed = self._read()
+
+        if self.completed is None:
+            self.completed = set()
+            with open(path, 'w') as fd:
+                fd.write(self.header + '\n')
+                fd.flush()
+                os.fsync(fd.fileno())
+        self.fd = open(path, 'a')
+
+    def _read (self):
+        """Read completed unit ids from an existing journal.
+
+        Returns
+        -------
+        set or None
+            None if there is no journal for the same run
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'r') as fd:
+            text = fd.read()
+        lines = text.split('\n')
+        if len(lines) == 1 or lines[0] != self.header:
+            return None
+        ## the last item is '' or a partial line, which is removed so the 
+        ## next id is not appended to it
+        if lines[-1]:
+            os.truncate(self.path, len(text) - len(lines[-1]))
+        return set(int(line) for line in lines[1:-1] if line)
+
+    def __contains__ (self, unit_id):
+        return unit_id in self.completed
+
+    def __len__ (self):
+        return len(self.completed)
+
+    def add (self, unit_id):
+        """Record a unit as completed. The unit's results should be on disk
+        before this is called.
+
+        Parameters
+        ----------
+        unit_id: int
+        """
+        self.fd.write('%i\n' % unit_id)
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.completed.add(unit_id)
+
+    def close (self):
+        """Close journal file"""
+        self.fd.close()
+
+    def remove (self):
+        """Close and delete journal file"""
+        self.close()
+        os.remove(self.path)
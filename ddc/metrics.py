@@ -0,0 +1,175 @@
+"""
+Metrics
+-------
+
+Performance metrics for a run: wall time of each stage, pixels per second,
+methods used for the cells calculated, smoothing factor search effort, and
+worker utilization. Metrics are written to the logging directory as
+metrics.json, and as metric,value rows in metrics.csv.
+"""
+import json
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+## method map values, see methods.readme.txt in the logging directory
+METHOD_NAMES = {
+    1: 'spline',
+    2: 'fallback',
+    3: 'fallback after spline failed',
+    4: 'fallback predicted by prescreen',
+    5: 'windowed spline',
+    6: 'windowed spline with fallback years',
+    7: 'linear',
+    8: 'linear with fallback windows',
+    9: 'fallback after time budget exceeded',
+}
+## cells with method map value 1, after a search for a smoothing factor
+SEARCHED_SPLINE = 'spline after smoothing factor search'
+
+def count_methods (methods, searched = None):
+    """Count the cells calculated with each method. Cells calculated with 
+    the spline method after a search for a smoothing factor are counted as
+    SEARCHED_SPLINE instead of 'spline'.
+
+    Parameters
+    ----------
+    methods: np.array
+        method map value for each cell
+    searched: np.array, optional
+        boolean array, cells where a smoothing factor was searched for
+
+    Returns
+    -------
+    dict
+        number of cells for each method name
+    """
+    methods = np.asarray(methods, dtype=float)
+    if searched is None:
+        searched = np.zeros(methods.shape, dtype=bool)
+    after_search = searched & (methods == 1)
+    codes, counts = np.unique(
+        methods[~np.isnan(methods) & ~after_search], return_counts = True
+    )
+    named = {
+        METHOD_NAMES.get(int(code), str(code)): int(count)
+            for code, count in zip(codes, counts)
+    }
+    if after_search.any():
+        named[SEARCHED_SPLINE] = int(after_search.sum())
+    return named
+
+class RunMetrics (object):
+    """Metrics collected during a run"""
+    def __init__ (self):
+        self.stages = {}
+        self.units = []
+        self.failed_units = 0
+        self.num_process = 1
+        self.methods = {}
+
+    @contextmanager
+    def stage (self, name):
+        """Time a stage of a run, times for stages with the same name
+        are added
+
+        Parameters
+        ----------
+        name: str
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = \
+                self.stages.get(name, 0) + perf_counter() - start
+
+    def add_unit (self, stats):
+        """Add the stats of a finished work unit
+
+        Parameters
+        ----------
+        stats: dict
+            from calc_degree_days.process_work_unit. The unit's 'methods' 
+            counts (see count_methods) are added to the run's
+        """
+        self.units.append(stats)
+        for name, count in stats.get('methods', {}).items():
+            self.methods[name] = self.methods.get(name, 0) + count
+
+    def summary (self):
+        """Summary of metrics
+
+        Returns
+        -------
+        dict
+        """
+        pixels = sum(unit['cells'] for unit in self.units)
+        busy = {}
+        for unit in self.units:
+            busy[unit['pid']] = busy.get(unit['pid'], 0) + unit['seconds']
+        calculate = self.stages.get('calculate', 0)
+
+        return {
+            'stages': dict(self.stages),
+            'pixels': pixels,
+            'pixels_per_second': pixels / calculate if calculate else None,
+            'units': len(self.units),
+            'failed_units': self.failed_units,
+            'methods': dict(self.methods),
+            'smoothing': {
+                'searches': sum(
+                    unit['smoothing_searches'] for unit in self.units
+                ),
+                'tries': sum(unit['smoothing_tries'] for unit in self.units),
+            },
+            'workers': {
+                'num_process': self.num_process,
+                'busy_seconds': {str(pid): s for pid, s in busy.items()},
+                'utilization': sum(busy.values()) / \
+                    (calculate * self.num_process) if calculate else None,
+            },
+        }
+
+    def write (self, logging_dir):
+        """Write metrics.json and metrics.csv
+
+        Parameters
+        ----------
+        logging_dir: path
+
+        Returns
+        -------
+        dict
+            summary
+        """
+        summary = self.summary()
+        with open(os.path.join(logging_dir, 'metrics.json'), 'w') as fd:
+            json.dump(summary, fd, indent = 2)
+        with open(os.path.join(logging_dir, 'metrics.csv'), 'w') as fd:
+            fd.write('metric,value\n')
+            for key, value in flatten(summary):
+                fd.write('%s,%s\n' % (key, '' if value is None else value))
+        return summary
+
+def flatten (summary, prefix = ''):
+    """Flatten nested dicts to (dotted key, value) pairs
+
+    Parameters
+    ----------
+    summary: dict
+    prefix: str
+
+    Returns
+    -------
+    list
+    """
+    items = []
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            items += flatten(value, prefix + key + '.')
+        else:
+            items.append((prefix + key, value))
+    return items
@@ -0,0 +1,495 @@
+"""
+Piecewise
+---------
+
+Vectorized root finding and integration for the fitted splines (piecewise
+polynomials) of many pixels.
+
+Piecewise polynomials are stored as dicts with:
+    'breaks': np.array, shape (n intervals + 1,). Shared by all pixels.
+    'coefficients': np.array, shape (degree + 1, n intervals, n pixels).
+        Highest power first, in the local coordinates of each interval,
+        the same convention as scipy.interpolate.PPoly.
+"""
+from math import factorial
+
+import numpy as np
+from scipy import interpolate
+
+ROOT_TOLERANCE = 1e-9 # days
+
+def from_bspline (basis, coefficients):
+    """Convert batch splines to piecewise polynomials.
+
+    Parameters
+    ----------
+    basis: dict
+        shared basis from batch_spline.create_basis
+    coefficients: np.array
+        2d array of spline coefficients, coefficient by pixel, from
+        batch_spline.fit_splines
+
+    Returns
+    -------
+    dict
+        piecewise polynomials
+    """
+    degree = basis['degree']
+    breaks = np.unique(basis['knots'])
+    spline = interpolate.BSpline(basis['knots'], coefficients, degree)
+
+    pp_coefs = np.empty((degree + 1, len(breaks) - 1, coefficients.shape[1]))
+    for nu in range(degree + 1):
+        pp_coefs[degree - nu] = spline(breaks[:-1], nu=nu) / factorial(nu)
+    return {'breaks': breaks, 'coefficients': pp_coefs}
+
+def from_samples (x, values):
+    """Piecewise linear polynomials through samples (i.e. monthly means) 
+    of many pixels.
+
+    Parameters
+    ----------
+    x: np.array
+        increasing sample positions (i.e. days), shared by all pixels
+    values: np.array
+        2d array of samples, sample by pixel, without missing values
+
+    Returns
+    -------
+    dict
+        piecewise polynomials, degree 1
+    """
+    x = np.asarray(x, dtype=float)
+    values = np.asarray(values, dtype=float)
+    slopes = np.diff(values, axis=0) / np.diff(x)[:, np.newaxis]
+    return {'breaks': x, 'coefficients': np.stack([slopes, values[:-1]])}
+
+def from_spline (spline):
+    """Convert a single spline to a piecewise polynomial for one pixel.
+
+    Parameters
+    ----------
+    spline: scipy.interpolate.UnivariateSpline, BSpline, or PPoly
+
+    Returns
+    -------
+    dict
+        piecewise polynomial
+    """
+    if isinstance(spline, interpolate.UnivariateSpline):
+        spline = interpolate.PPoly.from_spline(spline._eval_args)
+    elif not isinstance(spline, interpolate.PPoly):
+        spline = interpolate.PPoly.from_spline(spline)
+
+    ## drop zero width intervals from repeated knots
+    keep = np.diff(spline.x) > 0
+    breaks = np.append(spline.x[:-1][keep], spline.x[-1])
+    return {
+        'breaks': breaks,
+        'coefficients': spline.c[:, keep, np.newaxis],
+    }
+
+def select (pp, pixels):
+    """Select pixels from piecewise polynomials.
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    pixels: np.array
+        boolean or integer index of pixels to select
+
+    Returns
+    -------
+    dict
+        piecewise polynomials for selected pixels
+    """
+    return {
+        'breaks': pp['breaks'],
+        'coefficients': pp['coefficients'][:, :, pixels]
+    }
+
+def _evaluate_local (coefficients, s):
+    """evaluate polynomials in local coordinates with horner's method.
+    coefficients is (degree + 1, ...) and broadcasts with s.
+    """
+    values = np.zeros(np.broadcast_shapes(coefficients.shape[1:], s.shape))
+    for coef in coefficients:
+        values = values * s + coef
+    return values
+
+def _critical_points (coefficients, widths):
+    """find points inside each interval where the slope is zero. Returns
+    array shape (degree - 1, n intervals, n pixels) with points outside of
+    the interval set to the interval width.
+    """
+    degree = coefficients.shape[0] - 1
+    shape = coefficients.shape[1:]
+    widths = widths[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if degree == 3:
+            a = 3 * coefficients[0]
+            b = 2 * coefficients[1]
+            c = coefficients[2]
+            disc = np.sqrt(b ** 2 - 4 * a * c)
+            q = -0.5 * (b + np.where(b < 0, -1, 1) * disc)
+            points = np.stack([
+                np.where(a == 0, -c / b, q / a),
+                np.where(a == 0, np.nan, c / q)
+            ])
+        elif degree == 2:
+            points = (-coefficients[1] / (2 * coefficients[0]))[np.newaxis]
+        else:
+            return np.empty((0,) + shape)
+
+    inside = np.isfinite(points) & (points > 0) & (points < widths)
+    return np.where(inside, points, np.broadcast_to(widths, shape))
+
+def find_roots (pp, tolerance = ROOT_TOLERANCE):
+    """Find all zero crossings for many pixels at once.
+
+    Each interval is split in to monotonic segments at its critical points
+    and each segment with a sign change contains exactly one root, which is
+    found by bisection for all segments at once (or directly for linear
+    polynomials).
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials, degree 3 or less
+    tolerance: float, Defaults to ROOT_TOLERANCE
+        tolerance of roots
+
+    Returns
+    -------
+    roots: np.array
+        2d array of sorted roots, pixel by root, padded with np.nan
+    counts: np.array
+        number of roots for each pixel
+    """
+    breaks = pp['breaks']
+    coefficients = pp['coefficients']
+    n_intervals, n_pixels = coefficients.shape[1:]
+    widths = np.diff(breaks)
+
+    points = np.concatenate([
+        np.zeros((1, n_intervals, n_pixels)),
+        _critical_points(coefficients, widths),
+        np.broadcast_to(widths[:, np.newaxis], (1, n_intervals, n_pixels)),
+    ])
+    points.sort(axis=0)
+    values = _evaluate_local(coefficients[:, np.newaxis], points)
+
+    ## roots at the end of a segment belong to that segment, so roots at
+    ## interval boundaries are only counted once
+    lo_vals, hi_vals = values[:-1], values[1:]
+    crossing = (lo_vals * hi_vals < 0) | ((hi_vals == 0) & (lo_vals != 0))
+
+    ## pixel, interval, segment order gives sorted roots for each pixel
+    crossing = crossing.transpose(2, 1, 0)
+    pixel, interval, segment = np.nonzero(crossing)
+    lo = points[segment, interval, pixel]
+    hi = points[segment + 1, interval, pixel]
+    lo_sign = np.sign(lo_vals[segment, interval, pixel])
+    local_coefs = coefficients[:, interval, pixel]
+
+    exact = hi_vals[segment, interval, pixel] == 0
+    if coefficients.shape[0] == 2:
+        ## linear, segments with a sign change have a non zero slope
+        with np.errstate(divide='ignore', invalid='ignore'):
+            local = -local_coefs[1] / local_coefs[0]
+        found = np.where(exact, hi, local) + breaks[interval]
+    else:
+        n_iterations = int(
+            np.ceil(np.log2(max(widths.max(), tolerance) / tolerance))
+        )
+        for _ in range(n_iterations):
+            mid = (lo + hi) / 2
+            same = np.sign(_evaluate_local(local_coefs, mid)) == lo_sign
+            lo = np.where(same, mid, lo)
+            hi = np.where(same, hi, mid)
+        found = np.where(exact, hi, (lo + hi) / 2) + breaks[interval]
+
+    counts = np.bincount(pixel, minlength=n_pixels)
+    roots = np.full((n_pixels, counts.max(initial=0)), np.nan)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    roots[pixel, np.arange(len(pixel)) - offsets[pixel]] = found
+    return roots, counts
+
+def antiderivative (pp, x):
+    """Evaluate the antiderivative of piecewise polynomials, starting from
+    the first break. Outside of the breaks the polynomials are treated as
+    zero (like FITPACK's splint).
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    x: np.array
+        2d array of points, pixel by point. np.nan values are allowed
+
+    Returns
+    -------
+    np.array
+        values, pixel by point
+    """
+    breaks = pp['breaks']
+    coefficients = pp['coefficients']
+    degree = coefficients.shape[0] - 1
+    n_intervals, n_pixels = coefficients.shape[1:]
+
+    powers = np.arange(degree + 1, 0, -1)[:, np.newaxis, np.newaxis]
+    anti_coefs = np.concatenate([
+        coefficients / powers, np.zeros((1, n_intervals, n_pixels))
+    ])
+    totals = _evaluate_local(anti_coefs, np.diff(breaks)[:, np.newaxis])
+    cumulative = np.concatenate([np.zeros((1, n_pixels)), totals.cumsum(0)])
+
+    x = np.asarray(x, dtype=float)
+    missing = np.isnan(x)
+    x = np.clip(np.where(missing, breaks[0], x), breaks[0], breaks[-1])
+    interval = np.clip(
+        np.searchsorted(breaks, x, side='right') - 1, 0, n_intervals - 1
+    )
+    pixel = np.arange(n_pixels)[:, np.newaxis]
+    values = cumulative[interval, pixel] + _evaluate_local(
+        anti_coefs[:, interval, pixel], x - breaks[interval]
+    )
+    values[missing] = np.nan
+    return values
+
+def integrate (pp, a, b):
+    """Integrate piecewise polynomials from a to b.
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    a, b: np.array
+        2d arrays of integration limits, pixel by limit
+
+    Returns
+    -------
+    np.array
+        values, pixel by limit
+    """
+    return antiderivative(pp, b) - antiderivative(pp, a)
+
+def spline_degree_days (pp, roots, counts, num_years):
+    """Calculate degree days for many pixels with the default spline method.
+    Vectorized version of calc_degree_days.degree_days_from_roots.
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    roots: np.array
+        roots, pixel by root, from find_roots
+    counts: np.array
+        number of roots for each pixel, from find_roots
+    num_years: int
+        number of years of data
+
+    Returns
+    -------
+    tdd: np.array
+        pixel by year
+    fdd: np.array
+        pixel by year. The last year is a dummy value of +8000
+    roots: np.array
+        pixel by 2 * num_years
+    success: np.array
+        boolean array, pixels where the method was successful. Only
+        these pixels have values in tdd, fdd and roots
+    """
+    expected_roots = 2 * num_years
+    success = counts == expected_roots
+
+    found = roots[success][:, :expected_roots].reshape(-1, expected_roots)
+    antideriv = antiderivative(select(pp, success), found)
+    vals = np.diff(antideriv, axis=1)
+    thawing = vals > 0
+
+    seasons = thawing.sum(axis=1) == num_years
+    found, vals, thawing = found[seasons], vals[seasons], thawing[seasons]
+    success[success] = seasons
+
+    n_pixels = len(found)
+    tdd = vals[thawing].reshape(n_pixels, num_years)
+    fdd = np.concatenate([
+        vals[~thawing].reshape(n_pixels, num_years - 1),
+        np.full((n_pixels, 1), 8000.0) # dummy value
+    ], axis=1)
+
+    signed = np.where(thawing, found[:, :-1], -1 * found[:, :-1])
+    last = found[:, -1] * signed[:, -1]/np.abs(signed[:, -1]) * -1
+    signed_roots = np.concatenate([signed, last[:, np.newaxis]], axis=1)
+
+    return tdd, fdd, signed_roots, success
+
+def _count_roots_before (roots, counts, points):
+    """count the roots <= each of the (shared) points for every pixel.
+    returns array pixel by point.
+    """
+    points = np.asarray(points, dtype=float)
+    order = np.argsort(points)
+    n_pixels = len(counts)
+    valid = np.arange(roots.shape[1]) < counts[:, np.newaxis]
+    pixel = np.broadcast_to(
+        np.arange(n_pixels)[:, np.newaxis], roots.shape
+    )[valid]
+    ## first sorted point each root is <= to
+    first = np.searchsorted(points[order], roots[valid], side='left')
+    hist = np.zeros((n_pixels, len(points) + 1), dtype=int)
+    np.add.at(hist, (pixel, first), 1)
+    before = hist.cumsum(axis=1)[:, :-1]
+    return before[:, np.argsort(order)]
+
+def _season_integral (pp, roots, counts, antideriv, window, part):
+    """integrate the positive (part = 1) or negative (part = -1) parts
+    of piecewise polynomials over a (shared) window for each year. The 
+    window is split at every root in (start, end].
+
+    returns values and the first point after start (first root or end), 
+    both pixel by year
+    """
+    n_pixels = len(counts)
+    starts = np.broadcast_to(window[:, 0], (n_pixels, len(window)))
+    ends = np.broadcast_to(window[:, 1], (n_pixels, len(window)))
+    clip = lambda vals: np.maximum(part * vals, 0) * part
+
+    ## cumulative integral of the selected part between consecutive roots
+    segments = np.nan_to_num(clip(np.diff(antideriv, axis=1)))
+    cumulative = np.concatenate(
+        [np.zeros((n_pixels, 1)), segments.cumsum(axis=1)], axis=1
+    )
+
+    first = _count_roots_before(roots, counts, window[:, 0])
+    last = _count_roots_before(roots, counts, window[:, 1]) - 1
+    in_window = last >= first
+    first_idx = np.clip(first, 0, max(roots.shape[1] - 1, 0))
+    last_idx = np.clip(last, 0, max(roots.shape[1] - 1, 0))
+    if roots.shape[1] == 0:
+        first_root = last_root = np.full(starts.shape, np.nan)
+        inner = np.zeros(starts.shape)
+    else:
+        first_root = np.take_along_axis(roots, first_idx, axis=1)
+        last_root = np.take_along_axis(roots, last_idx, axis=1)
+        inner = np.take_along_axis(cumulative, last_idx, axis=1) - \
+            np.take_along_axis(cumulative, first_idx, axis=1)
+    
+    a_start = antiderivative(pp, starts)
+    a_end = antiderivative(pp, ends)
+    split = clip(antiderivative(pp, first_root) - a_start) + inner + \
+        clip(a_end - antiderivative(pp, last_root))
+    values = np.where(in_window, split, clip(a_end - a_start))
+    return values, np.where(in_window, first_root, ends)
+
+def fallback_degree_days (pp, roots, counts, windows):
+    """Calculate degree days for many pixels with the fallback method, 
+    by integrating the positive parts of the splines over fixed thawing 
+    season windows and negative parts over fixed freezing season windows.
+    Vectorized version of the fallback method in 
+    calc_degree_days.calc_degree_days_for_cell.
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    roots: np.array
+        roots, pixel by root, from find_roots
+    counts: np.array
+        number of roots for each pixel, from find_roots
+    windows: dict
+        'tdd' and 'fdd' season windows, arrays of (start, end) days for 
+        each year, from calc_degree_days.fallback_windows
+
+    Returns
+    -------
+    tdd: np.array
+        pixel by year
+    fdd: np.array
+        pixel by year. The last year is only a partial season
+    roots: np.array
+        pixel by 2 * num_years. First root (or end) of the thawing season, 
+        and negative first root (or end) of the freezing season for 
+        each year.
+    """
+    antideriv = antiderivative(pp, roots)
+    tdd, tdd_roots = _season_integral(
+        pp, roots, counts, antideriv, windows['tdd'], 1
+    )
+    fdd, fdd_roots = _season_integral(
+        pp, roots, counts, antideriv, windows['fdd'], -1
+    )
+    signed_roots = np.stack([tdd_roots, -1 * fdd_roots], axis=2)
+    return tdd, fdd, signed_roots.reshape(tdd.shape[0], 2 * tdd.shape[1])
+
+def season_degree_days (pp, roots, counts, window, limits = None):
+    """Find the thawing season starting in a window (i.e. a year), and the
+    freezing season that follows it, for many pixels. Used for splines 
+    fit to a few years around the year (see windowed).
+
+    Parameters
+    ----------
+    pp: dict
+        piecewise polynomials
+    roots: np.array
+        roots, pixel by root, from find_roots
+    counts: np.array
+        number of roots for each pixel, from find_roots
+    window: tuple
+        (start, end) days, the thawing season must start in [start, end)
+    limits: tuple, optional
+        (thawing, freezing) days, the thawing season must end before 
+        limits[0] (i.e. the start of the next year's window), and the 
+        freezing season after it before limits[1] (i.e. the start of the 
+        window after that). Seasons that run over a whole winter or 
+        summer without a root are not split by the spline, and fail.
+
+    Returns
+    -------
+    tdd, fdd: np.array
+        value for each pixel. fdd is np.nan if there is no root after the
+        end of the thawing season.
+    roots: np.array
+        pixel by 2, start of thawing season and negative start of 
+        freezing season
+    success: np.array
+        boolean array, pixels with exactly one thawing season starting in
+        window, that ends within limits. Only these pixels have values.
+    """
+    n_pixels = len(counts)
+    tdd = np.full(n_pixels, np.nan)
+    fdd = np.full(n_pixels, np.nan)
+    signed_roots = np.full((n_pixels, 2), np.nan)
+    if roots.shape[1] < 2:
+        return tdd, fdd, signed_roots, np.zeros(n_pixels, dtype=bool)
+
+    vals = np.diff(antiderivative(pp, roots), axis=1)
+    starts = roots[:, :-1]
+    with np.errstate(invalid='ignore'):
+        thawing = (vals > 0) & (starts >= window[0]) & (starts < window[1])
+    success = thawing.sum(axis=1) == 1
+    season = np.argmax(thawing, axis=1)[:, np.newaxis]
+
+    take = lambda values, idx: np.take_along_axis(
+        values, np.clip(idx, 0, values.shape[1] - 1), axis=1
+    )[:, 0]
+    if not limits is None:
+        thaw_end = take(roots, season + 1)
+        freeze_end = take(roots, season + 2)
+        freeze_end[season[:, 0] + 2 >= roots.shape[1]] = np.nan
+        with np.errstate(invalid='ignore'):
+            success &= (thaw_end < limits[0]) & ~(freeze_end >= limits[1])
+
+    following = take(vals, season + 1)
+    following[season[:, 0] + 1 >= vals.shape[1]] = np.nan
+    with np.errstate(invalid='ignore'):
+        following[following >= 0] = np.nan
+
+    tdd[success] = take(vals, season)[success]
+    fdd[success] = following[success]
+    signed_roots[success, 0] = take(roots, season)[success]
+    signed_roots[success, 1] = -1 * take(roots, season + 1)[success]
+    return tdd, fdd, signed_roots, success
@@ -0,0 +1,84 @@
+"""
+Prescreen
+---------
+
+Cheap vectorized checks of monthly temperature series, used to predict
+which pixels the spline method will fail for (the spline does not have
+one thawing and one freezing season per year) so they can go straight to
+the fallback method.
+"""
+import numpy as np
+
+MONTHS_PER_YEAR = 12
+
+## defaults, in the units of the input data (i.e. degrees C)
+NEAR_ZERO = 0.5
+MIN_AMPLITUDE = 2.0
+MAX_NEAR_ZERO_FRACTION = 0.25
+
+def crossings_per_year (temps, months_per_year = MONTHS_PER_YEAR):
+    """Count the sign changes of monthly series in each year. A sign change
+    belongs to the year of the month after it.
+
+    Parameters
+    ----------
+    temps: np.array
+        2d array of monthly temperatures, timestep by pixel
+
+    Returns
+    -------
+    np.array
+        number of sign changes, year by pixel
+    """
+    signs = np.sign(temps)
+    changes = np.zeros(temps.shape, dtype=int)
+    changes[1:] = (signs[1:] * signs[:-1]) < 0
+    num_years = temps.shape[0] // months_per_year
+    return changes[:num_years * months_per_year].reshape(
+        num_years, months_per_year, -1
+    ).sum(axis=1)
+
+def prescreen (
+        temps, near_zero = NEAR_ZERO, min_amplitude = MIN_AMPLITUDE,
+        max_near_zero_fraction = MAX_NEAR_ZERO_FRACTION,
+        months_per_year = MONTHS_PER_YEAR
+    ):
+    """Predict the pixels the spline method will fail for. A pixel is
+    predicted to fail if:
+        - any year has no sign changes (no thawing or freezing season),
+        - the amplitude of the mean annual cycle is less than
+          min_amplitude, or
+        - more than max_near_zero_fraction of the years with other than
+          2 sign changes have months with in near_zero of 0.
+
+    Parameters
+    ----------
+    temps: np.array
+        2d array of monthly temperatures, timestep by pixel
+    near_zero: float, Defaults to NEAR_ZERO
+    min_amplitude: float, Defaults to MIN_AMPLITUDE
+    max_near_zero_fraction: float, Defaults to MAX_NEAR_ZERO_FRACTION
+
+    Returns
+    -------
+    np.array
+        boolean array, True for pixels predicted to fail
+    """
+    temps = np.asarray(temps, dtype=float)
+    num_years = temps.shape[0] // months_per_year
+    by_year = temps[:num_years * months_per_year].reshape(
+        num_years, months_per_year, -1
+    )
+
+    crossings = crossings_per_year(temps, months_per_year)
+    no_season = (crossings == 0).any(axis=0)
+
+    annual_cycle = by_year.mean(axis=0)
+    amplitude = annual_cycle.max(axis=0) - annual_cycle.min(axis=0)
+    flat = amplitude < min_amplitude
+
+    near_zero_years = (np.abs(by_year) < near_zero).any(axis=1)
+    noisy = ((crossings != 2) & near_zero_years).sum(axis=0) > \
+        max_near_zero_fraction * num_years
+
+    return no_season | flat | noisy
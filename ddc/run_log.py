@@ -0,0 +1,119 @@
+"""
+Run Log
+-------
+
+Logging for worker processes without a shared (Manager) log. Each worker
+keeps messages in a local buffer, and appends them to its own file in the
+logging directory after each work unit. The log files of all workers are
+collected in to a summary once, at the end of a run.
+
+Each line of a worker's log file is a JSON list:
+[unit id, row, col, message], row and col are null for messages that
+are not about a cell.
+"""
+import glob
+import json
+import os
+
+LOG_FILE_PATTERN = 'ddc-temp-log.%i.txt' # process id
+LOG_FILE_GLOB = 'ddc-temp-log.*.txt'
+
+class LogBuffer (object):
+    """Local log buffer for a worker process.
+
+    Parameters
+    ----------
+    logging_dir: path
+        directory for log files
+    verbose: int, Defaults to 0
+        messages are also printed if verbose >= their level
+    """
+    def __init__ (self, logging_dir, verbose = 0):
+        self.logging_dir = logging_dir
+        self.verbose = verbose
+        self.entries = []
+
+    def message (self, text, cell = None, level = 2):
+        """Add a message to the buffer
+
+        Parameters
+        ----------
+        text: str
+        cell: tuple, optional
+            (row, col) the message is about
+        level: int, Defaults to 2
+            verbosity level to print message at
+        """
+        row, col = (None, None) if cell is None else (int(c) for c in cell)
+        self.entries.append((row, col, text))
+        if self.verbose >= level:
+            print(text if cell is None else '%s at row: %i, col: %i' % (
+                text, row, col
+            ))
+
+    def flush (self, unit_id):
+        """Append buffered messages to this process's log file
+
+        Parameters
+        ----------
+        unit_id: int
+            id of the work unit the messages are from
+        """
+        if not self.entries:
+            return
+        path = os.path.join(self.logging_dir, LOG_FILE_PATTERN % os.getpid())
+        with open(path, 'a') as fd:
+            fd.write(''.join(
+                json.dumps([unit_id, row, col, text]) + '\n'
+                    for row, col, text in self.entries
+            ))
+        self.entries = []
+
+def collect (logging_dir, remove = True):
+    """Collect the messages from the log files of all workers. Messages
+    repeated by a work unit that was run again (i.e. when resuming) are
+    only included once.
+
+    Parameters
+    ----------
+    logging_dir: path
+    remove: bool, Defaults to True
+        if True the worker log files are removed
+
+    Returns
+    -------
+    dict
+        'Element Messages': list of messages not about a cell, and
+        'Spline Errors': list of (row, col, message), sorted by row and col
+    """
+    entries = []
+    for path in sorted(glob.glob(os.path.join(logging_dir, LOG_FILE_GLOB))):
+        with open(path, 'r') as fd:
+            for line in fd:
+                try:
+                    entries.append(tuple(json.loads(line)))
+                except ValueError:
+                    pass ## partial line from an interrupted run
+        if remove:
+            os.remove(path)
+    entries = list(dict.fromkeys(entries))
+
+    return {
+        'Element Messages': [
+            text for unit, row, col, text in entries if row is None
+        ],
+        'Spline Errors': sorted(
+            (row, col, text) for unit, row, col, text in entries
+                if not row is None
+        ),
+    }
+
+def clear (logging_dir):
+    """Remove worker log files left by an earlier run
+
+    Parameters
+    ----------
+    logging_dir: path
+    """
+    for path in glob.glob(os.path.join(logging_dir, LOG_FILE_GLOB)):
+        os.remove(path)
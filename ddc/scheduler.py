@@ -0,0 +1,278 @@
+"""
+Scheduler
+---------
+
+Tools for splitting a grid in to work units and running them on a
+persistent pool of worker processes.
+
+Work units are sent to each worker over its own pipe, one chunk at a time,
+so the main process knows which chunk every worker has. A worker that
+exits while it has a chunk (i.e. a crash, or killed for memory) fails
+only that chunk, and is replaced.
+"""
+import traceback
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from time import monotonic
+
+import numpy as np
+
+ROW, COL = 0, 1
+
+class WorkUnitError (Exception):
+    """Raised (or returned) when a work unit fails in a worker"""
+
+class WorkUnitTimeout (WorkUnitError):
+    """Returned when a work unit did not finish in time (the worker was
+    stuck or crashed)
+    """
+
+def tile_cells (indices, shape, tile_shape):
+    """Group flattened grid cell indices into rectangular tiles (work
+    units). Tiles are returned in row major order.
+
+    Parameters
+    ----------
+    indices: np.array
+        flattened grid cell indices
+    shape: tuple
+        grid shape (rows, cols)
+    tile_shape: tuple
+        tile shape (rows, cols)
+
+    Yields
+    ------
+    np.array
+        (row, col) index for each cell in a tile, shape (n cells, 2)
+    """
+    rows, cols = np.unravel_index(np.asarray(indices), shape)
+    tiles_per_row = -(-shape[COL] // tile_shape[COL])
+    tile_ids = (rows // tile_shape[ROW]) * tiles_per_row + \
+        cols // tile_shape[COL]
+    order = np.argsort(tile_ids, kind='stable')
+    splits = np.where(np.diff(tile_ids[order]))[0] + 1
+    for tile in np.split(order, splits):
+        if len(tile) > 0:
+            yield np.stack([rows[tile], cols[tile]], axis=1)
+
+def tile_id (cells, shape, tile_shape):
+    """Get the id of the tile containing cells (from tile_cells). Tiles 
+    are numbered in row major order.
+
+    Parameters
+    ----------
+    cells: np.array
+        (row, col) index for each cell in a tile, shape (n cells, 2)
+    shape: tuple
+        grid shape (rows, cols)
+    tile_shape: tuple
+        tile shape (rows, cols)
+
+    Returns
+    -------
+    int
+    """
+    tiles_per_row = -(-shape[COL] // tile_shape[COL])
+    row, col = cells[0]
+    return int(
+        (row // tile_shape[ROW]) * tiles_per_row + col // tile_shape[COL]
+    )
+
+def _chunks (units, chunk_size):
+    """group work units in to lists of chunk_size units"""
+    chunk = []
+    for unit in units:
+        chunk.append(unit)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _run_chunk (function, chunk):
+    """run function on each unit of a chunk, errors are returned as
+    WorkUnitErrors, so one bad unit does not lose the rest of the chunk
+    """
+    results = []
+    for unit in chunk:
+        try:
+            results.append(function(unit))
+        except Exception:
+            results.append(WorkUnitError(traceback.format_exc()))
+    return results
+
+def _worker_loop (function, connection, initializer, initargs):
+    """run chunks of work units received on connection, until None is 
+    received
+    """
+    if initializer:
+        initializer(*initargs)
+    while True:
+        chunk = connection.recv()
+        if chunk is None:
+            break
+        connection.send(_run_chunk(function, chunk))
+
+class _Worker (object):
+    """A worker process, and the chunk of work units it is running
+
+    Parameters
+    ----------
+    function: function
+    initializer: function or None
+    initargs: tuple
+    """
+    def __init__ (self, function, initializer, initargs):
+        self.connection, child = Pipe()
+        self.process = Process(
+            target = _worker_loop, 
+            args = (function, child, initializer, initargs), daemon = True
+        )
+        self.process.start()
+        child.close()
+        self.chunk = None
+        self.deadline = None
+
+    def submit (self, chunk, timeout = None):
+        """send a chunk to the worker"""
+        self.chunk = chunk
+        self.deadline = monotonic() + timeout * len(chunk) if timeout \
+            else None
+        self.connection.send(chunk)
+
+    def receive (self):
+        """get the results of the chunk, None if the worker exited"""
+        try:
+            results = self.connection.recv()
+        except (EOFError, OSError):
+            return None
+        self.chunk = None
+        self.deadline = None
+        return results
+
+    def stop (self):
+        """ask the worker to exit"""
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def kill (self):
+        """end the worker process"""
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+def run_work_units (
+        function, units, num_process = 1, chunk_size = 1,
+        initializer = None, initargs = (), timeout = None
+    ):
+    """Run a function on work units with a persistent pool of workers.
+
+    Units are sent to the workers in chunks of chunk_size units, one 
+    chunk per worker at a time. The main process blocks while waiting 
+    for results, instead of spinning.
+
+    If a worker exits before returning the results of its chunk (i.e. it
+    crashed), the units of the chunk fail with a WorkUnitError, and a new 
+    worker is started. With a timeout, a worker that has not finished its
+    chunk timeout seconds per unit after it was sent is stopped, the units
+    of the chunk fail with a WorkUnitTimeout, and a new worker is started.
+    Other workers are not interrupted.
+
+    Parameters
+    ----------
+    function: function
+        module level function with a work unit as its only argument
+    units: iterable
+        work units
+    num_process: int, Defaults to 1
+        number of worker processes. If 1, units are run in this process.
+    chunk_size: int, Defaults to 1
+        number of work units sent to a worker at once
+    initializer: function, optional
+        called with initargs when each worker starts (or once, in
+        this process, if num_process is 1)
+    initargs: tuple
+        arguments for initializer
+    timeout: float, optional
+        seconds a work unit may take. Only used if num_process is more 
+        than 1
+
+    Yields
+    ------
+    unit, result
+        each work unit and the result of function for it, in the
+        order units are finished. result is a WorkUnitError if function
+        raised an exception or the worker exited, or a WorkUnitTimeout if
+        the unit did not finish in time.
+    """
+    chunks = _chunks(units, chunk_size)
+
+    if num_process == 1:
+        if initializer:
+            initializer(*initargs)
+        for chunk in chunks:
+            yield from zip(chunk, _run_chunk(function, chunk))
+        return
+
+    start_worker = lambda: _Worker(function, initializer, initargs)
+    workers = [start_worker() for _ in range(num_process)]
+    try:
+        for worker in workers:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            worker.submit(chunk, timeout)
+
+        while True:
+            busy = [w for w in workers if not w.chunk is None]
+            if not busy:
+                break
+            deadlines = [w.deadline for w in busy if not w.deadline is None]
+            wait_for = max(0, min(deadlines) - monotonic()) \
+                if deadlines else None
+            wait(
+                [w.connection for w in busy] + 
+                [w.process.sentinel for w in busy], 
+                wait_for
+            )
+
+            for worker in busy:
+                chunk = worker.chunk
+                if worker.connection.poll():
+                    results, timed_out = worker.receive(), False
+                elif not worker.process.is_alive():
+                    results, timed_out = None, False
+                elif not worker.deadline is None and \
+                        monotonic() >= worker.deadline:
+                    results, timed_out = None, True
+                else:
+                    continue
+
+                if results is None:
+                    worker.kill()
+                    if timed_out:
+                        error = WorkUnitTimeout(
+                            'work unit did not finish in %s seconds' % timeout
+                        )
+                    else:
+                        error = WorkUnitError(
+                            'worker process exited with code %s' % 
+                                worker.process.exitcode
+                        )
+                    results = [error] * len(chunk)
+                    index = workers.index(worker)
+                    workers[index] = worker = start_worker()
+
+                yield from zip(chunk, results)
+                chunk = next(chunks, None)
+                if not chunk is None:
+                    worker.submit(chunk, timeout)
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.process.join(1)
+            worker.kill()
@@ -0,0 +1,244 @@
+"""
+Scratch
+-------
+
+Pixel major (time contiguous) scratch storage for grids.
+
+TemporalGrids store data as [timestep, row, col], so the time series for
+a pixel is spread across the whole file. A PixelMajorStore keeps the same
+data as [tile row, tile col, row in tile, col in tile, timestep], so the
+time series of each pixel, and all of the pixels in a tile, are
+contiguous on disk.
+
+A store's metadata file is only written once its data has been copied 
+in (see PixelMajorStore.from_view), so stores left by a copy that was 
+interrupted are copied again instead of reused.
+"""
+import hashlib
+import os
+
+import numpy as np
+import yaml
+
+## memory used when converting to and from TemporalGrids
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+
+class PixelMajorStore (object):
+    """Tile chunked, pixel major, memory mapped storage for a grid.
+
+    Parameters
+    ----------
+    path: path
+        path to data file. Metadata is stored at path + '.yml'.
+    grid_shape: tuple
+        (rows, cols) of grid
+    num_timesteps: int
+        number of timesteps
+    tile_shape: tuple
+        (rows, cols) of tiles
+    dtype: str or np.dtype, Defaults to 'float32'
+    source: str, optional
+        digest of the data the store is copied from (see sample_digest).
+        Existing stores are only reused if it matches.
+    """
+    def __init__ (
+            self, path, grid_shape, num_timesteps, tile_shape,
+            dtype = 'float32', source = None
+        ):
+        self.path = path
+        self.grid_shape = tuple(int(i) for i in grid_shape)
+        self.num_timesteps = int(num_timesteps)
+        self.tile_shape = tuple(int(i) for i in tile_shape)
+        self.dtype = np.dtype(dtype)
+        self.source = source
+
+        tiles = [
+            -(-self.grid_shape[i] // self.tile_shape[i]) for i in range(2)
+        ]
+        shape = tuple(tiles) + self.tile_shape + (self.num_timesteps, )
+
+        self.reused = os.path.exists(path) and self._metadata() == \
+            self._load_metadata()
+        if not self.reused and os.path.exists(path + '.yml'):
+            os.remove(path + '.yml')
+        self.data = np.memmap(
+            path, dtype = self.dtype, shape = shape,
+            mode = 'r+' if self.reused else 'w+'
+        )
+
+    def _metadata (self):
+        """metadata dict"""
+        return {
+            'grid_shape': list(self.grid_shape),
+            'num_timesteps': self.num_timesteps,
+            'tile_shape': list(self.tile_shape),
+            'dtype': self.dtype.str,
+            'source': self.source,
+        }
+
+    def save_metadata (self):
+        """Write the data to disk, and then the metadata, marking the store
+        as complete so it can be reused.
+        """
+        self.data.flush()
+        with open(self.path + '.yml', 'w') as fd:
+            yaml.dump(self._metadata(), fd)
+
+    def _load_metadata (self):
+        """load existing metadata or None"""
+        try:
+            with open(self.path + '.yml', 'r') as fd:
+                return yaml.safe_load(fd)
+        except (IOError, yaml.YAMLError):
+            return None
+
+    def _index (self, cells):
+        """get index in to data for cells"""
+        rows, cols = np.asarray(cells).T
+        t_rows, t_cols = self.tile_shape
+        return rows // t_rows, cols // t_cols, rows % t_rows, cols % t_cols
+
+    def __getstate__ (self):
+        """stores are pickled (i.e. sent to worker processes) without 
+        their data, which is mapped again by path when unpickled
+        """
+        state = dict(self.__dict__)
+        state['data'] = self.data.shape
+        return state
+
+    def __setstate__ (self, state):
+        self.__dict__.update(state)
+        self.data = np.memmap(
+            self.path, dtype = self.dtype, shape = state['data'], mode = 'r+'
+        )
+
+    def read_cells (self, cells):
+        """Read the time series for many cells.
+
+        Parameters
+        ----------
+        cells: np.array
+            (row, col) index for each cell, shape (n cells, 2)
+
+        Returns
+        -------
+        np.array
+            timestep by cell
+        """
+        return np.array(self.data[self._index(cells)]).T
+
+    def write_cells (self, cells, values):
+        """Write the time series for many cells.
+
+        Parameters
+        ----------
+        cells: np.array
+            (row, col) index for each cell, shape (n cells, 2)
+        values: np.array
+            cell by timestep
+        """
+        self.data[self._index(cells)] = values
+
+    def flush (self):
+        """Write changes to disk"""
+        self.data.flush()
+
+    def _column_chunks (self):
+        """split tile columns in to chunks that fit in DEFAULT_CHUNK_BYTES
+        for a band of tile rows
+        """
+        n_tile_cols = self.data.shape[1]
+        band_bytes = self.num_timesteps * self.tile_shape[0] * \
+            self.tile_shape[1] * self.dtype.itemsize
+        per_chunk = max(1, DEFAULT_CHUNK_BYTES // band_bytes)
+        for start in range(0, n_tile_cols, per_chunk):
+            yield start, min(start + per_chunk, n_tile_cols)
+
+    def _iterate_blocks (self):
+        """yields (tile row, tile col start, tile col end, and
+        row and col slices in the grid) for every block of tiles
+        """
+        rows, cols = self.grid_shape
+        t_rows, t_cols = self.tile_shape
+        for t_row in range(self.data.shape[0]):
+            r_0 = t_row * t_rows
+            r_1 = min(r_0 + t_rows, rows)
+            for tc_0, tc_1 in self._column_chunks():
+                c_0 = tc_0 * t_cols
+                c_1 = min(tc_1 * t_cols, cols)
+                yield t_row, tc_0, tc_1, slice(r_0, r_1), slice(c_0, c_1)
+
+    def from_view (self, view):
+        """Copy data in to the store, in one streaming pass over blocks of
+        tiles. The metadata is saved when the copy is done.
+
+        Parameters
+        ----------
+        view: np.array
+            (timestep, row, col) data, i.e. from
+            calc_degree_days.grid_view
+        """
+        t_rows, t_cols = self.tile_shape
+        for t_row, tc_0, tc_1, rows, cols in self._iterate_blocks():
+            n_rows = rows.stop - rows.start
+            n_cols = cols.stop - cols.start
+            block = np.full(
+                (self.num_timesteps, n_rows, (tc_1 - tc_0) * t_cols),
+                np.nan, dtype = self.dtype
+            )
+            block[:, :, :n_cols] = view[:, rows, cols]
+            block = block.reshape(
+                self.num_timesteps, n_rows, tc_1 - tc_0, t_cols
+            )
+            self.data[t_row, tc_0:tc_1, :n_rows] = block.transpose(2, 1, 3, 0)
+        self.save_metadata()
+
+    def to_view (self, view):
+        """Copy data from the store, in one streaming pass over blocks of
+        tiles.
+
+        Parameters
+        ----------
+        view: np.array
+            (timestep, row, col) data, i.e. from
+            calc_degree_days.grid_view, that is written to
+        """
+        for t_row, tc_0, tc_1, rows, cols in self._iterate_blocks():
+            n_rows = rows.stop - rows.start
+            n_cols = cols.stop - cols.start
+            block = np.array(self.data[t_row, tc_0:tc_1, :n_rows])
+            block = block.transpose(3, 1, 0, 2).reshape(
+                self.num_timesteps, n_rows, -1
+            )
+            view[:, rows, cols] = block[:, :, :n_cols]
+
+    def remove (self):
+        """Close and delete the store files"""
+        del self.data
+        for path in (self.path, self.path + '.yml'):
+            if os.path.exists(path):
+                os.remove(path)
+
+def sample_digest (view):
+    """Digest of the shape, dtype, and first, middle, and last timesteps 
+    of data, to check that a store was copied from the same data without
+    reading all of it.
+
+    Parameters
+    ----------
+    view: np.array
+        (timestep, row, col) data, i.e. from calc_degree_days.grid_view, 
+        or a tiff_source.TiffSource
+
+    Returns
+    -------
+    str
+    """
+    digest = hashlib.sha1(
+        repr((tuple(view.shape), np.dtype(view.dtype).str)).encode()
+    )
+    num_timesteps = view.shape[0]
+    for timestep in sorted({0, num_timesteps // 2, num_timesteps - 1}):
+        values = np.ascontiguousarray(view[timestep, :, :])
+        digest.update(values.tobytes())
+    return digest.hexdigest()
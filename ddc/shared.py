@@ -0,0 +1,123 @@
+"""
+Shared
+------
+
+Arrays shared with worker processes by name, so workers do not need
+to inherit the main process's memory (the 'fork' start method), and the
+data is not copied when workers start.
+
+Memory mapped arrays (i.e. the grids of TemporalGrids) are shared by
+their file name, workers map the same file. Other arrays are copied once
+to a named block of shared memory, and copied back when released.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+class SharedArray (object):
+    """Picklable handle to an array that worker processes attach to
+    by name.
+
+    Parameters
+    ----------
+    array: np.array or np.memmap
+        a memmap should map its whole file from its offset (not a slice
+        of another memmap)
+    """
+    def __init__ (self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.filename = None
+        self.offset = 0
+        self.mode = 'r+'
+        self.shm_name = None
+        self._source = None
+        self._shm = None
+        self._array = None
+
+        if isinstance(array, np.memmap) and array.filename \
+                and array.mode in ('r', 'r+', 'w+') \
+                and array.flags.c_contiguous:
+            self.filename = array.filename
+            self.offset = array.offset
+            self.mode = 'r' if array.mode == 'r' else 'r+'
+        else:
+            self._shm = shared_memory.SharedMemory(
+                create = True, size = max(array.nbytes, 1)
+            )
+            self.shm_name = self._shm.name
+            self._array = np.ndarray(
+                self.shape, dtype = self.dtype, buffer = self._shm.buf
+            )
+            self._array[:] = array
+            self._source = array
+
+    def attach (self):
+        """Get the shared array, attaching to it if needed
+
+        Returns
+        -------
+        np.array or np.memmap
+        """
+        if self._array is None:
+            if self.filename:
+                self._array = np.memmap(
+                    self.filename, dtype = self.dtype, mode = self.mode,
+                    offset = self.offset, shape = self.shape
+                )
+            else:
+                self._shm = shared_memory.SharedMemory(name = self.shm_name)
+                self._array = np.ndarray(
+                    self.shape, dtype = self.dtype, buffer = self._shm.buf
+                )
+        return self._array
+
+    def release (self):
+        """Copy changes back to an array that was copied to shared memory
+        and free the shared memory. Only call this in the process that
+        created the handle, after the workers are done.
+        """
+        if not self._source is None:
+            self._source[:] = self._array
+            self._array = None
+            self._shm.close()
+            self._shm.unlink()
+            self._source = None
+        elif isinstance(self._array, np.memmap):
+            self._array.flush()
+        self._array = None
+
+    def __getstate__ (self):
+        state = dict(self.__dict__)
+        state.update(_source = None, _shm = None, _array = None)
+        return state
+
+def share (value):
+    """Get a SharedArray for arrays, other values are returned as is.
+
+    Parameters
+    ----------
+    value: object
+
+    Returns
+    -------
+    SharedArray or value
+    """
+    if isinstance(value, np.ndarray):
+        return SharedArray(value)
+    return value
+
+def attach (value):
+    """Attach to a SharedArray, other values are returned as is.
+
+    Parameters
+    ----------
+    value: object
+
+    Returns
+    -------
+    np.array or value
+    """
+    if isinstance(value, SharedArray):
+        return value.attach()
+    return value
@@ -5,34 +5,156 @@ Sort Functions
 Alternate sort functions
 
 """
+import glob
+import json
 import os
+import re
 
-MONTHS = ['{:02d}'.format(m) for m in range(1,13) ]          
+MONTHS = ['{:02d}'.format(m) for m in range(1,13) ]
 
-def sort_snap_files (files):
+## snap files are named ..._MM_YYYY.tif, i.e. ...01_1901.tif
+SNAP_PATTERN = r'(?P<month>\d{2})_(?P<year>\d{4})\.tif$'
+
+## date index cache is saved next to the input directory
+## as <directory>.date-index.json
+INDEX_CACHE_SUFFIX = '.date-index.json'
+
+class DateIndexError (Exception):
+    """Raised when files cannot be indexed by date, or the dates have gaps
+    or duplicates
+    """
+
+def build_date_index (files, pattern = SNAP_PATTERN):
+    """Index files by the year and month parsed from their names, and sort
+    them by date.
+
+    Parameters
+    ----------
+    files: list
+        unordered list of files
+    pattern: str, Defaults to SNAP_PATTERN
+        regular expression with 'year' and 'month' named groups, searched
+        for in each file name
+
+    Raises
+    ------
+    DateIndexError
+        if a file name does not match pattern, or the months are not
+        continuous (gaps or duplicates)
+
+    Returns
+    -------
+    list
+        (year, month, file) for each file, sorted by date
+    """
+    regex = re.compile(pattern)
+    index = []
+    unmatched = []
+    for file in files:
+        match = regex.search(os.path.split(file)[1])
+        if match is None:
+            unmatched.append(file)
+            continue
+        year, month = int(match.group('year')), int(match.group('month'))
+        index.append((year, month, file))
+    if unmatched:
+        raise DateIndexError(
+            '%i file names do not match %s, i.e. %s' % (
+                len(unmatched), pattern, unmatched[0]
+            )
+        )
+
+    index.sort()
+    problems = []
+    months = [year * 12 + month for year, month, file in index]
+    for idx in range(1, len(index)):
+        previous, current = index[idx - 1], index[idx]
+        step = months[idx] - months[idx - 1]
+        if step == 0:
+            problems.append('duplicate %i-%02i' % current[:2])
+        elif step > 1:
+            problems.append(
+                'gap between %i-%02i and %i-%02i' % 
+                    (previous[:2] + current[:2])
+            )
+    if problems:
+        raise DateIndexError(
+            '%i problems with file dates: %s' % (
+                len(problems), ', '.join(problems[:10])
+            )
+        )
+    return index
+
+def sort_snap_files (files, pattern = SNAP_PATTERN):
     """Sorts snap geotiff files by year then month.
 
     Parameters
     ----------
     files: list
         unordered list of files
-    
+    pattern: str, Defaults to SNAP_PATTERN
+        see build_date_index
+
+    Raises
+    ------
+    DateIndexError
+        see build_date_index
+
+    Returns
+    -------
+    ordered list of files
+    """
+    return [file for year, month, file in build_date_index(files, pattern)]
+
+def sorted_snap_directory (directory, pattern = SNAP_PATTERN, cache = True):
+    """Get the sorted snap geotiff files in a directory. The sorted index
+    is cached next to the directory (see INDEX_CACHE_SUFFIX) and reused
+    while the directory is unchanged, so the directory is not scanned
+    again.
+
+    Parameters
+    ----------
+    directory: path
+        directory of .tif files
+    pattern: str, Defaults to SNAP_PATTERN
+        see build_date_index
+    cache: bool, Defaults to True
+        if True, use and save the cached index
+
+    Raises
+    ------
+    DateIndexError
+        see build_date_index
+
     Returns
     -------
     ordered list of files
     """
+    directory = os.path.normpath(directory)
+    cache_file = directory + INDEX_CACHE_SUFFIX
+    modified = os.stat(directory).st_mtime
 
-    files = sorted(files)
+    if cache and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as fd:
+                cached = json.load(fd)
+            if cached['pattern'] == pattern and cached['modified'] == modified:
+                return [os.path.join(directory, f) for f in cached['files']]
+        except (IOError, ValueError, KeyError):
+            pass
 
-    year = int(os.path.split(files[0])[1][-8:-4])
+    files = sort_snap_files(
+        glob.glob(os.path.join(directory, '*.tif')), pattern
+    )
 
-    sorted_files = []
-    while len(sorted_files) < len(files):
-        for month in MONTHS:
-            for file in files:
-                search_area = os.path.split(file)[1]
-                if search_area.find(month + '_' + str(year)) != -1:
-                    sorted_files.append(file)
-                    break
-        year += 1
-    return sorted_files
+    if cache:
+        try:
+            with open(cache_file, 'w') as fd:
+                json.dump({
+                    'pattern': pattern,
+                    'modified': modified,
+                    'files': [os.path.split(f)[1] for f in files],
+                }, fd)
+        except IOError:
+            pass ## read only location, skip cache
+    return files
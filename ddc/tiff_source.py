@@ -0,0 +1,220 @@
+"""
+Tiff Source
+-----------
+
+Read monthly temperature data directly from a sorted list of GeoTIFF files,
+one spatial window (i.e. a work unit tile) at a time, instead of loading
+all of the files in to a TemporalGrid first. Or load all of the files in
+to a TemporalGrid with many reading threads.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+from dateutil.relativedelta import relativedelta
+
+DEFAULT_IO_THREADS = 4
+
+MASK_COMPARISONS = {
+    'eq': np.equal, 'ne': np.not_equal,
+    'lt': np.less, 'gt': np.greater,
+    'lte': np.less_equal, 'gte': np.greater_equal,
+}
+
+def mask_no_data (values, mask_val = None, mask_comp = 'eq'):
+    """Set no data values to np.nan, in place
+
+    Parameters
+    ----------
+    values: np.array
+        float values
+    mask_val: number, optional
+        no data value, if None nothing is masked
+    mask_comp: str, Defaults to 'eq'
+        key in MASK_COMPARISONS, values where
+        MASK_COMPARISONS[mask_comp](values, mask_val) are masked
+
+    Returns
+    -------
+    np.array
+        values
+    """
+    if not mask_val is None:
+        values[MASK_COMPARISONS[mask_comp](values, mask_val)] = np.nan
+    return values
+
+class TiffSource (object):
+    """Monthly data read on demand from GeoTIFF files. Supports the
+    parts of the TemporalGrid interface used by calc_degree_days:
+    config, convert_timesteps_to_julian_days, timestep_range,
+    reading a timestep (source[timestep]), and reading a window across
+    timesteps (source[:, r_0:r_1, c_0:c_1]).
+
+    Files are opened for each read, so sources can be shared with
+    worker processes.
+
+    Parameters
+    ----------
+    files: list
+        GeoTIFF files, sorted in time order
+    start_timestep: datetime.datetime
+        date of the first file
+    mask_val: number, optional
+        no data value, see mask_no_data
+    mask_comp: str, Defaults to 'eq'
+        see mask_no_data
+    delta_timestep: relativedelta, Defaults to 1 month
+    """
+    def __init__ (
+            self, files, start_timestep, mask_val = None, mask_comp = 'eq',
+            delta_timestep = relativedelta(months=1)
+        ):
+        self.files = list(files)
+        self.mask_val = mask_val
+        self.mask_comp = mask_comp
+        self.dtype = np.dtype('float32')
+
+        dataset = gdal.Open(self.files[0])
+        grid_shape = (dataset.RasterYSize, dataset.RasterXSize)
+        dataset = None
+
+        self.config = {
+            'grid_shape': grid_shape,
+            'num_timesteps': len(self.files),
+            'num_grids': len(self.files),
+            'start_timestep': start_timestep,
+            'delta_timestep': delta_timestep,
+            'grid_name_map': {
+                start_timestep + delta_timestep * idx: idx
+                    for idx in range(len(self.files))
+            },
+        }
+        self.shape = (len(self.files), ) + grid_shape
+
+    def timestep_range (self):
+        """list of timesteps"""
+        return list(self.config['grid_name_map'].keys())
+
+    def convert_timesteps_to_julian_days (self):
+        """Days since the first timestep for each timestep
+
+        Returns
+        -------
+        list
+        """
+        start = self.config['start_timestep']
+        return [(ts - start).days for ts in self.timestep_range()]
+
+    def read_file (self, index, rows = slice(None), cols = slice(None)):
+        """Read a window of one file
+
+        Parameters
+        ----------
+        index: int
+            index of file
+        rows, cols: slice
+            window to read
+
+        Returns
+        -------
+        np.array
+            2d masked window
+        """
+        r_0, r_1, _ = rows.indices(self.shape[1])
+        c_0, c_1, _ = cols.indices(self.shape[2])
+        dataset = gdal.Open(self.files[index])
+        values = dataset.GetRasterBand(1).ReadAsArray(
+            c_0, r_0, c_1 - c_0, r_1 - r_0
+        ).astype(self.dtype)
+        dataset = None
+        return mask_no_data(values, self.mask_val, self.mask_comp)
+
+    def read_window (self, rows, cols, timesteps = None):
+        """Read a window from many files
+
+        Parameters
+        ----------
+        rows, cols: slice
+            window to read
+        timesteps: list, optional
+            file indices to read, Defaults to all
+
+        Returns
+        -------
+        np.array
+            3d (timestep, row, col) masked window
+        """
+        if timesteps is None:
+            timesteps = range(len(self.files))
+        return np.array(
+            [self.read_file(idx, rows, cols) for idx in timesteps],
+            dtype = self.dtype
+        )
+
+    def load (
+            self, view, num_threads = DEFAULT_IO_THREADS, max_pending = None
+        ):
+        """Read every file in to view. Files are read by a pool of threads
+        (GDAL releases the GIL while reading), masked (see mask_no_data),
+        and written to view in order. At most max_pending files are read 
+        but not yet written, so memory use is bounded.
+
+        Parameters
+        ----------
+        view: np.array
+            (timestep, row, col) array (i.e. a memmap) to write to
+        num_threads: int, Defaults to DEFAULT_IO_THREADS
+            number of reading threads
+        max_pending: int, optional
+            max number of files read, or being read, but not written. 
+            Defaults to 2 * num_threads
+
+        Returns
+        -------
+        np.array
+            2d boolean grid, True for pixels with any valid (not masked,
+            or nan) data
+        """
+        if max_pending is None:
+            max_pending = 2 * num_threads
+        valid = np.zeros(self.shape[1:], dtype=bool)
+        def write (index, values):
+            view[index] = values
+            valid[np.isfinite(values)] = True
+
+        pending = deque()
+        with ThreadPoolExecutor(num_threads) as pool:
+            for idx in range(len(self.files)):
+                if len(pending) >= max_pending:
+                    jdx, future = pending.popleft()
+                    write(jdx, future.result())
+                pending.append((idx, pool.submit(self.read_file, idx)))
+            while pending:
+                jdx, future = pending.popleft()
+                write(jdx, future.result())
+        return valid
+
+    def __getitem__ (self, key):
+        """Read a timestep, or a (timestep, row, col) window"""
+        if isinstance(key, tuple):
+            timesteps, rows, cols = key
+            index = np.arange(len(self.files))[timesteps]
+            squeeze = tuple(
+                ax for ax, s in ((1, rows), (2, cols)) if isinstance(s, int)
+            )
+            rows, cols = [
+                slice(s, s + 1) if isinstance(s, int) else s
+                    for s in (rows, cols)
+            ]
+            values = self.read_window(rows, cols, np.atleast_1d(index))
+            if np.ndim(index) == 0:
+                squeeze = (0, ) + squeeze
+            return values.squeeze(axis = squeeze)
+        return self.read_file(self.config['grid_name_map'][key])
+
+    def __repr__ (self):
+        return 'TiffSource: %i files from %s' % (
+            len(self.files), os.path.dirname(self.files[0])
+        )
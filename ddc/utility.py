@@ -11,15 +11,18 @@ from dateutil.relativedelta import relativedelta
 
 import numpy as np
 
-from calc_degree_days import calc_grid_degree_days#, create_day_array
-from multigrids.tools import load_and_create, get_raster_metadata
+from calc_degree_days import calc_grid_degree_days, grid_view
+from calc_degree_days import select_cells_by_method
+from metrics import RunMetrics
+from prescreen import NEAR_ZERO, MIN_AMPLITUDE, MAX_NEAR_ZERO_FRACTION
+from multigrids.tools import get_raster_metadata
 from multigrids import TemporalGrid
 from spicebox import CLILib
 from __init__ import __version__
 
-from multiprocessing import Manager, Lock
 
-from sort import sort_snap_files
+from sort import sorted_snap_directory, DateIndexError, SNAP_PATTERN
+from tiff_source import TiffSource
 
 def create_or_load_dataset(
         data_path, grid_shape, num_years, start_year, name, raster_metadata
@@ -48,6 +51,73 @@ def create_or_load_dataset(
             grids[ts] = np.nan
     return grids
 
+def extend_dataset (data_path, num_timesteps, append_from = None):
+    """Extend an existing dataset to num_timesteps, new timesteps are 
+    added at the end and set to np.nan. 
+
+    append_from (the number of years before the dataset was first 
+    extended) is saved in the config as 'append-from', so a run that is
+    interrupted after extending the dataset can be resumed 
+    (see append_start). Datasets that were already extended are not 
+    changed.
+    """
+    old = TemporalGrid(data_path)
+    old_timesteps = old.grids.shape[0]
+    if old_timesteps == num_timesteps and \
+            old.config.get('append-from') == append_from:
+        return
+    grid_shape = old.config['grid_shape']
+    grids = TemporalGrid(
+        grid_shape[0], grid_shape[1], num_timesteps, 
+        start_timestep=old.config['start_timestep'],
+        mode='w+'
+    )
+    for key in ['raster_metadata', 'dataset_name', 'delta_timestep']:
+        if key in old.config:
+            grids.config[key] = old.config[key]
+    grids.config['degree-day-calculator-version'] = __version__
+    if not append_from is None:
+        grids.config['append-from'] = append_from
+    grids.grids[:] = np.nan
+    grids.grids[:old_timesteps] = old.grids
+    del old
+    grids.save(data_path)
+
+def append_start (data_path):
+    """Get the number of years in a dataset before new years are appended.
+    For a dataset extended by an unfinished append run this is the number
+    of years before it was extended (see extend_dataset).
+
+    Returns
+    -------
+    int
+    """
+    config = TemporalGrid(data_path).config
+    return config.get('append-from', config['num_timesteps'])
+
+def list_tiff_files (
+        directory, sort_method = 'default', pattern = SNAP_PATTERN
+    ):
+    """List the .tif files in a directory in time order.
+
+    Parameters
+    ----------
+    directory: path
+    sort_method: str, Defaults to 'default'
+        'default' to sort with pythons `sorted` function, or 'snap' to 
+        sort by the year and month in the file names (see 
+        sort.sorted_snap_directory)
+    pattern: str, Defaults to sort.SNAP_PATTERN
+        file name pattern for 'snap' sort_method
+
+    Returns
+    -------
+    list
+    """
+    if sort_method == 'snap':
+        return sorted_snap_directory(directory, pattern)
+    return sorted(glob.glob(os.path.join(directory, '*.tif')))
+
 def utility ():
     """Utility for calculating the freezing and thawing degree-days and saving
     them as tiffs. Uses as spline based method to find roots from monthly 
@@ -89,6 +159,9 @@ def utility ():
     --num-processes: int
         Optional, Default 1. Number of processes to use when calculating 
         degree-days. 
+    --chunk-size: int
+        Optional, Default 1. Number of work units (tiles, see --tile-size) 
+        sent to a process at once.
     --mask-val: int 
         Optional, Default None. Nodata value in input tiff data.    
     --mask-comp: 'eq','ne', 'lt', 'gt', 'lte', 'gte'
@@ -108,12 +181,133 @@ def utility ():
         snap uses a function that sorts the files named via snaps month/
         year naming  convention (...01_1901.tif, ...01_1902.tif, ..., 
         ...12_2005.tif, ...12_2006.tif) to year/month order.
+        Files are sorted by the year and month found with --date-pattern,
+        and the sorted list is cached next to the input directory 
+        (<directory>.date-index.json). Missing or duplicate months are 
+        reported before any processing.
+    --date-pattern: str
+        Optional, Default '(?P<month>\\d{2})_(?P<year>\\d{4})\\.tif$'. Regular
+        expression with 'year' and 'month' groups used to find the date 
+        in file names with --sort-method=snap.
+    --reprocess: bool
+        Optional, Default False. If True, recalculate the pixels selected 
+        with --reprocess-methods and --reprocess-region (and 
+        --recalc-mask-file) using the method map (methods.data.npy) in the 
+        logging directory from a previous run. Results are written in 
+        place to the fdd.yml, tdd.yml, and roots.yml multigrids of the 
+        previous run (created with --out-format=multigrid or both), other
+        pixels are not changed. Only the input for the selected pixels is
+        read from the tiff files (see --stream-input). Other flags (i.e. 
+        --method, --always-fallback) set how the pixels are recalculated.
+        Requires --out-format=multigrid or both, so the updated 
+        multigrids are kept.
+    --reprocess-methods: str
+        Optional. Comma separated method map values of the pixels to 
+        recalculate with --reprocess, i.e. "2,3". Defaults to all pixels.
+    --reprocess-region: str
+        Optional. "min row,min col,max row,max col" region of the pixels
+        to recalculate with --reprocess, max values are exclusive.
+    --append: bool
+        Optional, Default False. If True, extend the fdd.yml, tdd.yml, and
+        roots.yml multigrids of a previous run (created with 
+        --out-format=multigrid or both) with the new years in 
+        --in-temperature, which should have all of the years starting at
+        --start-year. Only the last years of the temperature data, starting 
+        --append-overlap years before the new years, are read and fit. 
+        The last year of the previous run is recalculated (its fdd was a 
+        copy of the year before), earlier years are not changed. The new
+        years are close to, but not the same as, a run over all of the 
+        years, because the spline is only fit to the window of years 
+        (roots near the start of the window can move). An interrupted 
+        --append run is resumed by running the same command again.
+        Requires --out-format=multigrid or both, so the extended 
+        multigrids are kept.
+    --append-overlap: int
+        Optional, Default 3. Number of years of the previous run fit with
+        the new years with --append.
+    --pixel-timing: bool
+        Optional, Default False. If True the calculation time for each pixel
+        is saved to pixel-seconds.data.npy in the logging directory. 
+        Metrics for each run (stage times, pixels per second, methods used,
+        worker utilization) are always saved to metrics.json and 
+        metrics.csv in the logging directory.
+    --pixel-budget: float
+        Optional. Seconds a pixel calculated with its own spline may take.
+        Pixels that take longer (i.e. a long search for a smoothing factor)
+        are calculated with the fallback windows on a linear curve through
+        the monthly values, and marked with 9 in the method map. Not 
+        available on windows.
+    --unit-timeout: float
+        Optional. Seconds a work unit (tile) may take, with 
+        --num-processes more than 1. Work units that do not finish in time
+        (the worker is stuck or crashed) are abandoned, and retried with the
+        linear method and fallback windows at the end of the run. Only the 
+        stuck worker is stopped. Their pixels are marked with 9 in the 
+        method map.
     --start-at: int
         Optional, Default 0. index to star-at on resuming processing
+        Runs that are interrupted are resumed from the completion journal
+        in the logging directory when run again with the same arguments,
+        without --start-at.
     --save-temp-monthly: bool
         Optional, Default False. If True save temporary monthly data state
     --always-fallback: bool
         Optional, Default False. If True fallback method is always used.
+    --prescreen: bool
+        Optional, Default False. If True pixels the spline method is 
+        predicted to fail for (no thawing or freezing season in a year, 
+        small annual cycle, or noisy near zero series) use the fallback 
+        method, with a shorter search for a smoothing factor. Values only
+        change for pixels that would have used the spline method.
+        The prescreen is a prediction: on synthetic grids with the default 
+        thresholds it catches nearly all of the pixels the spline method 
+        fails for, but about 6% of the pixels the spline method works for 
+        are also sent to the fallback method, and get fallback values. 
+        Raising --prescreen-max-near-zero-fraction or lowering 
+        --prescreen-min-amplitude sends fewer working pixels to the fallback 
+        method, but catches fewer failing pixels (i.e. 0.5 roughly halves the
+        working pixels sent, and misses about 8% of the failing pixels).
+    --prescreen-near-zero: float
+        Optional, Default 0.5. With --prescreen, monthly values with in this 
+        of 0 are near zero.
+    --prescreen-min-amplitude: float
+        Optional, Default 2.0. With --prescreen, pixels with a mean annual 
+        cycle smaller than this (max - min) are predicted to fail.
+    --prescreen-max-near-zero-fraction: float
+        Optional, Default 0.25. With --prescreen, pixels where more than this
+        fraction of the years without one thawing and one freezing season 
+        have near zero months are predicted to fail.
+    --method: "spline", "batch-spline", "windowed-spline", or "linear"
+        Optional, Default "spline". "spline" fits a spline to each pixel 
+        individually. "batch-spline" fits smoothing splines to tiles of 
+        pixels at once with shared basis matrices, pixels where this fails
+        are calculated with the "spline" method. "windowed-spline" is like
+        "batch-spline", but each year's degree-days come from a spline fit
+        to the 3 years around it, for long records.
+        The "batch-spline" and "windowed-spline" degree-days are close 
+        to, but not the same as, the "spline" results: the median 
+        difference is about 1% (10-15 degree-days) on synthetic grids, 
+        and up to about 100 degree-days for noisy, near zero pixels. 
+        Use ddc/verify.py to check them on a dataset.
+        "linear" treats the monthly values as a piecewise linear curve,
+        it is much faster, but not smoothed, for quick screening runs.
+    --tile-size: int
+        Optional, Default 32. Size (rows and cols) of the tiles (work units)
+        pixels are processed in.
+    --scratch-dir: path
+        Optional. If provided, temperature and results are copied to pixel 
+        major scratch files (each pixel's time series is contiguous) here 
+        while degree-days are calculated, and copied back at the end. 
+        Use with grids larger than memory.
+    --stream-input: bool
+        Optional, Default False. If True, and --in-temperature is a 
+        directory, the tiles of pixels being calculated are read directly 
+        from the tiff files when needed, instead of loading all of the 
+        tiff files in to a temporary multigrid
+        first.
+    --io-threads: int
+        Optional, Default 4. Number of threads used to read the tiff files 
+        when loading them in to a temporary multigrid.
 
     Examples
     --------
@@ -150,6 +344,8 @@ def utility ():
 
             "--num-processes": 
                 {'required': False, 'default': 1, 'type': int },
+            "--chunk-size": 
+                {'required': False, 'default': 1, 'type': int },
             '--mask-val':  ## still broken
                 {'required': False, 'type': int},
             '--mask-comp':
@@ -182,6 +378,39 @@ def utility ():
             '--save-temp-monthly':
                 {'required': False, 'type': bool, 'default': False },
             '--always-fallback':  {'required': False, 'type': bool, 'default': False },
+            '--prescreen':  {'required': False, 'type': bool, 'default': False },
+            '--prescreen-near-zero':
+                {'required': False, 'type': float, 'default': NEAR_ZERO },
+            '--prescreen-min-amplitude':
+                {'required': False, 'type': float, 'default': MIN_AMPLITUDE },
+            '--prescreen-max-near-zero-fraction':
+                {
+                    'required': False, 'type': float, 
+                    'default': MAX_NEAR_ZERO_FRACTION
+                },
+            '--method': 
+                {
+                    'required': False, 'type': str, 'default': 'spline',
+                    'accepted-values': [
+                        'spline', 'batch-spline', 'windowed-spline', 
+                        'linear'
+                    ]
+                },
+            '--tile-size': {'required': False, 'type': int, 'default': 32 },
+            '--scratch-dir': {'required': False, 'type': str },
+            '--stream-input':  {'required': False, 'type': bool, 'default': False },
+            '--io-threads': {'required': False, 'type': int, 'default': 4 },
+            '--date-pattern': 
+                {'required': False, 'type': str, 'default': SNAP_PATTERN },
+            '--reprocess':  {'required': False, 'type': bool, 'default': False },
+            '--reprocess-methods': {'required': False, 'type': str },
+            '--reprocess-region': {'required': False, 'type': str },
+            '--append':  {'required': False, 'type': bool, 'default': False },
+            '--append-overlap': 
+                {'required': False, 'type': int, 'default': 3 },
+            '--pixel-timing':  {'required': False, 'type': bool, 'default': False },
+            '--pixel-budget': {'required': False, 'type': float },
+            '--unit-timeout': {'required': False, 'type': float },
             
         }
 
@@ -195,13 +424,12 @@ def utility ():
     # sys.exit(0)
 
     verbosity = {'log':2, 'warn':1, '':0}[arguments['--verbose']]
+    run_metrics = RunMetrics()
     
     sort_method = "Using default sort function"
-    sort_fn = sorted
 
     if  arguments['--sort-method'].lower() == 'snap':
         sort_method = "Using SNAP sort function"
-        sort_fn = sort_snap_files
     elif arguments['--sort-method'].lower() != "default":
         print("invalid --sort-method option")
         print("run utility.py --help to see valid options")
@@ -239,6 +467,55 @@ def utility ():
                 pass
 
     start_year = int(arguments['--start-year'])
+    valid_mask = None
+
+    previous_methods = None
+    for update in ['--reprocess', '--append']:
+        if arguments[update] and \
+                not arguments['--out-format'] in ['multigrid', 'both']:
+            ## the multigrids are removed at the end of a tiff only run, 
+            ## which would remove the results being updated
+            print(update, 'requires --out-format=multigrid or both')
+            print("exiting")
+            return
+
+    if arguments['--reprocess'] or arguments['--append']:
+        ## results are recalculated in place, so the results of the 
+        ## previous run must have been saved as multigrids
+        previous = [
+            os.path.join(out_fdd, 'fdd.yml'),
+            os.path.join(out_tdd, 'tdd.yml'),
+            os.path.join(out_roots, 'roots.yml'),
+        ]
+        if arguments['--reprocess']:
+            previous.append(os.path.join(logging_dir, 'methods.data.npy'))
+        missing = [f for f in previous if not os.path.isfile(f)]
+        if missing:
+            print('Cannot update, previous results are missing:')
+            for f in missing:
+                print('\t', f)
+            print("exiting")
+            return
+
+    if arguments['--reprocess']:
+        previous_methods = np.load(
+            os.path.join(logging_dir, 'methods.data.npy')
+        )
+        codes = None
+        if arguments['--reprocess-methods']:
+            codes = [
+                int(c) for c in arguments['--reprocess-methods'].split(',')
+            ]
+        region = None
+        if arguments['--reprocess-region']:
+            region = [
+                int(v) for v in arguments['--reprocess-region'].split(',')
+            ]
+        reprocess_mask = select_cells_by_method(
+            previous_methods, codes, region
+        )
+        if verbosity >= 2:
+            print('\t reprocessing %i pixels' % reprocess_mask.sum())
 
     num_processes = int(arguments['--num-processes'])
     
@@ -248,11 +525,41 @@ def utility ():
         print(monthly_temps)
         num_years = monthly_temps.config['num_timesteps'] // 12
         raster_metadata  = monthly_temps.config['raster_metadata'] 
+    elif arguments['--stream-input'] or arguments['--reprocess'] \
+            or arguments['--append']:
+        try:
+            with run_metrics.stage('sort-input'):
+                files = list_tiff_files(
+                    arguments['--in-temperature'], 
+                    arguments['--sort-method'].lower(), 
+                    arguments['--date-pattern']
+                )
+        except DateIndexError as error:
+            print('Cannot sort input files:', error)
+            print("exiting")
+            return
+        num_years = len(files) // 12
+        monthly_temps = TiffSource(
+            files[:num_years * 12], datetime(arguments['--start-year'],1,1), 
+            arguments['--mask-val'], arguments['--mask-comp']
+        )
+        raster_metadata = get_raster_metadata(files[0])
+        monthly_temps.config['raster_metadata'] = raster_metadata
+        if verbosity >= 2:
+            print('\t', monthly_temps)
     else:
-        num_years = len(
-            glob.glob(os.path.join(arguments['--in-temperature'],'*.tif')) 
-        ) 
-        num_years = num_years // 12
+        try:
+            with run_metrics.stage('sort-input'):
+                files = list_tiff_files(
+                    arguments['--in-temperature'], 
+                    arguments['--sort-method'].lower(), 
+                    arguments['--date-pattern']
+                )
+        except DateIndexError as error:
+            print('Cannot sort input files:', error)
+            print("exiting")
+            return
+        num_years = len(files) // 12
 
         years = [start_year + yr for yr in range(num_years)]
 
@@ -261,13 +568,6 @@ def utility ():
             for mn in range(1,13):
                 temporal_grid_keys.append('%d-%02d' % (yr,mn) ) 
         # print(glob.glob(arguments['--in-temperature']))
-        load_params = {
-                "method": "tiff",
-                "directory": arguments['--in-temperature'],
-                "sort_func": sort_fn,
-                "verbose": True if verbosity >= 2 else False,
-                "filename": 'temp-in-temperature.data',
-            }
         create_params = {
             "name": "monthly temperatures",
             "grid_names": temporal_grid_keys,
@@ -276,33 +576,23 @@ def utility ():
             
         }
 
-        monthly_temps = load_and_create(load_params, create_params)
+        source = TiffSource(
+            files[:num_years * 12], create_params['start_timestep'],
+            arguments['--mask-val'], arguments['--mask-comp']
+        )
+        monthly_temps = TemporalGrid(
+            source.shape[1], source.shape[2], source.shape[0], 
+            mode='w+', **create_params
+        )
+        if verbosity >= 2:
+            print('\t loading', source)
+        with run_metrics.stage('load-input'):
+            valid_mask = source.load(
+                grid_view(monthly_temps), arguments['--io-threads']
+            )
         
-        ex_raster = glob.glob(
-                os.path.join(arguments['--in-temperature'],'*.tif')
-            )[0]
-        raster_metadata = get_raster_metadata(ex_raster)
+        raster_metadata = get_raster_metadata(files[0])
         monthly_temps.config['raster_metadata'] = raster_metadata
-
-        if not arguments['--mask-val'] is None:
-            mask = arguments['--mask-val']
-            if arguments['--mask-comp']   == 'eq':
-                no_data_idx =     monthly_temps.grids == mask
-            elif arguments['--mask-comp'] == 'ne':
-                no_data_idx =     monthly_temps.grids != mask
-            elif arguments['--mask-comp'] == 'lt':
-                no_data_idx =     monthly_temps.grids < mask
-            elif arguments['--mask-comp'] == 'gt':
-                no_data_idx =     monthly_temps.grids > mask
-            elif arguments['--mask-comp'] == 'lte':
-                no_data_idx =     monthly_temps.grids <= mask
-            elif arguments['--mask-comp'] == 'gte':
-                no_data_idx =     monthly_temps.grids >= mask   
-            # elif arguments['--mask-comp'] == 'map':
-            #     no_data_idx = monthly_temps.grids == 0          
-            monthly_temps.grids[no_data_idx] = np.nan
-
-        
             
         monthly_temps.config['num_timesteps'] = \
             monthly_temps.config['num_grids']
@@ -312,9 +602,32 @@ def utility ():
     recalc_mask = None
     if not arguments['--recalc-mask-file'] is None:
         recalc_mask = np.load(arguments['--recalc-mask-file']).astype(int) == 1
+    if arguments['--reprocess']:
+        recalc_mask = reprocess_mask if recalc_mask is None \
+            else recalc_mask & reprocess_mask
     
     grid_shape = monthly_temps.config['grid_shape']
 
+    append_from = None
+    if arguments['--append']:
+        ## tdd is extended after fdd, and before roots, so it has the 
+        ## number of years before an unfinished append run extended them
+        append_from = append_start(os.path.join(out_tdd, 'tdd.yml'))
+        if num_years <= append_from:
+            print('No new years to append, exiting')
+            return
+        if verbosity >= 2:
+            print('\t appending %i years' % (num_years - append_from))
+        extend_dataset(
+            os.path.join(out_fdd, 'fdd.yml'), num_years, append_from
+        )
+        extend_dataset(
+            os.path.join(out_tdd, 'tdd.yml'), num_years, append_from
+        )
+        extend_dataset(
+            os.path.join(out_roots, 'roots.yml'), num_years * 2, append_from
+        )
+
     fdd = create_or_load_dataset(
         os.path.join(out_fdd, 'fdd.yml'), 
         grid_shape, 
@@ -350,12 +663,10 @@ def utility ():
     #      ] 
     # )
 
-    manager = Manager()  
-    log = manager.dict() 
-    log.update(
-        {'Element Messages': manager.list() , 'Spline Errors': manager.list()}
-    )
-    log['verbose'] = verbosity
+    ## workers log to their own files, see run_log
+    log = {
+        'Element Messages': [], 'Spline Errors': [], 'verbose': verbosity
+    }
 
     try:
         os.makedirs(logging_dir)
@@ -381,6 +692,25 @@ def utility ():
         logging_dir=logging_dir,
         use_fallback=arguments['--always-fallback'],
         recalc_mask = recalc_mask,
+        method = arguments['--method'],
+        tile_shape = (arguments['--tile-size'], arguments['--tile-size']),
+        chunk_size = arguments['--chunk-size'],
+        use_prescreen = arguments['--prescreen'],
+        prescreen_options = {
+            'near_zero': arguments['--prescreen-near-zero'],
+            'min_amplitude': arguments['--prescreen-min-amplitude'],
+            'max_near_zero_fraction': 
+                arguments['--prescreen-max-near-zero-fraction'],
+        },
+        scratch_dir = arguments['--scratch-dir'],
+        valid_mask = valid_mask,
+        previous_methods = previous_methods,
+        append_from = append_from,
+        append_overlap = arguments['--append-overlap'],
+        run_metrics = run_metrics,
+        pixel_timing = arguments['--pixel-timing'],
+        pixel_budget = arguments['--pixel-budget'],
+        unit_timeout = arguments['--unit-timeout'],
     )
     # calc_grid_degree_days(
     #         days, 
@@ -395,22 +725,20 @@ def utility ():
     #         logging_dir = logging_dir
     #     )
 
-    for item in log["Spline Errors"]:
-        words = item.split(' ')
-        location = int(words[-1])
-        print ( grid_shape)
-        row, col = np.unravel_index(location, grid_shape)  
+    ## the append is finished, the key is saved with the multigrids
+    for grids in [fdd, tdd, roots]:
+        grids.config.pop('append-from', None)
 
-        msg = ' '.join(words[:-1])
-        msg += ' at row:' + str(row) + ', col:' + str(col) + '.'
-        print(msg)
+    for row, col, msg in log["Spline Errors"]:
+        print(msg + ' at row:' + str(row) + ', col:' + str(col) + '.')
 
     # print(flags)
     if arguments['--out-format'] in ['tiff', 'both']:
-        tdd.save_all_as_geotiff(out_tdd)
-        fdd.save_all_as_geotiff(out_fdd)
-        if out_roots != flags['--out-roots']['default']:
-            roots.save_all_as_geotiff(out_roots)
+        with run_metrics.stage('export-tiff'):
+            tdd.save_all_as_geotiff(out_tdd)
+            fdd.save_all_as_geotiff(out_fdd)
+            if out_roots != flags['--out-roots']['default']:
+                roots.save_all_as_geotiff(out_roots)
     
     if arguments['--out-format'] == 'tiff':
         os.remove(os.path.join(out_tdd, 'tdd.yml'))
@@ -442,14 +770,18 @@ def utility ():
         tdd.config['command-used-to-create'] = ' '.join(sys.argv)
         roots.config['command-used-to-create'] = ' '.join(sys.argv)
         # print(os.path.join(out_fdd, 'fdd.yml'))
-        fdd.save(os.path.join(out_fdd, 'fdd.yml'))
-        tdd.save(os.path.join(out_tdd, 'tdd.yml'))
-        roots.save(os.path.join(out_roots, 'roots.yml'))
+        with run_metrics.stage('export-multigrid'):
+            fdd.save(os.path.join(out_fdd, 'fdd.yml'))
+            tdd.save(os.path.join(out_tdd, 'tdd.yml'))
+            roots.save(os.path.join(out_roots, 'roots.yml'))
 
     if not arguments['--save-temp-monthly']:
         for file in glob.glob('temp-monthly-temperature-data.*'):
             os.remove(file)
 
+    ## again, with the export stages
+    run_metrics.write(logging_dir)
+
 ## fix this
 
 # calculating degree days for element 53670. ~57.12% complete.
@@ -0,0 +1,556 @@
+"""
+Verify
+------
+
+Check the results of a degree-day method against the reference per cell
+spline (degree_days_for_series, as used by calc_degree_days_for_cell) on a
+sample of series. Samples are pixels picked at random or stratified by the
+method map of an earlier run, or named locations from a csv of monthly
+temperatures (i.e. method-failure-locations-rcp45.csv).
+
+The report has the largest and mean differences of tdd, fdd, and roots for
+each year, the values outside the tolerances, and the series where the
+methods disagree (the spline was used by one method and the fallback by
+the other).
+
+Flags
+-----
+--in-temperature: path
+    Required. Monthly temperature multigrid (.yml, i.e. saved with
+    --save-temp-monthly) or a csv of monthly temperatures for named
+    locations (first column "YYYY-MM", one column per location)
+--method: str
+    Optional, Default "batch-spline". Method to verify, "spline",
+    "batch-spline", "windowed-spline", or "linear"
+--sample-method: str
+    Optional, Default "random". How pixels are picked from a multigrid,
+    "random" or "stratified" (an even share of pixels for each method map
+    value, requires --method-map)
+--sample-size: int
+    Optional, Default 200. Number of pixels
+--method-map: path
+    Optional. methods.data.npy from the logging directory of a run
+--seed: int
+    Optional, Default 0. Random seed for sample
+--tolerance: float
+    Optional, Default 1.0. Allowed difference of tdd and fdd
+    (degree-days) and roots (days)
+--relative-tolerance: float
+    Optional, Default 0.01. Allowed difference of tdd and fdd, as a
+    fraction of the reference value, added to --tolerance
+--prescreen: bool
+    Optional, Default False. If True the method is run with the prescreen
+--prescreen-near-zero, --prescreen-min-amplitude, 
+--prescreen-max-near-zero-fraction: float
+    Optional, prescreen thresholds, see ddc/utility.py
+
+Exits with status 1 if any value is outside the tolerances.
+
+Example
+-------
+python ddc/verify.py --in-temperature=method-failure-locations-rcp45.csv
+    --method=windowed-spline
+"""
+import csv
+import sys
+import warnings
+from datetime import datetime
+
+import numpy as np
+from spicebox import CLILib
+
+try:
+    from multigrids import temporal_grid
+except ImportError:
+    from .multigrids import temporal_grid
+TemporalGrid = temporal_grid.TemporalGrid
+
+try:
+    from . import calc_degree_days as cdd
+    from .metrics import METHOD_NAMES
+    from . import prescreen
+except ImportError:
+    import calc_degree_days as cdd
+    from metrics import METHOD_NAMES
+    import prescreen
+
+VARIABLES = ['tdd', 'fdd', 'roots']
+
+## method map values where the spline (or the candidate method's
+## equivalent) was used for every year, other values used the fallback
+## for some or all years
+SPLINE_CODES = (1, 5, 7)
+
+DEFAULT_TOLERANCE = 1.0
+DEFAULT_RELATIVE_TOLERANCE = 0.01
+
+def random_cells (shape, size, method_map = None, seed = 0):
+    """Pick pixels at random
+
+    Parameters
+    ----------
+    shape: tuple
+        (rows, cols) of grid
+    size: int
+        number of pixels, all pixels are used if there are fewer
+    method_map: np.array, optional
+        if provided only pixels with a method (not nan) are picked
+    seed: int, Defaults to 0
+
+    Returns
+    -------
+    np.array
+        (row, col) index for each pixel, shape (n cells, 2)
+    """
+    if method_map is None:
+        candidates = np.indices(shape).reshape(2, -1).T
+    else:
+        candidates = np.argwhere(~np.isnan(method_map))
+    rng = np.random.default_rng(seed)
+    size = min(size, len(candidates))
+    picked = rng.choice(len(candidates), size, replace = False)
+    return candidates[np.sort(picked)]
+
+def stratified_cells (method_map, size, seed = 0):
+    """Pick pixels at random with an even share for each method map value,
+    so rare methods (i.e. fallback after the spline failed) are checked.
+
+    Parameters
+    ----------
+    method_map: np.array
+    size: int
+        number of pixels, fewer are picked if a method has less than
+        its share
+    seed: int, Defaults to 0
+
+    Returns
+    -------
+    np.array
+        (row, col) index for each pixel, shape (n cells, 2)
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.unique(method_map[~np.isnan(method_map)])
+    if len(codes) == 0:
+        return np.zeros((0, 2), dtype=int)
+    share = int(np.ceil(size / len(codes)))
+    picked = []
+    for code in codes:
+        candidates = np.argwhere(method_map == code)
+        count = min(share, len(candidates))
+        picked.append(
+            candidates[rng.choice(len(candidates), count, replace = False)]
+        )
+    cells = np.concatenate(picked)
+    return cells[np.lexsort((cells[:, 1], cells[:, 0]))]
+
+def load_locations (path):
+    """Load monthly temperatures for named locations from a csv. The first
+    row has the location names, and the first column the "YYYY-MM" of
+    each month (see method-failure-locations-rcp45.csv).
+
+    Parameters
+    ----------
+    path: path
+
+    Returns
+    -------
+    names: list
+    timesteps: list
+        datetime of each month
+    temps: np.array
+        temperatures, timestep by location
+    """
+    with open(path, 'r') as fd:
+        rows = [row for row in csv.reader(fd) if row]
+    names = [name.strip() for name in rows[0][1:]]
+    timesteps = [
+        datetime.strptime(row[0].strip(), '%Y-%m') for row in rows[1:]
+    ]
+    temps = np.array([
+        [float(v) if v.strip() else np.nan for v in row[1:]]
+            for row in rows[1:]
+    ])
+    return names, timesteps, temps
+
+def reference_degree_days (temps, days, num_years, windows):
+    """Calculate degree days for each series with its own spline
+    (degree_days_for_series), the way calc_degree_days_for_cell does.
+    Missing values are skipped.
+
+    Parameters
+    ----------
+    temps: np.array
+        temperatures, timestep by series
+    days: list like
+        day number for each temperature value.
+    num_years: int
+    windows: dict
+        fallback season windows
+
+    Returns
+    -------
+    dict
+        'tdd', 'fdd', 'roots', and 'method', like
+        calc_degree_days.degree_days_for_cells
+    """
+    n_series = temps.shape[1]
+    results = {
+        'tdd': np.full((n_series, num_years), np.nan),
+        'fdd': np.full((n_series, num_years), np.nan),
+        'roots': np.full((n_series, 2 * num_years), np.nan),
+        'method': np.full(n_series, np.nan),
+    }
+    days = np.asarray(days)
+    for idx in range(n_series):
+        finite = np.isfinite(temps[:, idx])
+        if finite.sum() <= cdd.batch_spline.DEGREE:
+            continue
+        tdd_temp, fdd_temp, roots_temp, method = cdd.degree_days_for_series(
+            days[finite], temps[finite, idx], num_years, windows
+        )
+        results['tdd'][idx] = tdd_temp
+        results['fdd'][idx] = fdd_temp
+        results['roots'][idx] = roots_temp
+        results['method'][idx] = method
+    results['fdd'] = cdd.fix_last_winter(results['fdd'])
+    return results
+
+def outside_tolerance (reference, candidate, tolerance, relative = 0):
+    """Find values outside a tolerance. Values that are missing in only
+    one of the results are outside the tolerance.
+
+    Parameters
+    ----------
+    reference, candidate: np.array
+    tolerance: float
+        allowed absolute difference
+    relative: float, Defaults to 0
+        allowed difference as a fraction of the reference value, added
+        to tolerance
+
+    Returns
+    -------
+    np.array
+        bool, True where values are outside tolerance
+    """
+    ref_nan, can_nan = np.isnan(reference), np.isnan(candidate)
+    with np.errstate(invalid = 'ignore'):
+        outside = np.abs(candidate - reference) > \
+            tolerance + relative * np.abs(reference)
+    return (outside & ~ref_nan & ~can_nan) | (ref_nan != can_nan)
+
+def compare_results (
+        labels, reference, candidate, tolerance = DEFAULT_TOLERANCE,
+        relative = DEFAULT_RELATIVE_TOLERANCE
+    ):
+    """Compare the results of a method to the reference results
+
+    Parameters
+    ----------
+    labels: list
+        label of each series, i.e. (row, col) or a location name
+    reference, candidate: dict
+        'tdd', 'fdd', 'roots', and 'method' results for the series
+    tolerance: float, Defaults to DEFAULT_TOLERANCE
+        allowed difference of tdd, fdd (degree-days) and roots (days)
+    relative: float, Defaults to DEFAULT_RELATIVE_TOLERANCE
+        allowed difference of tdd and fdd as a fraction of the reference
+        value, added to tolerance
+
+    Returns
+    -------
+    dict
+        'series': number of series,
+        'differences': for each variable, 'max' and 'mean' absolute
+            difference for each year (each root for 'roots'),
+        'violations': list of (label, variable, index, reference value,
+            candidate value),
+        'disagreements': list of (label, reference method, candidate
+            method), where the spline was used by only one of the methods
+    """
+    report = {
+        'series': len(labels), 'differences': {},
+        'violations': [], 'disagreements': [],
+    }
+    for variable in VARIABLES:
+        ref, can = reference[variable], candidate[variable]
+        diff = np.abs(can - ref)
+        with warnings.catch_warnings():
+            ## years without values in any series are nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            report['differences'][variable] = {
+                'max': np.nanmax(diff, axis = 0, initial = np.nan),
+                'mean': np.nanmean(diff, axis = 0),
+            }
+        rel = 0 if variable == 'roots' else relative
+        for idx, year in np.argwhere(
+                outside_tolerance(ref, can, tolerance, rel)
+            ):
+            report['violations'].append(
+                (labels[idx], variable, int(year), ref[idx, year],
+                    can[idx, year])
+            )
+
+    ref_spline = np.isin(reference['method'], SPLINE_CODES)
+    can_spline = np.isin(candidate['method'], SPLINE_CODES)
+    ref_none = np.isnan(reference['method'])
+    can_none = np.isnan(candidate['method'])
+    disagree = (ref_spline != can_spline) | (ref_none != can_none)
+    for idx in np.where(disagree)[0]:
+        report['disagreements'].append(
+            (labels[idx], reference['method'][idx], candidate['method'][idx])
+        )
+    return report
+
+def verify_series (
+        labels, temps, days, num_years, windows, method = 'batch-spline',
+        tolerance = DEFAULT_TOLERANCE, relative = DEFAULT_RELATIVE_TOLERANCE,
+        use_prescreen = False, cells = None, prescreen_options = None
+    ):
+    """Verify a method on a sample of series
+
+    Parameters
+    ----------
+    labels: list
+        label of each series
+    temps: np.array
+        temperatures, timestep by series
+    days: list like
+        day number for each temperature value.
+    num_years: int
+    windows: dict
+        fallback season windows
+    method: str, Defaults to 'batch-spline'
+        method for calc_degree_days.degree_days_for_cells
+    tolerance, relative: float
+        see compare_results
+    use_prescreen: bool, Defaults to False
+        if True the method is run with the prescreen
+    cells: np.array, optional
+        (row, col) index for each series. Series seed the search for a 
+        smoothing factor with the factors of their neighbors (see 
+        calc_degree_days.find_smoothing_factor). If not provided, each 
+        series gets an index with no neighbors in the sample.
+    prescreen_options: dict, optional
+        prescreen thresholds, see calc_degree_days.degree_days_for_cells
+
+    Returns
+    -------
+    dict
+        see compare_results, with the 'method' verified
+    """
+    reference = reference_degree_days(temps, days, num_years, windows)
+    if cells is None:
+        cells = np.zeros((len(labels), 2), dtype=int)
+        cells[:, 0] = 2 * np.arange(len(labels))
+    candidate = cdd.degree_days_for_cells(
+        cells, temps, days, num_years, windows, method,
+        use_prescreen = use_prescreen, prescreen_options = prescreen_options
+    )
+    report = compare_results(
+        labels, reference, candidate, tolerance, relative
+    )
+    report['method'] = method
+    return report
+
+def verify_grid (monthly_temps, cells, method = 'batch-spline', **kwargs):
+    """Verify a method on a sample of pixels from a monthly
+    temperature grid (see random_cells and stratified_cells)
+
+    Parameters
+    ----------
+    monthly_temps: TemporalGrid
+    cells: np.array
+        (row, col) index for each pixel, shape (n cells, 2)
+    method: str, Defaults to 'batch-spline'
+    **kwargs:
+        see verify_series
+
+    Returns
+    -------
+    dict
+        see compare_results
+    """
+    windows = cdd.fallback_windows(monthly_temps)
+    ## pixels are read one at a time, the block containing a sample 
+    ## spread over the grid is most of the grid
+    temps = np.full(
+        (monthly_temps.config['num_timesteps'], len(cells)), np.nan
+    )
+    for idx in range(len(cells)):
+        temps[:, idx] = cdd.read_cells(monthly_temps, cells[idx:idx + 1])[:, 0]
+    return verify_series(
+        [tuple(int(i) for i in cell) for cell in cells], temps,
+        monthly_temps.convert_timesteps_to_julian_days(),
+        len(windows['tdd']), windows, method, cells = cells, **kwargs
+    )
+
+def verify_locations (path, method = 'batch-spline', **kwargs):
+    """Verify a method on the named locations in a csv (see
+    load_locations)
+
+    Parameters
+    ----------
+    path: path
+    method: str, Defaults to 'batch-spline'
+    **kwargs:
+        see verify_series
+
+    Returns
+    -------
+    dict
+        see compare_results
+    """
+    names, timesteps, temps = load_locations(path)
+    windows = cdd.season_windows(timesteps)
+    days = [(ts - timesteps[0]).days for ts in timesteps]
+    return verify_series(
+        names, temps, days, len(windows['tdd']), windows, method, **kwargs
+    )
+
+def format_report (report, max_lines = 20):
+    """Format a report as text
+
+    Parameters
+    ----------
+    report: dict
+        from compare_results
+    max_lines: int, Defaults to 20
+        violations and disagreements listed, the rest are counted
+
+    Returns
+    -------
+    str
+    """
+    name = lambda code: 'none' if np.isnan(code) else \
+        METHOD_NAMES.get(int(code), str(code))
+    lines = ['Method: %s, series: %i' % (
+        report.get('method', ''), report['series']
+    )]
+    lines.append('%-6s %12s %12s %12s' % (
+        'value', 'max diff', 'mean diff', 'worst index'
+    ))
+    for variable in VARIABLES:
+        diff = report['differences'][variable]
+        if np.isnan(diff['max']).all():
+            lines.append('%-6s %12s' % (variable, 'no values'))
+            continue
+        lines.append('%-6s %12.3f %12.3f %12i' % (
+            variable, np.nanmax(diff['max']), np.nanmean(diff['mean']),
+            np.nanargmax(diff['max'])
+        ))
+
+    lines.append('%i values outside tolerance' % len(report['violations']))
+    counts = {}
+    for violation in report['violations']:
+        counts[violation[0]] = counts.get(violation[0], 0) + 1
+    for label, count in sorted(counts.items(), key = lambda c: -c[1]):
+        lines.append('    %s: %i' % (label, count))
+    if report['violations']:
+        lines.append('first values outside tolerance:')
+    for label, variable, year, ref, can in \
+            report['violations'][:max_lines]:
+        lines.append('    %s %s[%i]: reference %.3f, method %.3f' % (
+            label, variable, year, ref, can
+        ))
+    lines.append('%i method disagreements' % len(report['disagreements']))
+    for label, ref, can in report['disagreements'][:max_lines]:
+        lines.append('    %s: reference %s, method %s' % (
+            label, name(ref), name(can)
+        ))
+    return '\n'.join(lines)
+
+def main ():
+    """verify utility"""
+    try:
+        arguments = CLILib.CLI({
+            '--in-temperature': {'required': True, 'type': str},
+            '--method':
+                {
+                    'required': False, 'type': str,
+                    'default': 'batch-spline',
+                    'accepted-values': [
+                        'spline', 'batch-spline', 'windowed-spline',
+                        'linear'
+                    ]
+                },
+            '--sample-method':
+                {
+                    'required': False, 'type': str, 'default': 'random',
+                    'accepted-values': ['random', 'stratified']
+                },
+            '--sample-size': {'required': False, 'type': int, 'default': 200},
+            '--method-map': {'required': False, 'type': str},
+            '--seed': {'required': False, 'type': int, 'default': 0},
+            '--tolerance':
+                {
+                    'required': False, 'type': float,
+                    'default': DEFAULT_TOLERANCE
+                },
+            '--relative-tolerance':
+                {
+                    'required': False, 'type': float,
+                    'default': DEFAULT_RELATIVE_TOLERANCE
+                },
+            '--prescreen': {'required': False, 'type': bool, 'default': False},
+            '--prescreen-near-zero':
+                {
+                    'required': False, 'type': float,
+                    'default': prescreen.NEAR_ZERO
+                },
+            '--prescreen-min-amplitude':
+                {
+                    'required': False, 'type': float,
+                    'default': prescreen.MIN_AMPLITUDE
+                },
+            '--prescreen-max-near-zero-fraction':
+                {
+                    'required': False, 'type': float,
+                    'default': prescreen.MAX_NEAR_ZERO_FRACTION
+                },
+        })
+    except (CLILib.CLILibHelpRequestedError, CLILib.CLILibMandatoryError) as E:
+        print (E)
+        print(__doc__)
+        return 0
+
+    options = {
+        'tolerance': arguments['--tolerance'],
+        'relative': arguments['--relative-tolerance'],
+        'use_prescreen': arguments['--prescreen'],
+        'prescreen_options': {
+            'near_zero': arguments['--prescreen-near-zero'],
+            'min_amplitude': arguments['--prescreen-min-amplitude'],
+            'max_near_zero_fraction': 
+                arguments['--prescreen-max-near-zero-fraction'],
+        },
+    }
+    path = arguments['--in-temperature']
+    if path.endswith('.csv'):
+        report = verify_locations(path, arguments['--method'], **options)
+    else:
+        monthly_temps = TemporalGrid(path)
+        method_map = None
+        if arguments['--method-map']:
+            method_map = np.load(arguments['--method-map'])
+        if arguments['--sample-method'] == 'stratified':
+            if method_map is None:
+                print('--sample-method=stratified requires --method-map')
+                return 1
+            cells = stratified_cells(
+                method_map, arguments['--sample-size'], arguments['--seed']
+            )
+        else:
+            cells = random_cells(
+                monthly_temps.config['grid_shape'],
+                arguments['--sample-size'], method_map, arguments['--seed']
+            )
+        report = verify_grid(
+            monthly_temps, cells, arguments['--method'], **options
+        )
+
+    print(format_report(report))
+    return 1 if report['violations'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
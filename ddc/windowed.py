@@ -0,0 +1,159 @@
+"""
+Windowed
+--------
+
+Windowed spline method. Instead of one spline for the whole time series,
+a batch spline (see batch_spline) is fit to a short window of years
+around each year, and only that year's thawing season and the freezing
+season after it are taken from it. Years are independent, so fit cost
+grows linearly with the length of the record, and a noisy year only
+affects the years near it. Years where the window's spline does not have
+a thawing season starting in the year, ending before the next year, and
+followed by a freezing season ending before the year after that, use the
+fallback method.
+"""
+import numpy as np
+
+try:
+    from . import batch_spline, piecewise
+except ImportError:
+    import batch_spline, piecewise
+
+WINDOW_YEARS = 3
+MONTHS_PER_YEAR = 12
+
+def year_windows (num_years, window_years = WINDOW_YEARS):
+    """Get the window of years fit for each year. Windows are centered on
+    the year, and shifted at the start and end of the record so all
+    windows have window_years years.
+
+    Parameters
+    ----------
+    num_years: int
+    window_years: int, Defaults to WINDOW_YEARS
+
+    Returns
+    -------
+    list
+        (first year, end year) of window for each year, end is exclusive
+    """
+    window_years = min(window_years, num_years)
+    windows = []
+    for year in range(num_years):
+        first = min(max(0, year - window_years // 2), num_years - window_years)
+        windows.append((first, first + window_years))
+    return windows
+
+def create_bases (
+        days, num_years, window_years = WINDOW_YEARS,
+        smoothing = batch_spline.DEFAULT_SMOOTHING
+    ):
+    """Create the shared batch spline basis for each window.
+
+    Parameters
+    ----------
+    days: np.array
+        day number for each timestep
+    num_years: int
+    window_years: int, Defaults to WINDOW_YEARS
+    smoothing: float, Defaults to batch_spline.DEFAULT_SMOOTHING
+
+    Returns
+    -------
+    dict
+        basis (see batch_spline.create_basis) with days relative to the
+        start of the window, keyed by (first year, end year)
+    """
+    days = np.asarray(days, dtype=float)
+    bases = {}
+    for first, end in set(year_windows(num_years, window_years)):
+        window_days = days[first * MONTHS_PER_YEAR:end * MONTHS_PER_YEAR]
+        bases[(first, end)] = batch_spline.create_basis(
+            window_days - window_days[0], smoothing
+        )
+    return bases
+
+def windowed_degree_days (
+        temps, days, num_years, windows, bases, window_years = WINDOW_YEARS,
+        use_fallback = None
+    ):
+    """Calculate degree days for many pixels with the windowed spline
+    method.
+
+    Parameters
+    ----------
+    temps: np.array
+        temperatures, timestep by pixel, without missing values
+    days: np.array
+        day number for each timestep
+    num_years: int
+    windows: dict
+        fallback season windows, from calc_degree_days.fallback_windows
+    bases: dict
+        from create_bases
+    window_years: int, Defaults to WINDOW_YEARS
+    use_fallback: np.array, optional
+        boolean array, pixels to use the fallback method for every year
+
+    Returns
+    -------
+    tdd: np.array
+        pixel by year
+    fdd: np.array
+        pixel by year. The last year is a dummy or partial value
+    roots: np.array
+        pixel by 2 * num_years
+    fallback: np.array
+        boolean array, pixel by year, True for years where the fallback
+        method was used
+    """
+    days = np.asarray(days, dtype=float)
+    n_pixels = temps.shape[1]
+    if use_fallback is None:
+        use_fallback = np.zeros(n_pixels, dtype=bool)
+    tdd = np.full((n_pixels, num_years), np.nan)
+    fdd = np.full((n_pixels, num_years), np.nan)
+    roots = np.full((n_pixels, num_years, 2), np.nan)
+    fallback = np.zeros((n_pixels, num_years), dtype=bool)
+
+    for year, (first, end) in enumerate(year_windows(num_years, window_years)):
+        months = slice(first * MONTHS_PER_YEAR, end * MONTHS_PER_YEAR)
+        offset = days[months][0]
+        coefficients = batch_spline.fit_splines(
+            bases[(first, end)], temps[months]
+        )
+        pp = piecewise.from_bspline(bases[(first, end)], coefficients)
+        year_roots, counts = piecewise.find_roots(pp)
+
+        season = windows['tdd'][year] - offset
+        ## seasons must end before the next years' windows start
+        limits = np.append(
+            windows['tdd'][year + 1:year + 3, 0], [np.inf, np.inf]
+        )[:2] - offset
+        y_tdd, y_fdd, y_roots, success = piecewise.season_degree_days(
+            pp, year_roots, counts, season, limits
+        )
+        ## the freezing season after the last year is never complete
+        if year < num_years - 1:
+            success &= ~np.isnan(y_fdd)
+        success &= ~use_fallback
+
+        failed = ~success
+        if failed.any():
+            f_tdd, f_fdd, f_roots = piecewise.fallback_degree_days(
+                piecewise.select(pp, failed), year_roots[failed], 
+                counts[failed], {
+                    'tdd': windows['tdd'][year:year + 1] - offset,
+                    'fdd': windows['fdd'][year:year + 1] - offset,
+                }
+            )
+            y_tdd[failed] = f_tdd[:, 0]
+            y_fdd[failed] = f_fdd[:, 0]
+            y_roots[failed] = f_roots
+
+        tdd[:, year] = y_tdd
+        fdd[:, year] = y_fdd
+        roots[:, year] = np.sign(y_roots) * (np.abs(y_roots) + offset)
+        fallback[:, year] = failed
+
+    return tdd, fdd, roots.reshape(n_pixels, 2 * num_years), fallback
@@ -0,0 +1,67 @@
+"""
+Tests for ddc.journal
+"""
+from ddc import journal
+
+HEADER = {'grid_shape': [10, 10], 'tile_shape': [2, 2], 'selection': 'abc'}
+
+def test_resume (tmp_path):
+    path = str(tmp_path / 'journal.txt')
+    first = journal.CompletionJournal(path, HEADER)
+    for unit_id in [3, 1, 4]:
+        first.add(unit_id)
+    first.close()
+
+    resumed = journal.CompletionJournal(path, HEADER)
+    assert len(resumed) == 3
+    assert 4 in resumed and not 5 in resumed
+    resumed.close()
+
+def test_resume_after_truncated_last_line (tmp_path):
+    path = str(tmp_path / 'journal.txt')
+    first = journal.CompletionJournal(path, HEADER)
+    first.add(12)
+    first.add(345)
+    first.close()
+
+    ## a crash while writing the last id leaves part of the line
+    with open(path, 'r') as fd:
+        text = fd.read()
+    with open(path, 'w') as fd:
+        fd.write(text[:-3])
+
+    resumed = journal.CompletionJournal(path, HEADER)
+    assert resumed.completed == {12}
+    resumed.add(345)
+    resumed.close()
+
+    assert journal.CompletionJournal(path, HEADER).completed == {12, 345}
+
+def test_other_run_replaces_journal (tmp_path):
+    path = str(tmp_path / 'journal.txt')
+    first = journal.CompletionJournal(path, HEADER)
+    first.add(1)
+    first.close()
+
+    other = dict(HEADER, selection = 'def')
+    assert len(journal.CompletionJournal(path, other)) == 0
+    assert len(journal.CompletionJournal(path, HEADER)) == 0
+
+def test_selection_digest ():
+    assert journal.selection_digest([1, 2, 3]) == \
+        journal.selection_digest([1, 2, 3])
+    assert journal.selection_digest([1, 2, 3]) != \
+        journal.selection_digest([1, 2, 4])
+
+def test_truncated_header (tmp_path):
+    path = str(tmp_path / 'journal.txt')
+    journal.CompletionJournal(path, HEADER).close()
+    with open(path, 'r') as fd:
+        text = fd.read()
+    with open(path, 'w') as fd:
+        fd.write(text[:-1])
+
+    first = journal.CompletionJournal(path, HEADER)
+    first.add(7)
+    first.close()
+    assert journal.CompletionJournal(path, HEADER).completed == {7}
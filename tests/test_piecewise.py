@@ -0,0 +1,82 @@
+"""
+Tests for ddc.piecewise, checked against scipy's splines
+"""
+import numpy as np
+import pytest
+from scipy import interpolate
+
+from ddc import piecewise
+
+def monthly_spline (seed = 0, num_years = 5):
+    """a smoothing spline through noisy monthly temperatures, like
+    calc_degree_days.calc_degree_days_for_cell fits
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(12 * num_years) * 30.4 + 15
+    temps = 12 * np.sin(2 * np.pi * (days - 100) / 365) - 2 + \
+        rng.normal(0, 1, len(days))
+    return interpolate.UnivariateSpline(days, temps)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_find_roots_matches_scipy (seed):
+    spline = monthly_spline(seed)
+    roots, counts = piecewise.find_roots(piecewise.from_spline(spline))
+    expected = spline.roots()
+
+    assert counts[0] == len(expected)
+    np.testing.assert_allclose(roots[0], expected, atol = 1e-6)
+    np.testing.assert_allclose(spline(roots[0]), 0, atol = 1e-6)
+
+def test_find_roots_many_pixels ():
+    splines = [monthly_spline(seed) for seed in range(3)]
+    pp = {
+        'breaks': piecewise.from_spline(splines[0])['breaks'],
+        'coefficients': np.concatenate([
+            piecewise.from_spline(s)['coefficients'] for s in splines
+        ], axis = 2)
+    }
+    roots, counts = piecewise.find_roots(pp)
+    for idx, spline in enumerate(splines):
+        expected = spline.roots()
+        assert counts[idx] == len(expected)
+        np.testing.assert_allclose(
+            roots[idx, :counts[idx]], expected, atol = 1e-6
+        )
+        assert np.isnan(roots[idx, counts[idx]:]).all()
+
+def test_integrate_matches_scipy ():
+    spline = monthly_spline()
+    pp = piecewise.from_spline(spline)
+    a = np.array([[15, 100, 400.5, -50]])
+    b = np.array([[200, 380, 1700, 3000]])
+
+    expected = [spline.integral(lo, hi) for lo, hi in zip(a[0], b[0])]
+    np.testing.assert_allclose(
+        piecewise.integrate(pp, a, b)[0], expected, rtol = 1e-9, atol = 1e-6
+    )
+
+def test_integrate_between_roots_has_one_sign ():
+    spline = monthly_spline()
+    pp = piecewise.from_spline(spline)
+    roots, counts = piecewise.find_roots(pp)
+    areas = piecewise.integrate(pp, roots[:, :-1], roots[:, 1:])[0]
+    signs = np.sign(areas)
+
+    assert (signs[1:] == -signs[:-1]).all()
+
+def test_from_samples_is_linear_interpolation ():
+    x = np.arange(0, 120, 10.)
+    values = np.stack([np.sin(x / 20), np.cos(x / 20) - 0.5], axis = 1)
+    pp = piecewise.from_samples(x, values)
+    roots, counts = piecewise.find_roots(pp)
+
+    for idx in range(2):
+        found = roots[idx, :counts[idx]]
+        np.testing.assert_allclose(
+            np.interp(found, x, values[:, idx]), 0, atol = 1e-12
+        )
+    trapezoids = (values[1:] + values[:-1]) / 2 * np.diff(x)[:, np.newaxis]
+    np.testing.assert_allclose(
+        piecewise.integrate(pp, np.full((2, 1), x[0]), np.full((2, 1), x[-1])),
+        trapezoids.sum(axis = 0)[:, np.newaxis]
+    )
@@ -0,0 +1,82 @@
+"""
+Tests for ddc.scheduler
+"""
+import os
+import time
+
+import numpy as np
+
+from ddc import scheduler
+
+def square (unit):
+    return os.getpid(), unit ** 2
+
+def stuck_or_slow_square (unit):
+    """unit 3 never finishes, the others take a moment"""
+    time.sleep(60 if unit == 3 else 0.5)
+    return square(unit)
+
+def crash_or_square (unit):
+    """unit 3 kills its worker"""
+    if unit == 3:
+        os._exit(1)
+    return square(unit)
+
+def fail_or_square (unit):
+    if unit == 3:
+        raise ValueError('bad unit')
+    return square(unit)
+
+def test_tile_cells ():
+    shape, tile_shape = (5, 7), (2, 3)
+    indices = np.arange(35)
+    tiles = list(scheduler.tile_cells(indices, shape, tile_shape))
+
+    assert len(tiles) == 9
+    assert sum(len(tile) for tile in tiles) == 35
+    for number, tile in enumerate(tiles):
+        assert scheduler.tile_id(tile, shape, tile_shape) == number
+        assert len(set(map(tuple, tile // tile_shape))) == 1
+
+def test_run_work_units ():
+    results = dict(
+        scheduler.run_work_units(square, range(10), 3, chunk_size = 2)
+    )
+    assert {unit: value for unit, (pid, value) in results.items()} == \
+        {unit: unit ** 2 for unit in range(10)}
+    assert not os.getpid() in [pid for pid, value in results.values()]
+
+def test_error_only_fails_unit ():
+    results = dict(
+        scheduler.run_work_units(fail_or_square, range(6), 2, chunk_size = 3)
+    )
+    assert isinstance(results[3], scheduler.WorkUnitError)
+    assert 'bad unit' in str(results[3])
+    assert [results[unit][1] for unit in [0, 1, 2, 4, 5]] == [0, 1, 4, 16, 25]
+
+def test_dead_worker_is_replaced ():
+    results = dict(scheduler.run_work_units(crash_or_square, range(8), 2))
+    assert type(results[3]) is scheduler.WorkUnitError
+    assert [results[unit][1] for unit in range(8) if unit != 3] == \
+        [unit ** 2 for unit in range(8) if unit != 3]
+
+def test_timeout_replaces_only_stuck_worker ():
+    start = time.monotonic()
+    results = list(scheduler.run_work_units(
+        stuck_or_slow_square, range(10), 2, timeout = 2
+    ))
+    assert time.monotonic() - start < 30
+
+    units = [unit for unit, result in results]
+    stuck = units.index(3)
+    assert isinstance(results[stuck][1], scheduler.WorkUnitTimeout)
+    assert sorted(units) == list(range(10))
+    assert [result[1] for unit, result in results if unit != 3] == \
+        [unit ** 2 for unit in units if unit != 3]
+
+    ## the worker that was not stuck kept running, and the stuck one was 
+    ## replaced by a new worker
+    before = {result[0] for unit, result in results[:stuck]}
+    after = {result[0] for unit, result in results[stuck + 1:]}
+    assert len(before & after) == 1
+    assert len(after - before) == 1
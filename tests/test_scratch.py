@@ -0,0 +1,71 @@
+"""
+Tests for ddc.scratch
+"""
+import pickle
+
+import numpy as np
+
+from ddc import scratch
+
+def grid (seed = 0, shape = (7, 5, 9)):
+    return np.random.default_rng(seed).normal(size = shape).astype('float32')
+
+def test_round_trip (tmp_path):
+    view = grid()
+    store = scratch.PixelMajorStore(
+        str(tmp_path / 'temps.data'), view.shape[1:], view.shape[0], (2, 4)
+    )
+    store.from_view(view)
+
+    copy = np.zeros_like(view)
+    store.to_view(copy)
+    np.testing.assert_array_equal(copy, view)
+
+    cells = np.array([[0, 0], [4, 8], [3, 5]])
+    np.testing.assert_array_equal(
+        store.read_cells(cells), view[:, cells[:, 0], cells[:, 1]]
+    )
+
+def test_write_cells_and_pickle (tmp_path):
+    view = grid()
+    store = scratch.PixelMajorStore(
+        str(tmp_path / 'temps.data'), view.shape[1:], view.shape[0], (3, 3)
+    )
+    store.from_view(view)
+    cells = np.array([[1, 2], [4, 0]])
+    store.write_cells(cells, np.ones((2, view.shape[0])))
+    store.flush()
+
+    ## workers get the store by path
+    copy = pickle.loads(pickle.dumps(store))
+    np.testing.assert_array_equal(copy.read_cells(cells), 1)
+
+def test_reused_only_after_copy (tmp_path):
+    view = grid()
+    path = str(tmp_path / 'temps.data')
+    digest = scratch.sample_digest(view)
+    args = (view.shape[1:], view.shape[0], (2, 2))
+
+    ## interrupted before the copy finished
+    assert not scratch.PixelMajorStore(path, *args, source = digest).reused
+    assert not scratch.PixelMajorStore(path, *args, source = digest).reused
+
+    scratch.PixelMajorStore(path, *args, source = digest).from_view(view)
+    store = scratch.PixelMajorStore(path, *args, source = digest)
+    assert store.reused
+    copy = np.zeros_like(view)
+    store.to_view(copy)
+    np.testing.assert_array_equal(copy, view)
+
+    other = scratch.sample_digest(grid(seed = 1))
+    assert not scratch.PixelMajorStore(path, *args, source = other).reused
+
+def test_sample_digest ():
+    view = grid()
+    changed = view.copy()
+    changed[-1, 2, 2] += 1
+
+    assert scratch.sample_digest(view) == scratch.sample_digest(view.copy())
+    assert scratch.sample_digest(view) != scratch.sample_digest(changed)
+    assert scratch.sample_digest(view) != \
+        scratch.sample_digest(view.astype('float64'))
@@ -0,0 +1,51 @@
+"""
+Tests for ddc.shared
+"""
+import pickle
+from multiprocessing import Process
+
+import numpy as np
+
+from ddc import shared
+
+def fill (data, value):
+    """worker: write value to a pickled shared array"""
+    handle = pickle.loads(data)
+    array = handle.attach()
+    array[:] = value
+    if isinstance(array, np.memmap):
+        array.flush()
+
+def test_shared_memory ():
+    array = np.zeros((3, 4))
+    handle = shared.share(array)
+    assert not handle.shm_name is None
+
+    process = Process(target = fill, args = (pickle.dumps(handle), 5))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    ## copied back when released
+    assert (array == 0).all()
+    handle.release()
+    assert (array == 5).all()
+
+def test_memmap_shared_by_file (tmp_path):
+    array = np.memmap(
+        str(tmp_path / 'grid.data'), dtype = 'float32', mode = 'w+',
+        shape = (2, 3)
+    )
+    handle = shared.share(array)
+    assert handle.filename == array.filename
+    assert handle.shm_name is None
+
+    process = Process(target = fill, args = (pickle.dumps(handle), 7))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert (array == 7).all()
+
+def test_other_values_unchanged ():
+    assert shared.share(3) == 3
+    assert shared.attach('text') == 'text'
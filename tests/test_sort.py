@@ -0,0 +1,51 @@
+"""
+Tests for ddc.sort
+"""
+import pytest
+
+from ddc import sort
+
+def snap_files (years, months = range(1, 13)):
+    return [
+        'data/tas_mean_C_%02i_%i.tif' % (month, year)
+            for year in years for month in months
+    ]
+
+def test_build_date_index_sorts_by_date ():
+    files = snap_files([1902, 1901])
+    index = sort.build_date_index(files[::-1])
+
+    assert [(y, m) for y, m, f in index] == \
+        [(y, m) for y in [1901, 1902] for m in range(1, 13)]
+    assert index[0][2] == 'data/tas_mean_C_01_1901.tif'
+    assert sort.sort_snap_files(files) == [f for y, m, f in index]
+
+def test_build_date_index_gap ():
+    files = snap_files([1901, 1902])
+    files.remove('data/tas_mean_C_07_1901.tif')
+
+    with pytest.raises(sort.DateIndexError, match = 'gap'):
+        sort.build_date_index(files)
+
+def test_build_date_index_duplicate ():
+    files = snap_files([1901]) + ['other/tas_mean_C_03_1901.tif']
+
+    with pytest.raises(sort.DateIndexError, match = 'duplicate 1901-03'):
+        sort.build_date_index(files)
+
+def test_build_date_index_unmatched ():
+    files = snap_files([1901]) + ['data/readme.txt']
+
+    with pytest.raises(sort.DateIndexError, match = 'do not match'):
+        sort.build_date_index(files)
+
+def test_sorted_snap_directory_cache (tmp_path):
+    directory = tmp_path / 'monthly'
+    directory.mkdir()
+    for name in snap_files([1901]):
+        (directory / name.split('/')[1]).write_text('')
+
+    first = sort.sorted_snap_directory(str(directory))
+    assert (tmp_path / ('monthly' + sort.INDEX_CACHE_SUFFIX)).exists()
+    assert sort.sorted_snap_directory(str(directory)) == first
+    assert first[0].endswith('tas_mean_C_01_1901.tif')